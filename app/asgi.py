@@ -0,0 +1,354 @@
+"""
+Async serving mode
+
+Serves the interaction endpoint on an asyncio server with non-blocking database and
+HTTP access, so a stalled webhook or query only holds up its own interaction instead
+of a whole worker. Run with::
+
+    gunicorn "asgi:create_app()" --preload -k uvicorn.workers.UvicornWorker -b 0.0.0.0:9200
+
+Starring and the settings share their logic with the blocking mode through :mod:`handlers`,
+the guide doesn't do any I/O and runs unchanged. The webhook setup route is only served
+by the blocking mode.
+"""
+import asyncio
+import json
+import logging
+from functools import lru_cache
+from time import monotonic
+
+import delivery
+import handlers
+import metrics
+import retention
+import tracing
+from bot import app as flask_app
+from bot import IDEMPOTENT, discord
+from bot import create_app as create_flask_app
+from flask_discord_interactions import Context, DiscordInteractions
+from flask_discord_interactions.discord import InteractionType, ResponseType
+from flask_discord_interactions.models.message import Message
+from http_client import RateLimited, close_async_client, get_async_client
+from nacl.exceptions import BadSignatureError
+from nacl.signing import VerifyKey
+from resources import aiodatabase, guilds, interactions, leaderboard, messages
+from resources.storage import get_backend
+from scheduler import scheduler
+from translations import set_locale, t
+
+# deferred followups still running, so they aren't garbage collected
+_followups = set()
+
+
+async def star(ctx: Context, data: dict) -> Message:
+    """Message starring context menu command"""
+    message = ctx.target
+    guild = await guilds.get_async(ctx.guild_id)
+    error = handlers.star_error(ctx, message, guild, flask_app.config["DISCORD_CLIENT_ID"])
+    if error is not None:
+        return error
+    if not await messages.insert_async(handlers.new_message(ctx, message), star_user=ctx.author.id):
+        return Message(t("errors.message_exists"), ephemeral=True)
+    return handlers.star_message(ctx, message, data)
+
+
+async def star_button(ctx: Context, data: dict) -> Message:
+    """Star button handler"""
+    message_id = data["data"]["custom_id"].split("\n")[1]
+    guild = await guilds.get_async(ctx.guild_id)
+    error = handlers.star_button_error(ctx, message_id, guild)
+    if error is not None:
+        return error
+    embeds = data["message"]["embeds"]
+    build_post = handlers.post_builder(ctx, guild, message_id, embeds)
+    result = await messages.star_async(message_id, ctx.author.id, guild.required_stars, build_post=build_post)
+    if result.claimed:
+        metrics.STARBOARD_POSTS.inc(ctx.guild_id)
+        if guild.delete_own_messages:
+            # persisted tasks are written with the blocking pool
+            await asyncio.to_thread(scheduler.schedule, "delete_original", 1, url=ctx.followup_url("@original"))
+        delivery.deliverer.wake()
+        logging.info("A message with the id %s was queued for the Starboard in guild %s.", message_id, ctx.guild_id)
+    return handlers.star_button_message(ctx, message_id, embeds, result)
+
+
+async def settings(ctx: Context, data: dict) -> Message:
+    """Set up starboard."""
+    options = {option["name"]: option["value"] for option in data["data"].get("options", [])}
+    guild = await guilds.get_async(ctx.guild_id)
+    changes = handlers.settings_changes(
+        guild, options.get("stars"), options.get("allow_self_stars"), options.get("delete_message")
+    )
+    if changes:
+        await guilds.update_async(guild, **changes)
+    return handlers.settings_message(guild)
+
+
+async def leaderboard_command(ctx: Context, _data: dict) -> Message:
+    """Show the most starred messages and users of this server."""
+    return handlers.leaderboard_message(ctx, await leaderboard.get_async(ctx.guild_id))
+
+
+COMMANDS = {"Star message": star, "settings": settings, "leaderboard": leaderboard_command}
+HANDLERS = {"star": star_button}
+
+
+async def run(name: str, func, data: dict):
+    """
+    Runs an async command or handler and records how long it took
+    """
+    with handlers.measured(discord.timings, name, data):
+        return await func(Context.from_data(discord, flask_app, data), data)
+
+
+async def run_with_deadline(name: str, func, data: dict, started: float, update: bool) -> Message:
+    """
+    Runs an async command or handler, answering with a deferred response if it misses the deadline
+
+    :param str name: Name of the command or custom id of the handler
+    :param func: The command or handler
+    :param dict data: Incoming interaction data
+    :param float started: Monotonic time the interaction was received at
+    :param bool update: Whether the deferred response updates the clicked message
+    :return: The handler's result or a deferred response
+    """
+    budget = handlers.remaining(started)
+    task = asyncio.create_task(run(name, func, data))
+    if discord.timings.expected(name) < budget:
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), budget)
+        except asyncio.TimeoutError:
+            pass
+    followup = asyncio.create_task(finish_deferred(task, data))
+    _followups.add(followup)
+    followup.add_done_callback(_followups.discard)
+    return handlers.deferred(name, update)
+
+
+async def finish_deferred(task: asyncio.Task, data: dict) -> None:
+    """
+    Sends the result of a deferred command or handler through the followup endpoint
+    """
+    try:
+        followup = handlers.followup_body(data, result=await task)
+    except Exception as error:  # pylint: disable=broad-except
+        followup = handlers.followup_body(data, error=error)
+    if followup is None:
+        return
+    client = get_async_client()
+    try:
+        for method, url, kwargs in handlers.followup_requests(data, flask_app.config["DISCORD_CLIENT_ID"], *followup):
+            for delay in handlers.followup_delays():
+                await asyncio.sleep(delay)
+                response = await client.request(method, url, **kwargs)
+                if response.status != 404:
+                    break
+            response.raise_for_status()
+    except RateLimited as error:
+        logging.warning("Dropped the deferred response of interaction %s: %s", data["id"], error)
+    except Exception:  # pylint: disable=broad-except
+        logging.exception("Failed to send the deferred response of interaction %s", data["id"])
+
+
+def primary_id(data: dict) -> str:
+    """
+    :return: The custom id of a component without the handler's arguments
+    """
+    return data["data"]["custom_id"].split("\n", 1)[0]
+
+
+async def handle_interaction(data: dict, started: float) -> bytes:
+    """
+    Dispatches an interaction once, duplicates get the response of the first one
+
+    :raises InteractionPending: In case a duplicate's response isn't there before the deadline
+    :return: The serialized response
+    """
+    if data.get("type") not in IDEMPOTENT:
+        return await dispatch(data, started)
+    try:
+        duplicate = await interactions.claim_async(data["id"], handlers.remaining(started))
+    except interactions.InteractionPending:
+        metrics.DUPLICATE_INTERACTIONS.inc("pending")
+        raise
+    if duplicate is not None:
+        return handlers.answer_duplicate(data["id"], duplicate).encode()
+    try:
+        body = await dispatch(data, started)
+    except BaseException:
+        await interactions.release_async(data["id"])
+        raise
+    response = body.decode()
+    if interactions.storable(response):
+        await interactions.store_async(data["id"], response)
+    else:
+        # oversized responses aren't kept, their duplicates run again
+        await interactions.release_async(data["id"])
+    return body
+
+
+async def dispatch(data: dict, started: float) -> bytes:
+    """
+    Dispatches an interaction to its command or handler
+
+    :return: The serialized response
+    """
+    set_locale(data.get("locale"))
+    interaction_type = data.get("type")
+    if interaction_type == InteractionType.PING:
+        return json.dumps({"type": ResponseType.PONG}).encode()
+    if interaction_type == InteractionType.APPLICATION_COMMAND and data["data"]["name"] in COMMANDS:
+        name = data["data"]["name"]
+        result = await run_with_deadline(name, COMMANDS[name], data, started, update=False)
+    elif interaction_type == InteractionType.MESSAGE_COMPONENT and primary_id(data) in HANDLERS:
+        name = primary_id(data)
+        result = await run_with_deadline(name, HANDLERS[name], data, started, update=True)
+    else:
+        # everything else, like the guide, never waits for I/O and runs as in the blocking mode
+        if interaction_type == InteractionType.APPLICATION_COMMAND:
+            name = data["data"]["name"]
+        elif interaction_type == InteractionType.APPLICATION_COMMAND_AUTOCOMPLETE:
+            name = f"{data['data']['name']}:autocomplete"
+        else:
+            name = primary_id(data)
+        with flask_app.app_context(), metrics.HANDLER_DURATION.time(name), tracing.trace(data["id"], name):
+            if interaction_type == InteractionType.APPLICATION_COMMAND:
+                result = DiscordInteractions.run_command(discord, data)
+            elif interaction_type == InteractionType.APPLICATION_COMMAND_AUTOCOMPLETE:
+                result = discord.run_autocomplete(data)
+            elif interaction_type == InteractionType.MODAL_SUBMIT:
+                result = DiscordInteractions.run_handler(discord, data, allow_modal=False)
+            else:
+                result = DiscordInteractions.run_handler(discord, data)
+    body, _ = result.encode()
+    # autocomplete results are encoded as text
+    return body.encode() if isinstance(body, str) else body
+
+
+@lru_cache(maxsize=None)
+def verify_key(public_key: str) -> VerifyKey:
+    """
+    :return: The key verifying Discord's signatures
+    """
+    return VerifyKey(bytes.fromhex(public_key))
+
+
+def verified(headers: dict, body: bytes) -> bool:
+    """
+    :return: Whether the request was signed by Discord
+    """
+    if flask_app.config.get("DONT_VALIDATE_SIGNATURE"):
+        return True
+    signature = headers.get(b"x-signature-ed25519")
+    timestamp = headers.get(b"x-signature-timestamp")
+    if signature is None or timestamp is None:
+        return False
+    try:
+        verify_key(flask_app.config["DISCORD_PUBLIC_KEY"]).verify(timestamp + body, bytes.fromhex(signature.decode()))
+    except (BadSignatureError, ValueError):
+        return False
+    return True
+
+
+async def respond(send, status: int, body: bytes, content_type: bytes = b"application/json") -> None:
+    """
+    Sends a complete HTTP response
+    """
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def readiness() -> tuple[int, bytes]:
+    """
+    :return: Status and body of the readiness check reporting whether the database is reachable
+    """
+    try:
+        await get_backend().ping_async()
+    except Exception:  # pylint: disable=broad-except
+        logging.exception("The database is unreachable")
+        return 503, b'{"database": "unreachable"}'
+    return 200, b'{"database": "ok"}'
+
+
+async def lifespan(receive, send) -> None:
+    """
+    Starts the background workers of the process and closes the connections on shutdown
+    """
+    while True:
+        event = await receive()
+        if event["type"] == "lifespan.startup":
+            delivery.deliverer.start()
+            retention.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif event["type"] == "lifespan.shutdown":
+            await close_async_client()
+            await aiodatabase.close_pool()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def metrics_page() -> tuple[int, bytes, bytes]:
+    """
+    :return: Status, body and content type of the metrics in the Prometheus text format
+    """
+    return 200, metrics.render().encode(), b"text/plain; version=0.0.4"
+
+
+# pages answering GET requests, by path
+PAGES = {"/metrics": metrics_page, "/ready": readiness}
+
+
+async def interaction(scope, receive) -> tuple:
+    """
+    Reads, verifies and handles an interaction
+
+    :return: Status, body and, unless it's JSON, the content type of the response
+    """
+    started = monotonic()
+    chunks = []
+    while True:
+        event = await receive()
+        chunks.append(event.get("body", b""))
+        if not event.get("more_body"):
+            break
+    body = b"".join(chunks)
+    if not verified(dict(scope["headers"]), body):
+        return 401, b"Incorrect Signature", b"text/plain"
+    try:
+        return 200, await handle_interaction(json.loads(body), started)
+    except interactions.InteractionPending:
+        return 409, b"Conflict", b"text/plain"
+    except Exception as error:  # pylint: disable=broad-except
+        response = handlers.error_response(error)
+        if response is None:
+            logging.exception("Interaction failed")
+            return 500, b"Internal Server Error", b"text/plain"
+        return 200, response
+
+
+async def app(scope, receive, send) -> None:
+    """
+    ASGI application serving the interaction endpoint
+    """
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["method"] == "POST" and scope["path"] == "/interactions":
+        await respond(send, *await interaction(scope, receive))
+    elif scope["method"] == "GET" and scope["path"] in PAGES:
+        await respond(send, *await PAGES[scope["path"]]())
+    else:
+        await respond(send, 404, b"Not Found", b"text/plain")
+
+
+def create_app():
+    """
+    Prepares everything the workers share and returns the ASGI application, see :func:`bot.create_app`
+    """
+    create_flask_app()
+    return app
@@ -0,0 +1,115 @@
+"""
+Export and import of guilds, messages and star votes as JSON lines
+
+Run with ``python3 backup.py export`` or ``python3 backup.py import`` from the app directory,
+see ``--help`` for the options. Every line is one row with its ``type``, rows are read and
+written in batches, so both directions run in constant memory. Importing leaves existing
+rows untouched and can be repeated. Exporting with one ``STORAGE_BACKEND`` and importing
+with the other moves a deployment between MySQL and SQLite. The star statistics aren't
+exported, they are rebuilt from the imported rows.
+"""
+import argparse
+import json
+import logging
+import sys
+from dataclasses import asdict
+from time import monotonic
+
+import config
+from resources import guilds, leaderboard, messages
+
+TYPES = ("guild", "message", "vote")
+
+
+def export(output, types: tuple = TYPES, batch_size: int = None) -> dict:
+    """
+    Writes the rows of the given types as JSON lines
+
+    :param output: Text file to write to
+    :return: Number of exported rows by type
+    """
+    counts = dict.fromkeys(types, 0)
+    rows = {
+        "guild": lambda: (asdict(guild) for guild in guilds.iterate(batch_size)),
+        "message": lambda: (asdict(message) for message in messages.iterate(batch_size)),
+        "vote": lambda: (
+            {"message_id": message_id, "user_id": user_id} for message_id, user_id in messages.iterate_votes(batch_size)
+        ),
+    }
+    for kind in types:
+        for row in rows[kind]():
+            output.write(json.dumps({"type": kind, **row}) + "\n")
+            counts[kind] += 1
+    return counts
+
+
+def flush(kind: str, batch: list) -> int:
+    """
+    Inserts a batch of rows of one type
+
+    :return: Number of added rows
+    """
+    if kind == "guild":
+        added = guilds.insert_many([guilds.Guild(**row) for row in batch])
+    elif kind == "message":
+        added = messages.insert_many([messages.Message(**row) for row in batch])
+    else:
+        added = messages.insert_votes([(row["message_id"], row["user_id"]) for row in batch])
+    batch.clear()
+    return added
+
+
+def import_rows(lines, batch_size: int = None) -> dict:
+    """
+    Adds the rows of JSON lines, skipping rows that already exist
+
+    :param lines: Iterable of JSON lines, like a text file
+    :raises ValueError: In case a line has an unknown type
+    :return: Number of read and added rows by type
+    """
+    batch_size = batch_size or config.Database.BATCH_SIZE
+    batches = {kind: [] for kind in TYPES}
+    counts = {kind: {"read": 0, "added": 0} for kind in TYPES}
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        kind = row.pop("type", None)
+        if kind not in batches:
+            raise ValueError(f"Line {number} has the unknown type {kind!r}")
+        batches[kind].append(row)
+        counts[kind]["read"] += 1
+        if len(batches[kind]) >= batch_size:
+            counts[kind]["added"] += flush(kind, batches[kind])
+    for kind, batch in batches.items():
+        if batch:
+            counts[kind]["added"] += flush(kind, batch)
+    return counts
+
+
+def main() -> None:
+    """Exports or imports with the options of the command line"""
+    logging.basicConfig(level=logging.INFO, format=config.LOG_FORMAT)
+    parser = argparse.ArgumentParser(description="Export or import guilds, messages and star votes as JSON lines")
+    parser.add_argument("--batch-size", type=int, help="rows read or written at a time")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write all rows")
+    export_parser.add_argument("file", nargs="?", help="file to write to, standard output if missing")
+    export_parser.add_argument("--types", nargs="+", choices=TYPES, default=list(TYPES), help="types of rows to export")
+    import_parser = commands.add_parser("import", help="add the rows of an export")
+    import_parser.add_argument("file", nargs="?", help="file to read from, standard input if missing")
+    args = parser.parse_args()
+    started = monotonic()
+    if args.command == "export":
+        with open(args.file, "w", encoding="utf-8") if args.file else sys.stdout as file:
+            result = export(file, tuple(args.types), args.batch_size)
+    else:
+        with open(args.file, encoding="utf-8") if args.file else sys.stdin as file:
+            result = import_rows(file, args.batch_size)
+        if result["message"]["added"] or result["vote"]["added"]:
+            leaderboard.rebuild(batch_size=args.batch_size)
+    logging.info("%sed %s within %.2fs", args.command.capitalize(), result, monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
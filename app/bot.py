@@ -1,48 +1,94 @@
 # pylint: disable=unused-argument, missing-module-docstring, wrong-import-position
+import gc
 import logging
 import sys
-import threading
-from datetime import datetime
-from os import getenv
-from time import sleep
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextvars import copy_context
+from functools import partial
+from os import getenv, getpid
+from time import monotonic, sleep
 
 import config
-import i18n
+import delivery
+import handlers
+import metrics
 import requests
-import json
-from flask import Flask, redirect, request
+import responses
+import retention
+import tracing
+import translations
+from flask import Flask, Response, abort, copy_current_request_context, g, redirect, request
 from flask_discord_interactions import DiscordInteractions, Context
-from flask_discord_interactions.models.component import ActionRow, Button
-from flask_discord_interactions.models.embed import Author, Embed, Field, Footer, Media
+from flask_discord_interactions.discord import InteractionType
 from flask_discord_interactions.models.message import Message
 from flask_discord_interactions.models.option import CommandOptionType, Option
-from i18n import set as set_i18n
-from i18n import t
-from resources import guilds, messages
-from utils import get_localizations
+from http_client import RateLimited, get_client
+from resources import guilds, interactions, leaderboard, messages
+from resources.storage import get_backend
+from scheduler import scheduler
+from translations import set_locale, t
+from utils import HandlerTimings, get_localizations
 
-i18n.set("filename_format", config.I18n.FILENAME_FORMAT)
-i18n.set("fallback", config.I18n.FALLBACK)
-i18n.set("available_locales", config.I18n.AVAILABLE_LOCALES)
-i18n.set("skip_locale_root_data", True)
+app = Flask(__name__)
 
-i18n.load_path.append("./locales")
+# interactions running a command or handler, which are only run once per interaction id
+IDEMPOTENT = (InteractionType.APPLICATION_COMMAND, InteractionType.MESSAGE_COMPONENT, InteractionType.MODAL_SUBMIT)
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
 
-logger.handlers.clear()
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(logging.Formatter(config.LOG_FORMAT))
-logger.addHandler(console_handler)
+class CustomDiscordInteractions(DiscordInteractions):
+    """
+    Runs commands and handlers against Discord's response deadline
 
-app = Flask(__name__)
+    Handlers that don't finish in time, or are known to be slow, get a deferred
+    response and edit it through the followup endpoint once they are done.
+    """
 
+    def __init__(self, flask_app: Flask = None):
+        super().__init__(flask_app)
+        self.timings = HandlerTimings()
+        self._executor = None
+        self._executor_pid = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Worker pool of the current process running commands and handlers"""
+        if self._executor_pid != getpid():
+            self._executor = ThreadPoolExecutor(config.Interactions.WORKERS, thread_name_prefix="interaction")
+            self._executor_pid = getpid()
+        return self._executor
 
-class CustomDiscordInteractions(DiscordInteractions):
     def handle_request(self):
-        set_i18n("locale", request.json.get("locale"))
-        return super().handle_request()
+        g.started = monotonic()
+        delivery.deliverer.start()
+        retention.start()
+        set_locale(request.json.get("locale"))
+        data = request.json
+        if data.get("type") not in IDEMPOTENT:
+            return super().handle_request()
+        # nothing is recorded for requests that aren't from Discord
+        self.verify_signature(request)
+        try:
+            duplicate = interactions.claim(data["id"], handlers.remaining(g.started))
+        except interactions.InteractionPending:
+            metrics.DUPLICATE_INTERACTIONS.inc("pending")
+            abort(409)
+        if duplicate is not None:
+            return responses.EncodedMessage(body=handlers.answer_duplicate(data["id"], duplicate))
+        try:
+            result = super().handle_request()
+            body, mimetype = result.encode()
+        except BaseException:
+            interactions.release(data["id"])
+            raise
+        if mimetype == "application/json":
+            body = body.decode() if isinstance(body, bytes) else body
+        if mimetype != "application/json" or not interactions.storable(body):
+            # responses with files and oversized ones aren't kept, their duplicates run again
+            interactions.release(data["id"])
+            return result
+        interactions.store(data["id"], body)
+        return responses.EncodedMessage(body=body)
 
     def run_command(self, data: dict):
         ctx = Context.from_data(self, app, data)
@@ -55,61 +101,85 @@ class CustomDiscordInteractions(DiscordInteractions):
             ctx.locale,
             ctx.guild_locale,
         )
-        return super().run_command(data)
+        return self.run_with_deadline(ctx.command_name, data, super().run_command, update=False)
+
+    def run_handler(self, data: dict, *, allow_modal: bool = True):
+        name = data["data"]["custom_id"].split("\n", 1)[0]
+        return self.run_with_deadline(name, data, partial(super().run_handler, allow_modal=allow_modal))
+
+    def run_autocomplete(self, data: dict):
+        name = f"{data['data']['name']}:autocomplete"
+        with metrics.HANDLER_DURATION.time(name), tracing.trace(data["id"], name):
+            return super().run_autocomplete(data)
+
+    def run_with_deadline(self, name: str, data: dict, func, update: bool = True) -> Message:
+        """
+        Runs a command or handler, answering with a deferred response if it misses the deadline
+
+        :param str name: Name of the command or custom id of the handler
+        :param dict data: Incoming interaction data
+        :param func: Function running the command or handler
+        :param bool update: Whether the deferred response updates the clicked message
+        :return: The handler's result or a deferred response
+        """
+        budget = handlers.remaining(g.started)
+
+        def timed():
+            with handlers.measured(self.timings, name, data):
+                return func(data)
+
+        # the locale lives in a context variable, which threads don't inherit on their own
+        future = self.executor.submit(copy_context().run, copy_current_request_context(timed))
+        if self.timings.expected(name) < budget:
+            try:
+                return future.result(timeout=budget)
+            except FutureTimeout:
+                pass
+        finish = copy_current_request_context(lambda future: self.finish_deferred(future, data))
+        finish_context = copy_context()
+        future.add_done_callback(lambda future: finish_context.run(finish, future))
+        return handlers.deferred(name, update)
+
+    def finish_deferred(self, future: Future, data: dict) -> None:
+        """
+        Sends the result of a deferred command or handler through the followup endpoint
+        """
+        try:
+            followup = handlers.followup_body(data, result=future.result())
+        except Exception as error:  # pylint: disable=broad-except
+            followup = handlers.followup_body(data, error=error)
+        if followup is None:
+            return
+        try:
+            for method, url, kwargs in handlers.followup_requests(data, app.config["DISCORD_CLIENT_ID"], *followup):
+                for delay in handlers.followup_delays():
+                    sleep(delay)
+                    response = get_client().request(method, url, **kwargs)
+                    if response.status_code != 404:
+                        break
+                response.raise_for_status()
+        except RateLimited as error:
+            logging.warning("Dropped the deferred response of interaction %s: %s", data["id"], error)
+        except requests.RequestException:
+            logging.exception("Failed to send the deferred response of interaction %s", data["id"])
 
 
 discord = CustomDiscordInteractions(app)
 
-# ugly thing I have to do to support nested locales
-for locale in config.I18n.AVAILABLE_LOCALES:
-    logging.info("Initialized locale %s", locale)
-    i18n.t("name", locale=locale)
-from guide import guide_bp
-
+from guide import get_index, guide_bp
 
+app.config["DISCORD_BASE_URL"] = config.DISCORD_API_URL
 app.config["DISCORD_CLIENT_ID"] = getenv("DISCORD_CLIENT_ID", default="")
 app.config["DISCORD_PUBLIC_KEY"] = getenv("DISCORD_PUBLIC_KEY", default="")
 app.config["DISCORD_CLIENT_SECRET"] = getenv("DISCORD_CLIENT_SECRET", default="")
 
-if "--debug" in sys.argv:
-    app.config["DONT_VALIDATE_SIGNATURE"] = True
-
-
-if "--remove-global" in sys.argv:
-    discord.update_commands()
-    sys.exit()
-
 
 @app.errorhandler(guilds.GuildNotFound)
 def guild_not_found(error: guilds.GuildNotFound):
     """
     Prompt the webhook selection again
     """
-    return json.loads(
-        Message(
-            embed=Embed(
-                title=t("guild_not_found.title"),
-                description=t("guild_not_found.body"),
-                color=config.EMBED_COLOR,
-                fields=[
-                    Field(name=t("guild_not_found.explanation.name"), value=t("guild_not_found.explanation.value")),
-                    Field(name=t("guild_not_found.warning.name"), value=t("guild_not_found.warning.value")),
-                ],
-            ),
-            ephemeral=True,
-            components=[
-                ActionRow(
-                    components=[
-                        Button(
-                            style=5,
-                            label=t("guild_not_found.button"),
-                            url="https://discord.com/api/oauth2/authorize?client_id=966294455726506035&permissions=0&redirect_uri=https%3A%2F%2Fstarboard.rfive.de%2Fapi%2Fsetup&response_type=code&scope=webhook.incoming",
-                        )
-                    ]
-                )
-            ],
-        ).encode()[0]
-    )
+    return Response(handlers.error_response(error), mimetype="application/json")
 
 
 @discord.command(
@@ -118,144 +188,38 @@ def guild_not_found(error: guilds.GuildNotFound):
 def star(ctx, message: Message):
     """Message starring context menu command"""
     guild = guilds.get(ctx.guild_id)
-    if int(message.id) < messages.max_timestamp():
-        return Message(t("errors.too_old"), ephemeral=True)
-    if message.author.id == app.config["DISCORD_CLIENT_ID"]:
-        return Message(t("errors.starboard_message"), ephemeral=True)
-    if messages.exists(message.id):
+    error = handlers.star_error(ctx, message, guild, app.config["DISCORD_CLIENT_ID"])
+    if error is not None:
+        return error
+    if not messages.insert(handlers.new_message(ctx, message), star_user=ctx.author.id):
         return Message(t("errors.message_exists"), ephemeral=True)
-    if ctx.author.id == message.author.id and guild.self_stars_allowed is False:
-        return Message(t("errors.self_star"), ephemeral=True)
-    messages.insert(messages.Message(id=message.id, star_users=ctx.author.id))
-    try:
-        attachment_url = request.json["data"]["resolved"]["messages"][message.id]["attachments"][0]["url"]
-    except IndexError:
-        attachment_url = None
-    set_i18n("locale", ctx.guild_locale)
-    return Message(
-        t("message.author", author=ctx.author.username),
-        embeds=[
-            Embed(
-                author=Author(
-                    name=f"{message.author.username}#{message.author.discriminator}", icon_url=message.author.avatar_url
-                ),
-                description=message.content,
-                footer=Footer(t("message.footer")),
-                color=config.EMBED_COLOR,
-                image=Media(url=attachment_url) if attachment_url else None,
-            )
-        ]
-        + message.embeds,
-        components=[
-            ActionRow(
-                components=[
-                    Button(label="1", emoji={"name": "⭐", "id": None}, custom_id=["star", message.id, 1], style=2),
-                    Button(
-                        label=t("message.jump"),
-                        style=5,
-                        url=f"https://discord.com/channels/{ctx.guild_id}/{ctx.channel_id}/{message.id}",
-                    ),
-                ]
-            )
-        ],
-    )
+    return handlers.star_message(ctx, message, request.json)
+
+
+@scheduler.task
+def delete_original(url: str):
+    """Deletes an interaction response"""
+    get_client().delete(url).raise_for_status()
 
 
 @discord.custom_handler(custom_id="star")
 def star_button(ctx, message_id, stars: int):
     """Star button handler"""
     guild = guilds.get(ctx.guild_id)
-    message = messages.get(message_id)
-    if int(message_id) < messages.max_timestamp():
-        return Message(t("errors.too_old"), ephemeral=True)
-    if ctx.author.id in message.star_users:
-        return Message(t("errors.starred_twice"), ephemeral=True)
-    if message.sent:
-        return Message(t("errors.starboard_message"), ephemeral=True)
-    if ctx.author.id == ctx.message.author.id and not guild.self_stars_allowed:
-        return Message(t("errors.self_star"), ephemeral=True)
-    set_i18n("locale", ctx.guild_locale)
-    message.add_star_user(ctx.author.id)
-    embeds = ctx.message.embeds
-    if stars + 1 < guild.required_stars:
-        embeds[0].footer = Footer(t("message.footer"))
-        return Message(
-            t("message.author", author=ctx.author.username),
-            embeds=embeds,
-            components=[
-                ActionRow(
-                    components=[
-                        Button(
-                            label=str(stars + 1),
-                            emoji={"name": "⭐", "id": None},
-                            custom_id=["star", message_id, stars + 1],
-                            style=2,
-                        ),
-                        Button(
-                            label=t("message.jump"),
-                            style=5,
-                            url=f"https://discord.com/channels/{ctx.guild_id}/{ctx.channel_id}/{message_id}",
-                        ),
-                    ]
-                )
-            ],
-            update=True,
-        )
-
-    def delete_original():
-        sleep(1)
-        requests.delete(ctx.followup_url() + "/messages/@original").raise_for_status()
-
-    if guild.delete_own_messages:
-        threading.Thread(target=delete_original).start()
-    embeds_starboard = embeds.copy()
-    embeds_starboard[0].footer = Footer(message_id)
-    embeds_starboard[0].timestamp = datetime.utcnow().isoformat()
-    requests.post(
-        f"{config.BASE_URL}/{guild.webhook_id}/{guild.webhook_token}",
-        json=json.loads(
-            Message(
-                embeds=embeds_starboard,
-                components=[
-                    ActionRow(
-                        components=[
-                            Button(
-                                label=t("message.jump"),
-                                style=5,
-                                url=f"https://discord.com/channels/{ctx.guild_id}/{ctx.channel_id}/{message_id}",
-                            )
-                        ]
-                    )
-                ],
-            ).encode(followup=True)[0]
-        ),
-    ).raise_for_status()
-    logging.info("A message with the id %s was sent to the Starboard in guild %s.", message_id, ctx.guild_id)
-    message.mark_sent()
-
-    return Message(
-        t("message.author", author=ctx.author.username),
-        embeds=embeds,
-        components=[
-            ActionRow(
-                components=[
-                    Button(
-                        label=str(stars + 1),
-                        emoji={"name": "⭐", "id": None},
-                        custom_id=["star", stars + 1],
-                        style=2,
-                        disabled=True,
-                    ),
-                    Button(
-                        label=t("message.jump"),
-                        style=5,
-                        url=f"https://discord.com/channels/{ctx.guild_id}/{ctx.channel_id}/{message_id}",
-                    ),
-                ]
-            )
-        ],
-        update=True,
-    )
+    error = handlers.star_button_error(ctx, message_id, guild)
+    if error is not None:
+        return error
+    embeds = request.json["message"]["embeds"]
+    build_post = handlers.post_builder(ctx, guild, message_id, embeds)
+    # the count in the custom id may be outdated, the database has the real one
+    result = messages.star(message_id, ctx.author.id, guild.required_stars, build_post=build_post)
+    if result.claimed:
+        metrics.STARBOARD_POSTS.inc(ctx.guild_id)
+        if guild.delete_own_messages:
+            scheduler.schedule("delete_original", 1, url=ctx.followup_url("@original"))
+        delivery.deliverer.wake()
+        logging.info("A message with the id %s was queued for the Starboard in guild %s.", message_id, ctx.guild_id)
+    return handlers.star_button_message(ctx, message_id, embeds, result)
 
 
 @discord.command(
@@ -291,24 +255,67 @@ def star_button(ctx, message_id, stars: int):
 def settings(ctx, stars: int = None, allow_self_stars: bool = None, delete_message: bool = None):
     """Set up starboard."""
     guild = guilds.get(ctx.guild_id)
-    if stars:
-        guilds.update(guild, required_stars=stars)
-    if allow_self_stars is not None:
-        guild.set_self_stars_allowed(allow_self_stars)
-    if delete_message is not None:
-        guild.set_delete_own_messages(delete_message)
-    return Message(
-        t("settings.success"),
-        embed=Embed(
-            fields=[
-                Field(t("settings.required_stars"), str(guild.required_stars)),
-                Field(t("settings.allow_self_stars"), "✅" if guild.self_stars_allowed is True else "⛔"),
-                Field(t("settings.delete_message"), "✅" if guild.delete_own_messages is True else "⛔"),
-            ],
-            color=config.EMBED_COLOR,
-        ),
-        ephemeral=True,
-    )
+    changes = handlers.settings_changes(guild, stars, allow_self_stars, delete_message)
+    if changes:
+        guilds.update(guild, **changes)
+    return handlers.settings_message(guild)
+
+
+@discord.command(
+    name="leaderboard",
+    name_localizations=get_localizations("commands.leaderboard.name"),
+    description_localizations=get_localizations("commands.leaderboard.description"),
+    dm_permission=False,
+)
+def leaderboard_command(ctx):
+    """Show the most starred messages and users of this server."""
+    return handlers.leaderboard_message(ctx, leaderboard.get(ctx.guild_id))
+
+
+metrics.Gauge(
+    "starboard_db_pool",
+    "Connections of the storage backend",
+    ("stat",),
+    lambda: {(stat,): value for stat, value in get_backend().stats().items()},
+)
+metrics.Gauge(
+    "starboard_guild_cache",
+    "Size and hit counters of the guild cache",
+    ("stat",),
+    lambda: {(stat,): value for stat, value in guilds.cache.stats().items()},
+)
+metrics.Gauge(
+    "starboard_outbox",
+    "Queued starboard posts and the delivery counters of this process",
+    ("stat",),
+    lambda: {(stat,): value for stat, value in delivery.deliverer.stats().items()},
+)
+metrics.Gauge(
+    "starboard_scheduler_pending", "Scheduled tasks waiting for their time", (), lambda: {(): scheduler.pending()}
+)
+metrics.Gauge(
+    "starboard_rate_limits",
+    "Known Discord rate limit buckets and routes",
+    ("stat",),
+    lambda: {(stat,): value for stat, value in get_client().rate_limits.stats().items()},
+)
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Metrics of this worker in the Prometheus text format"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/ready")
+def ready():
+    """Readiness check reporting whether the database is reachable"""
+    try:
+        get_backend().ping()
+    except Exception:  # pylint: disable=broad-except
+        logging.exception("The database is unreachable")
+        return {"database": "unreachable"}, 503
+    return {"database": "ok"}
 
 
 @app.route("/setup")
@@ -322,7 +329,7 @@ def webhook():
         "redirect_uri": "https://starboard.rfive.de/api/setup",
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    auth_request = requests.post("https://discord.com/api/v10/oauth2/token", data=data, headers=headers)
+    auth_request = get_client().post(f"{config.DISCORD_API_URL}/oauth2/token", data=data, headers=headers)
     try:
         auth_request.raise_for_status()
     except requests.HTTPError as error:
@@ -330,27 +337,51 @@ def webhook():
         return "Error while setting up", 500
     # pylint: disable = redefined-outer-name
     webhook = auth_request.json()["webhook"]
-    if not guilds.exists(webhook["guild_id"]):
-        guilds.insert(guilds.Guild(id=webhook["guild_id"], webhook_id=webhook["id"], webhook_token=webhook["token"]))
-    else:
-        guilds.update(guilds.get(webhook["guild_id"]), webhook_id=webhook["id"], webhook_token=webhook["token"])
+    guilds.upsert_webhook(webhook["guild_id"], webhook_id=webhook["id"], webhook_token=webhook["token"])
     logging.info("Got authorized for guild %s", webhook["guild_id"])
 
     return redirect("https://discord.com/oauth2/authorized")
 
 
 discord.register_blueprint(guide_bp)
+discord.set_route("/interactions")
 
-if "--update" in sys.argv:
-    discord.update_commands(guild_id=830928381100556338)
-    sys.exit()
 
-if "--deploy" in sys.argv:
-    discord.update_commands()
-    sys.exit()
+def configure_logging() -> None:
+    """
+    Logs everything from info on to the console
+    """
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    logger.handlers.clear()
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(config.LOG_FORMAT))
+    logger.addHandler(console_handler)
 
 
-discord.set_route("/interactions")
+def create_app() -> Flask:
+    """
+    Prepares everything the workers share and returns the application
+
+    Importing this module only defines the commands and routes. Serve the application with
+    ``gunicorn "bot:create_app()" --preload`` so this runs once in gunicorn's master process
+    and the forked workers share the loaded translations and guide. Commands are registered
+    with ``deploy.py`` and migrations applied with ``migrations.py``.
+    """
+    configure_logging()
+    get_index()
+    for locale in translations.catalog():
+        responses.guild_not_found(locale)
+    if config.Database.MIGRATE:
+        from migrations import migrate  # pylint: disable=import-outside-toplevel
+
+        migrate()
+    # everything loaded so far lives as long as the workers, collecting it would only copy the shared pages
+    gc.freeze()
+    return app
+
 
 if __name__ == "__main__":
-    app.run(port=9200, debug=True)
+    if "--debug" in sys.argv:
+        app.config["DONT_VALIDATE_SIGNATURE"] = True
+    create_app().run(port=9200, debug=True)
@@ -4,17 +4,117 @@ from os import getenv
 
 LOG_FORMAT = "%(levelname)s [%(module)s.%(funcName)s]: %(message)s"
 EMBED_COLOR = int("0x2f3136", 16)
-BASE_URL = "https://discord.com/api/v10/webhooks"
+DISCORD_API_URL = getenv("DISCORD_API_URL", default="https://discord.com/api/v10")
+BASE_URL = f"{DISCORD_API_URL}/webhooks"
 DATABASE_ARGS = {
     "host": getenv("MYSQL_HOST"),
+    "port": int(getenv("MYSQL_PORT", default="3306")),
     "user": getenv("MYSQL_USER"),
     "passwd": getenv("MYSQL_PASSWORD"),
     "database": getenv("MYSQL_DATABASE"),
 }
 
 
+class Interactions:
+    "Interaction response configuration values"
+    # Discord drops interactions that aren't answered within 3 seconds
+    DEADLINE = float(getenv("INTERACTION_DEADLINE", default="2.5"))
+    WORKERS = int(getenv("INTERACTION_WORKERS", default="16"))
+    # a followup can reach Discord before the deferred response it edits, which gets a 404 until then
+    FOLLOWUP_RETRIES = int(getenv("INTERACTION_FOLLOWUP_RETRIES", default="4"))
+    FOLLOWUP_RETRY_DELAY = float(getenv("INTERACTION_FOLLOWUP_RETRY_DELAY", default="0.25"))
+
+
+class Idempotency:
+    "Deduplication of interactions configuration values"
+    # seconds the response of an interaction is kept for duplicates, interaction tokens last 15 minutes
+    WINDOW = float(getenv("INTERACTION_WINDOW", default="900"))
+    # responses kept in memory per worker, the database has those of all workers
+    CACHE_SIZE = int(getenv("INTERACTION_CACHE_SIZE", default="10000"))
+    # characters of the largest response kept, duplicates of interactions with larger ones run again
+    MAX_RESPONSE_SIZE = int(getenv("INTERACTION_MAX_RESPONSE_SIZE", default="65536"))
+
+
+class Database:
+    "Storage backend and database connection pool configuration values"
+    # mysql, or sqlite for an embedded database on a single node
+    BACKEND = getenv("STORAGE_BACKEND", default="mysql").lower()
+    SQLITE_PATH = getenv("SQLITE_PATH", default="starboard.db")
+    POOL_SIZE = int(getenv("MYSQL_POOL_SIZE", default="5"))
+    POOL_TIMEOUT = float(getenv("MYSQL_POOL_TIMEOUT", default="5"))
+    # rows loaded at a time when iterating over whole tables
+    BATCH_SIZE = int(getenv("DATABASE_BATCH_SIZE", default="1000"))
+    # applies the pending migrations when the bot starts, workers starting together take turns
+    MIGRATE = getenv("DATABASE_MIGRATE", default="false").lower() == "true"
+
+
+class Tracing:
+    "Database statement tracing configuration values"
+    # statements taking longer are logged with the interaction that ran them
+    SLOW_QUERY = float(getenv("DB_SLOW_QUERY_MS", default="100")) / 1000
+    # logs the number of statements and their total time after every interaction
+    SUMMARY = getenv("DB_TRACE_SUMMARY", default="true").lower() == "true"
+
+
+class Asgi:
+    "Async serving mode configuration values"
+    DB_POOL_SIZE = int(getenv("ASGI_MYSQL_POOL_SIZE", default="20"))
+    HTTP_CONNECTIONS = int(getenv("ASGI_HTTP_CONNECTIONS", default="100"))
+
+
+class Cache:
+    "In-process cache configuration values"
+    # other workers only see a settings change once their copy expired, so it's kept short
+    GUILD_TTL = float(getenv("GUILD_CACHE_TTL", default="5"))
+    GUILD_SIZE = int(getenv("GUILD_CACHE_SIZE", default="10000"))
+
+
+class Outbox:
+    "Starboard post delivery configuration values"
+    WORKERS = int(getenv("OUTBOX_WORKERS", default="2"))
+    POLL_INTERVAL = float(getenv("OUTBOX_POLL_INTERVAL", default="5"))
+    MAX_ATTEMPTS = int(getenv("OUTBOX_MAX_ATTEMPTS", default="8"))
+    BACKOFF_BASE = 1.0
+    BACKOFF_MAX = 300.0
+
+
+class Scheduler:
+    "Delayed task configuration values"
+    WORKERS = int(getenv("SCHEDULER_WORKERS", default="4"))
+    PERSIST = getenv("SCHEDULER_PERSIST", default="false").lower() == "true"
+
+
+class Retention:
+    "Message retention configuration values"
+    DAYS = int(getenv("RETENTION_DAYS", default="35"))
+    BATCH_SIZE = int(getenv("RETENTION_BATCH_SIZE", default="1000"))
+    # seconds between purges, 0 disables the background job
+    INTERVAL = float(getenv("RETENTION_INTERVAL", default="3600"))
+
+
+class Http:
+    "Outgoing HTTP configuration values"
+    POOL_SIZE = int(getenv("HTTP_POOL_SIZE", default="10"))
+    TIMEOUT = float(getenv("HTTP_TIMEOUT", default="10"))
+    # longer waits are reported as RateLimited instead of blocking the caller
+    MAX_RATE_LIMIT_WAIT = float(getenv("HTTP_MAX_RATE_LIMIT_WAIT", default="5"))
+
+
+class Deploy:
+    "Command registration configuration values"
+    # what the last deploy registered, so unchanged commands aren't uploaded again
+    STATE_PATH = getenv("DEPLOY_STATE_PATH", default=".deployed_commands.json")
+
+
+class Guide:
+    "Guide configuration values"
+    PATH = "./guide"
+    # seconds between checks for edited guide files, 0 disables hot reloading
+    RELOAD_INTERVAL = float(getenv("GUIDE_RELOAD_INTERVAL", default="0"))
+
+
 class I18n:
     "I18n configuration values"
     AVAILABLE_LOCALES = ["en-US", "de"]
-    FILENAME_FORMAT = "{locale}{format}"
     FALLBACK = "en-US"
+    PATH = "./locales"
@@ -0,0 +1,158 @@
+"""
+Background delivery of queued starboard posts
+"""
+import atexit
+import logging
+import random
+import threading
+from os import getpid
+
+import config
+import requests
+from http_client import RateLimited, get_client
+from resources import outbox
+
+
+class Deliverer:
+    """
+    A pool of worker threads posting queued starboard messages to their webhooks
+
+    Posts are retried with exponential backoff, honouring ``Retry-After`` on rate limits.
+    Rate limits don't count towards the attempts, the post wasn't rejected.
+
+    :param int workers: Number of worker threads
+    :param float poll_interval: Seconds between checks for due posts when idle
+    :param int max_attempts: Attempts before a post is given up
+    """
+
+    def __init__(self, workers: int, poll_interval: float, max_attempts: int):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.pid = None
+        self._threads = []
+        self._wakeup = threading.Condition()
+        self._running = False
+        self._stats_lock = threading.Lock()
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self) -> None:
+        """
+        Starts the worker threads of the current process if they aren't running yet
+        """
+        if self._running and self.pid == getpid():
+            return
+        with self._wakeup:
+            if self._running and self.pid == getpid():
+                return
+            self.pid = getpid()
+            self._running = True
+            self._threads = [
+                threading.Thread(target=self._run, name=f"delivery-{i}", daemon=True) for i in range(self.workers)
+            ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """
+        Stops the worker threads, posts still queued are delivered after the next start
+        """
+        with self._wakeup:
+            self._running = False
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wake(self) -> None:
+        """
+        Tells an idle worker that a new post was queued
+        """
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _run(self) -> None:
+        while self._running:
+            try:
+                posts = outbox.claim_due(1)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to fetch queued starboard posts")
+                posts = []
+            if not posts:
+                with self._wakeup:
+                    if self._running:
+                        self._wakeup.wait(self.poll_interval)
+                continue
+            for post in posts:
+                self._deliver(post)
+
+    def backoff(self, attempts: int) -> float:
+        """
+        :return: Seconds to wait before the next attempt
+        """
+        delay = min(config.Outbox.BACKOFF_BASE * 2**attempts, config.Outbox.BACKOFF_MAX)
+        return delay * random.uniform(0.5, 1)
+
+    def _deliver(self, post: outbox.Post) -> None:
+        try:
+            response = get_client().post(post.url, json=post.payload)
+        except RateLimited as error:
+            self._retry(post, error.retry_after, str(error), rate_limited=True)
+            return
+        except requests.RequestException as error:
+            self._retry(post, self.backoff(post.attempts), str(error))
+            return
+        if response.ok:
+            outbox.mark_delivered(post)
+            with self._stats_lock:
+                self.delivered += 1
+                self.latency_total += post.age
+                self.latency_max = max(self.latency_max, post.age)
+            logging.info("A message with the id %s was sent to the Starboard.", post.message_id)
+        elif response.status_code == 429:
+            retry_after = float(response.headers.get("Retry-After", 0))
+            self._retry(post, max(retry_after, self.backoff(0)), "Rate limited", rate_limited=True)
+        elif response.status_code >= 500:
+            self._retry(post, self.backoff(post.attempts), f"{response.status_code} {response.reason}")
+        else:
+            # the webhook got deleted or the payload is invalid, retrying won't help
+            self._fail(post, f"{response.status_code} {response.text}")
+
+    def _retry(self, post: outbox.Post, delay: float, error: str, rate_limited: bool = False) -> None:
+        if not rate_limited and post.attempts + 1 >= self.max_attempts:
+            self._fail(post, error)
+            return
+        logging.warning("Delivery of message %s failed (%s), retrying in %.1fs", post.message_id, error, delay)
+        outbox.reschedule(post, delay, error, count_attempt=not rate_limited)
+        with self._stats_lock:
+            self.retried += 1
+
+    def _fail(self, post: outbox.Post, error: str) -> None:
+        logging.error("Giving up delivering message %s to the Starboard: %s", post.message_id, error)
+        outbox.mark_failed(post, error)
+        with self._stats_lock:
+            self.failed += 1
+
+    def stats(self) -> dict:
+        """
+        :return: Delivery counters of this process and the number of queued posts
+        """
+        # counting the queue runs a statement, which the workers updating the counters don't wait for
+        queue_depth = outbox.depth()
+        with self._stats_lock:
+            return {
+                "queue_depth": queue_depth,
+                "delivered": self.delivered,
+                "retried": self.retried,
+                "failed": self.failed,
+                "latency_avg": self.latency_total / self.delivered if self.delivered else 0.0,
+                "latency_max": self.latency_max,
+            }
+
+
+deliverer = Deliverer(config.Outbox.WORKERS, config.Outbox.POLL_INTERVAL, config.Outbox.MAX_ATTEMPTS)
+atexit.register(deliverer.stop)
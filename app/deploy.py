@@ -0,0 +1,225 @@
+"""
+Registration of the commands with Discord
+
+Run with ``python3 deploy.py`` from the app directory, see ``--help`` for the options. Serving
+the bot never registers commands, so this has to run whenever they changed. It needs
+``DISCORD_CLIENT_ID`` and ``DISCORD_CLIENT_SECRET``.
+
+Only the commands that changed are sent. The registered commands are fetched and every one
+is compared with its definition through a hash of its canonical payload. The hashes of the
+last deploy are kept in ``DEPLOY_STATE_PATH``, a command whose version didn't change since
+then is compared by hash alone. Without a state, like on a fresh checkout, the definition is
+compared with the registered command field by field.
+"""
+import argparse
+import hashlib
+import json
+import logging
+from os import replace
+
+import config
+from bot import app, discord
+from http_client import get_client
+
+# guild new commands are tried out in before they are deployed globally
+TEST_GUILD = "830928381100556338"
+ACTIONS = ("created", "updated", "deleted", "skipped")
+# deploys wait for the command routes' rate limits instead of giving up
+MAX_RATE_LIMIT_WAIT = 60
+
+
+def canonical(value):
+    """
+    :return: The payload without unset fields, which Discord doesn't return either
+    """
+    if isinstance(value, dict):
+        return {key: canonical(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [canonical(item) for item in value]
+    return value
+
+
+def payload_hash(payload: dict) -> str:
+    """
+    :return: Hash of the canonical JSON of a command's payload
+    """
+    encoded = json.dumps(canonical(payload), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def matches(defined, registered) -> bool:
+    """
+    Compares a canonical definition with a registered command
+
+    Fields Discord adds, like the id or version, are ignored, and so are empty or false fields
+    that Discord leaves out. Localizations have to be the same.
+
+    :return: Whether the registered command is up to date
+    """
+    if isinstance(defined, dict):
+        return isinstance(registered, dict) and all(
+            field_matches(key, value, registered) for key, value in defined.items()
+        )
+    if isinstance(defined, list):
+        return (
+            isinstance(registered, list)
+            and len(defined) == len(registered)
+            and all(matches(item, other) for item, other in zip(defined, registered))
+        )
+    return defined == registered
+
+
+def field_matches(key: str, value, registered: dict) -> bool:
+    """
+    :return: Whether a field of a definition is up to date in the registered command
+    """
+    if key not in registered:
+        return value is False or (isinstance(value, (dict, list, str)) and not value)
+    if key.endswith("_localizations"):
+        return value == registered[key]
+    return matches(value, registered[key])
+
+
+def commands_url(guild_id: str = None) -> str:
+    """
+    :return: The url of the global commands or those of a guild
+    """
+    base = f"{config.DISCORD_API_URL}/applications/{app.config['DISCORD_CLIENT_ID']}"
+    return f"{base}/guilds/{guild_id}/commands" if guild_id else f"{base}/commands"
+
+
+def send(method: str, url: str, **kwargs):
+    """
+    Sends a request to the commands endpoint, retrying after rate limits
+
+    :raises requests.HTTPError: In case Discord rejected the request
+    :return: The response's JSON, None if it has no body
+    """
+    while True:
+        response = get_client().request(
+            method, url, max_wait=MAX_RATE_LIMIT_WAIT, headers=discord.auth_headers(app), **kwargs
+        )
+        if response.status_code != 429:
+            break
+    response.raise_for_status()
+    return response.json() if response.content else None
+
+
+def load_state(path: str) -> dict:
+    """
+    :return: The deployed commands by scope, empty if nothing was deployed from here
+    """
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(path: str, state: dict) -> None:
+    """
+    Replaces the state at once, so an interrupted write never leaves half of it behind
+    """
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+    replace(f"{path}.tmp", path)
+
+
+def plan(definitions: list, registered: list, deployed: dict, force: bool = False) -> list:
+    """
+    Decides what has to be sent for every command
+
+    :param list definitions: Payloads of the commands as defined
+    :param list registered: Commands as returned by Discord
+    :param dict deployed: id, version and hash of the commands of the last deploy, by name
+    :param bool force: Updates every registered command, even unchanged ones
+    :return: (action, name, definition, registered command) of every command, sorted by name
+    """
+    by_key = {(command["name"], command.get("type", 1)): command for command in registered}
+    steps = []
+    for definition in definitions:
+        definition = canonical(definition)
+        current = by_key.pop((definition["name"], definition.get("type", 1)), None)
+        if current is None:
+            steps.append(("created", definition["name"], definition, None))
+            continue
+        last = deployed.get(definition["name"], {})
+        if last.get("id") == current["id"] and last.get("version") == current.get("version"):
+            unchanged = last.get("hash") == payload_hash(definition)
+        else:
+            unchanged = matches(definition, current)
+        steps.append(("skipped" if unchanged and not force else "updated", definition["name"], definition, current))
+    steps.extend(("deleted", command["name"], None, command) for command in by_key.values())
+    return sorted(steps, key=lambda step: (step[1], ACTIONS.index(step[0])))
+
+
+def apply(url: str, steps: list, dry_run: bool = False) -> dict:
+    """
+    Sends the planned requests
+
+    :param str url: The url of the commands
+    :param list steps: The plan of :func:`plan`
+    :param bool dry_run: Only logs what would be sent
+    :return: id, version and hash of the deployed commands, by name
+    """
+    commands = {}
+    for action, name, definition, current in steps:
+        logging.info("%s %s%s", action.capitalize(), name, " (dry run)" if dry_run and action != "skipped" else "")
+        if dry_run:
+            continue
+        if action == "deleted":
+            send("DELETE", f"{url}/{current['id']}")
+            continue
+        if action == "created":
+            current = send("POST", url, json=definition)
+        elif action == "updated":
+            current = send("PATCH", f"{url}/{current['id']}", json=definition)
+        commands[name] = {"id": current["id"], "version": current.get("version"), "hash": payload_hash(definition)}
+    return commands
+
+
+def deploy(guild_id: str = None, remove: bool = False, force: bool = False, dry_run: bool = False) -> dict:
+    """
+    Registers the commands that changed and deletes those that no longer exist
+
+    :param str guild_id: Registers the commands in this guild instead of globally
+    :param bool remove: Deletes all registered commands instead
+    :param bool force: Updates every registered command, even unchanged ones
+    :param bool dry_run: Only logs what would be sent
+    :return: Names of the commands by action
+    """
+    url = commands_url(guild_id)
+    scope = f"{app.config['DISCORD_CLIENT_ID']}/{guild_id or 'global'}"
+    state = load_state(config.Deploy.STATE_PATH)
+    definitions = [] if remove else [command.dump() for command in discord.discord_commands.values()]
+    registered = send("GET", url, params={"with_localizations": "true"})
+    steps = plan(definitions, registered, state.get(scope, {}), force)
+    commands = apply(url, steps, dry_run)
+    if not dry_run:
+        state[scope] = commands
+        save_state(config.Deploy.STATE_PATH, state)
+    return {action: [name for step, name, _, _ in steps if step == action] for action in ACTIONS}
+
+
+def main() -> None:
+    """Deploys with the options of the command line"""
+    logging.basicConfig(level=logging.INFO, format=config.LOG_FORMAT)
+    parser = argparse.ArgumentParser(description="Register the commands that changed with Discord")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--guild", help="only register the commands in this guild")
+    target.add_argument("--test", action="store_const", const=TEST_GUILD, dest="guild", help="use the test guild")
+    parser.add_argument("--remove", action="store_true", help="delete the registered commands instead")
+    parser.add_argument("--force", action="store_true", help="update unchanged commands too")
+    parser.add_argument("--dry-run", action="store_true", help="only show what would be sent")
+    args = parser.parse_args()
+    result = deploy(args.guild, args.remove, args.force, args.dry_run)
+    logging.info(
+        "%s %s: %s",
+        "Would deploy" if args.dry_run else "Deployed",
+        f"to guild {args.guild}" if args.guild else "globally",
+        ", ".join(f"{len(names)} {action}" for action, names in result.items()),
+    )
+
+
+if __name__ == "__main__":
+    main()
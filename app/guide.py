@@ -1,16 +1,20 @@
 "Blueprint file containing the guide command and its component handlers"
 # pylint: disable=unused-argument
-from os import listdir
+import logging
+import threading
+from dataclasses import dataclass
+from os import listdir, stat
+from time import monotonic
+from types import MappingProxyType
+from typing import Mapping, Optional
 
 import config
-from typing import Optional
 from flask_discord_interactions import DiscordInteractionsBlueprint, Embed, Message
 from flask_discord_interactions.models.component import ActionRow, SelectMenu, SelectMenuOption
 from flask_discord_interactions.models.embed import Media
 from flask_discord_interactions.models.option import Choice, CommandOptionType, Option
-from i18n import t, set as set_i18n
-
-# from i18n import t
+from search import SearchIndex
+from translations import set_locale, t
 from utils import get_localizations
 
 guide_bp = DiscordInteractionsBlueprint()
@@ -53,11 +57,11 @@ guide_bp = DiscordInteractionsBlueprint()
 def manual(ctx, language: str, topic: str = "intro") -> Message:
     """Get some informaton about starboard."""
     used_locale = language if language else ctx.locale
-    set_i18n("locale", used_locale)
-    try:
-        return Message(embed=get_guide_embed(topic, used_locale), components=get_guide_selects(used_locale))
-    except FileNotFoundError:
+    set_locale(used_locale)
+    guide_embed = get_guide_embed(topic, used_locale)
+    if guide_embed is None:
         return Message(t("errors.file_not_found", locale=used_locale), components=get_guide_selects(used_locale))
+    return Message(embed=guide_embed, components=get_guide_selects(used_locale))
 
 
 @manual.autocomplete()
@@ -65,57 +69,144 @@ def manual_autocomplete(ctx, locale: Option, topic: Optional[Option] = None):
     # workaround since lib goes by order instead of name, topic is only None when locale option is skipped
     if topic is None:
         return [Choice(name=t("commands.manual.topic.locale_error"), value="error")]
-    available_files = [
-        Choice(name=f[: f.find(".")].replace("_", " "), value=f[: f.find(".")])
-        for f in sorted(listdir(f"./guide/{locale.value}"))
-    ]
-    choices = []
-    for choice in available_files:
-        if topic.value in str.lower(choice.name):
-            choices.append(choice)
-
-    return choices
+    search = get_index().search.get(locale.value)
+    if search is None:
+        return []
+    return search.search(topic.value, limit=25)
 
 
 @guide_bp.custom_handler(custom_id="guide_topic")
 def guide_topic(ctx, locale: str = config.I18n.FALLBACK):
     """Handler for the topic select"""
-    return Message(embed=get_guide_embed(ctx.values[0], locale), components=get_guide_selects(locale), update=True)
-
-
-def get_guide_embed(topic: str, locale: str) -> Embed:
-    """Returns the fitting guide embed for a topic"""
-    with open(f"./guide/{locale}/{topic}.md", "r", encoding="utf8") as guide_file:
-        topic = str.lower(topic)
-        image_url = guide_file.readline()
-        guide_embed = Embed(
-            title=f"{str.upper(topic[0])}{topic[1:]}".replace("_", " "),
-            description=guide_file.read(),
-            color=config.EMBED_COLOR,
+    guide_embed = get_guide_embed(ctx.values[0], locale)
+    if guide_embed is None:
+        return Message(t("errors.file_not_found", locale=locale), ephemeral=True)
+    return Message(embed=guide_embed, components=get_guide_selects(locale), update=True)
+
+
+@dataclass(frozen=True)
+class GuideIndex:
+    """
+    Immutable snapshot of the guide directory
+
+    :ivar topics: Prebuilt embeds per locale and topic
+    :ivar choices: Autocomplete choices per locale
+    :ivar search: Autocomplete search index per locale
+    :ivar selects: Topic select components per locale
+    :ivar float mtime: Latest modification time of the guide files
+    """
+
+    topics: Mapping[str, Mapping[str, Embed]]
+    choices: Mapping[str, tuple]
+    search: Mapping[str, SearchIndex]
+    selects: Mapping[str, list]
+    mtime: float
+
+
+def guide_mtime(path: str = config.Guide.PATH) -> float:
+    """
+    :return: The latest modification time of the guide directories and files
+    """
+    mtimes = [stat(path).st_mtime]
+    for locale in listdir(path):
+        mtimes.append(stat(f"{path}/{locale}").st_mtime)
+        mtimes.extend(stat(f"{path}/{locale}/{f}").st_mtime for f in listdir(f"{path}/{locale}"))
+    return max(mtimes)
+
+
+def build_embed(topic: str, content: str) -> Embed:
+    """Builds the embed of a topic from its markdown file's content"""
+    image_url, _, description = content.partition("\n")
+    title = str.lower(topic)
+    guide_embed = Embed(
+        title=f"{str.upper(title[0])}{title[1:]}".replace("_", " "),
+        description=description,
+        color=config.EMBED_COLOR,
+    )
+    if image_url.startswith("https"):
+        guide_embed.image = Media(url=image_url.strip())
+    else:
+        guide_embed.description = f"{image_url}\n{description}"
+    return guide_embed
+
+
+def load_index(path: str = config.Guide.PATH, mtime: float = None) -> GuideIndex:
+    """
+    Reads the whole guide directory into a new index
+
+    :param float mtime: The :func:`guide_mtime` if it was just checked
+    """
+    mtime = guide_mtime(path) if mtime is None else mtime
+    topics, choices, search, selects = {}, {}, {}, {}
+    for locale in sorted(listdir(path)):
+        names = sorted(f[: f.find(".")] for f in listdir(f"{path}/{locale}") if f.endswith(".md"))
+        embeds = {}
+        for name in names:
+            with open(f"{path}/{locale}/{name}.md", "r", encoding="utf8") as guide_file:
+                embeds[name] = build_embed(name, guide_file.read())
+        topics[locale] = MappingProxyType(embeds)
+        choices[locale] = tuple(Choice(name=name.replace("_", " "), value=name) for name in names)
+        search[locale] = SearchIndex(
+            (choice, choice.name, embeds[choice.value].description) for choice in choices[locale]
         )
-        if image_url.startswith("https"):
-            guide_embed.image = Media(url=image_url)
-        else:
-            guide_embed.description = image_url + guide_embed.description
-        return guide_embed
+        selects[locale] = [
+            ActionRow(
+                components=[
+                    SelectMenu(
+                        custom_id=["guide_topic", locale],
+                        options=[
+                            SelectMenuOption(label=str.upper(name[:1]) + name[1:].replace("_", " "), value=name)
+                            for name in names
+                        ],
+                        placeholder=t("commands.manual.topic.placeholder", locale=locale),
+                    )
+                ]
+            )
+        ]
+    return GuideIndex(
+        topics=MappingProxyType(topics),
+        choices=MappingProxyType(choices),
+        search=MappingProxyType(search),
+        selects=MappingProxyType(selects),
+        mtime=mtime,
+    )
+
+
+_index: GuideIndex = None  # pylint: disable=invalid-name
+_checked_at = 0.0  # pylint: disable=invalid-name
+_index_lock = threading.Lock()
+
+
+def get_index() -> GuideIndex:
+    """
+    Returns the guide index, loading it on first use
+
+    If hot reloading is enabled the guide files are checked for changes at most once per interval.
+    """
+    global _index, _checked_at  # pylint: disable=global-statement
+    interval = config.Guide.RELOAD_INTERVAL
+    if _index is not None and (interval <= 0 or monotonic() - _checked_at < interval):
+        return _index
+    with _index_lock:
+        if _index is None:
+            _index = load_index()
+            _checked_at = monotonic()
+        elif 0 < interval <= monotonic() - _checked_at:
+            # set before the check, so a failing reload waits for the next interval too
+            _checked_at = monotonic()
+            mtime = guide_mtime()
+            if mtime > _index.mtime:
+                logging.info("Reloading the guide")
+                _index = load_index(mtime=mtime)
+    return _index
+
+
+def get_guide_embed(topic: str, locale: str) -> Optional[Embed]:
+    """Returns the fitting guide embed for a topic, None if there is none"""
+    return get_index().topics.get(locale, {}).get(topic)
 
 
 def get_guide_selects(locale: str):
     """Builder for the topic select"""
-    selects = [
-        ActionRow(
-            components=[
-                SelectMenu(
-                    custom_id=["guide_topic", locale],
-                    options=[
-                        SelectMenuOption(
-                            label=str.upper(f[:1]) + f[1 : f.find(".")].replace("_", " "), value=f[: f.find(".")]
-                        )
-                        for f in sorted(listdir(f"./guide/{locale}"))
-                    ],
-                    placeholder=t("commands.manual.topic.placeholder", locale=locale),
-                )
-            ]
-        )
-    ]
-    return selects
+    index = get_index()
+    return index.selects.get(locale, index.selects[config.I18n.FALLBACK])
@@ -0,0 +1,292 @@
+"""
+Interaction logic shared by the blocking and the async serving mode
+
+The functions work on data that has already been loaded, the callers do the
+database and HTTP work the way their mode does it.
+"""
+import json
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from time import monotonic
+from typing import Optional
+
+import config
+import metrics
+import responses
+import tracing
+from flask_discord_interactions import Context
+from flask_discord_interactions.discord import InteractionType
+from flask_discord_interactions.models.embed import Embed, Field
+from flask_discord_interactions.models.message import Message
+from resources import guilds, leaderboard, messages
+from translations import get_locale, set_locale, t
+from utils import HandlerTimings
+
+
+def star_error(ctx: Context, message: Message, guild: guilds.Guild, client_id: str) -> Optional[Message]:
+    """
+    :return: The reason the message can't be starred with the context menu, None if it can
+    """
+    if int(message.id) < messages.max_timestamp():
+        return Message(t("errors.too_old"), ephemeral=True)
+    if message.author.id == client_id:
+        return Message(t("errors.starboard_message"), ephemeral=True)
+    if ctx.author.id == message.author.id and guild.self_stars_allowed is False:
+        return Message(t("errors.self_star"), ephemeral=True)
+    return None
+
+
+def new_message(ctx: Context, message: Message) -> messages.Message:
+    """
+    :return: The record of a message starred with the context menu
+    """
+    return messages.Message(
+        id=message.id, guild_id=ctx.guild_id, author_id=message.author.id, channel_id=ctx.channel_id
+    )
+
+
+def star_message(ctx: Context, message: Message, data: dict) -> responses.RawMessage:
+    """
+    :param dict data: Incoming interaction data
+    :return: The message with the star button for a freshly starred message
+    """
+    resolved = data["data"]["resolved"]["messages"][message.id]
+    try:
+        attachment_url = resolved["attachments"][0]["url"]
+    except IndexError:
+        attachment_url = None
+    set_locale(ctx.guild_locale)
+    embed = {
+        "author": {
+            "name": f"{message.author.username}#{message.author.discriminator}",
+            "icon_url": message.author.avatar_url,
+        },
+        "footer": {"text": t("message.footer")},
+        "color": config.EMBED_COLOR,
+    }
+    if message.content is not None:
+        embed["description"] = message.content
+    if attachment_url:
+        embed["image"] = {"url": attachment_url}
+    return responses.RawMessage(
+        payload=responses.message_payload(
+            t("message.author", author=ctx.author.username),
+            [embed] + responses.clean_embeds(resolved.get("embeds", [])),
+            responses.star_components(message.id, 1, responses.jump_url(ctx.guild_id, ctx.channel_id, message.id)),
+        )
+    )
+
+
+def star_button_error(ctx: Context, message_id: str, guild: guilds.Guild) -> Optional[Message]:
+    """
+    :return: The reason the star button can't be clicked, None if it can
+    """
+    if int(message_id) < messages.max_timestamp():
+        return Message(t("errors.too_old"), ephemeral=True)
+    if ctx.author.id == ctx.message.author.id and not guild.self_stars_allowed:
+        return Message(t("errors.self_star"), ephemeral=True)
+    return None
+
+
+def post_builder(ctx: Context, guild: guilds.Guild, message_id: str, embeds: list):
+    """
+    :param list embeds: Embeds of the clicked message as received
+    :return: A function returning webhook url and payload of the starboard post
+    """
+
+    def build_post() -> tuple[str, dict]:
+        url = f"{config.BASE_URL}/{guild.webhook_id}/{guild.webhook_token}"
+        jump_url = responses.jump_url(ctx.guild_id, ctx.channel_id, message_id)
+        timestamp = datetime.utcnow().isoformat()
+        return url, responses.starboard_post(embeds, message_id, jump_url, timestamp, ctx.guild_locale)
+
+    return build_post
+
+
+def star_button_message(ctx: Context, message_id: str, embeds: list, result: messages.StarResult) -> Message:
+    """
+    :param list embeds: Embeds of the clicked message as received
+    :return: The answer to a star click with its authoritative result
+    """
+    if not result.added:
+        if result.sent:
+            return Message(t("errors.starboard_message"), ephemeral=True)
+        return Message(t("errors.starred_twice"), ephemeral=True)
+    set_locale(ctx.guild_locale)
+    content = t("message.author", author=ctx.author.username)
+    url = responses.jump_url(ctx.guild_id, ctx.channel_id, message_id)
+    if not result.claimed:
+        return responses.star_update(
+            content,
+            responses.with_footer(embeds, t("message.footer")),
+            responses.star_components(message_id, result.stars, url),
+        )
+    return responses.star_update(
+        content, responses.clean_embeds(embeds), responses.star_components(message_id, result.stars, url, disabled=True)
+    )
+
+
+def settings_changes(
+    guild: guilds.Guild, stars: int = None, allow_self_stars: bool = None, delete_message: bool = None
+) -> dict:
+    """
+    :return: The changed settings as arguments of :func:`guilds.update`
+    """
+    changes = {}
+    if stars:
+        changes["required_stars"] = stars
+    set_flags = clear_flags = 0
+    for flag, value in ((1 << 0, allow_self_stars), (1 << 1, delete_message)):
+        if value is not None and value != bool(guild.flags & flag):
+            if value:
+                set_flags |= flag
+            else:
+                clear_flags |= flag
+    if set_flags:
+        changes["set_flags"] = set_flags
+    if clear_flags:
+        changes["clear_flags"] = clear_flags
+    return changes
+
+
+def settings_message(guild: guilds.Guild) -> Message:
+    """
+    :return: The overview of a guild's settings
+    """
+    return Message(
+        t("settings.success"),
+        embed=Embed(
+            fields=[
+                Field(t("settings.required_stars"), str(guild.required_stars)),
+                Field(t("settings.allow_self_stars"), "✅" if guild.self_stars_allowed is True else "⛔"),
+                Field(t("settings.delete_message"), "✅" if guild.delete_own_messages is True else "⛔"),
+            ],
+            color=config.EMBED_COLOR,
+        ),
+        ephemeral=True,
+    )
+
+
+def leaderboard_message(ctx: Context, board: leaderboard.Leaderboard) -> Message:
+    """
+    :return: The most starred messages and users of a guild
+    """
+    if not board.messages and not board.users:
+        return Message(t("leaderboard.empty"), ephemeral=True)
+    set_locale(ctx.guild_locale)
+    top_messages = []
+    for place, (message_id, channel_id, stars) in enumerate(board.messages, 1):
+        # messages starred before channels were stored can't be linked
+        link = message_id
+        if channel_id:
+            link = f"[{t('message.jump')}]({responses.jump_url(ctx.guild_id, channel_id, message_id)})"
+        top_messages.append(f"{place}. ⭐ {stars} · {link}")
+    top_users = [
+        f"{place}. <@{user_id}> ⭐ {stars} · {t('leaderboard.posts', count=posts)}"
+        for place, (user_id, stars, posts) in enumerate(board.users, 1)
+    ]
+    # the statistics of users can outlive their purged messages, and an embed field can't be empty
+    fields = [Field(t("leaderboard.messages"), "\n".join(top_messages) or t("leaderboard.no_stars"))]
+    if top_users:
+        fields.append(Field(t("leaderboard.users"), "\n".join(top_users)))
+    return Message(embed=Embed(title=t("leaderboard.title"), fields=fields, color=config.EMBED_COLOR))
+
+
+def remaining(started: float) -> float:
+    """
+    :param float started: Monotonic time the interaction was received at
+    :return: Seconds left until Discord's response deadline
+    """
+    return config.Interactions.DEADLINE - (monotonic() - started)
+
+
+@contextmanager
+def measured(timings: HandlerTimings, name: str, data: dict):
+    """
+    Traces a run of a command or handler and records how long it took and whether it failed
+    """
+    started = monotonic()
+    try:
+        with tracing.trace(data["id"], name):
+            yield
+    except Exception:
+        metrics.HANDLER_ERRORS.inc(name)
+        raise
+    finally:
+        timings.record(name, monotonic() - started)
+        metrics.HANDLER_DURATION.observe(monotonic() - started, name)
+
+
+def deferred(name: str, update: bool) -> Message:
+    """
+    :param bool update: Whether the deferred response updates the clicked message
+    :return: The deferred response of a command or handler that misses the deadline
+    """
+    logging.warning("Deferring the response to %s", name)
+    metrics.HANDLER_DEFERRED.inc(name)
+    return Message(deferred=True, update=update)
+
+
+def answer_duplicate(interaction_id: str, response: str) -> str:
+    """
+    :return: The earlier response a duplicate interaction is answered with
+    """
+    metrics.DUPLICATE_INTERACTIONS.inc("answered")
+    logging.info("Answering the duplicate interaction %s with its earlier response", interaction_id)
+    return response
+
+
+def error_response(error: Exception) -> Optional[bytes]:
+    """
+    :return: The serialized response of an error that has one, None for unexpected errors
+    """
+    if isinstance(error, guilds.GuildNotFound):
+        return responses.guild_not_found(get_locale())
+    return None
+
+
+def followup_body(data: dict, result: Message = None, error: Exception = None) -> Optional[tuple[bytes, str, bool]]:
+    """
+    :param dict data: Incoming interaction data
+    :param result: The message of a deferred command or handler that finished
+    :param error: The error of one that failed instead
+    :return: Body, mimetype and whether it's ephemeral of the followup, None if the error has no response
+    """
+    if error is None:
+        body, mimetype = result.encode(followup=True)
+        return body, mimetype, result.ephemeral
+    # errors that have a response still get their message
+    response = error_response(error)
+    if response is None:
+        logging.error("Deferred interaction %s failed", data["id"], exc_info=error)
+        return None
+    payload = json.loads(response)["data"]
+    return json.dumps(payload).encode(), "application/json", bool(payload["flags"] & 64)
+
+
+def followup_requests(
+    data: dict, client_id: str, body: bytes, mimetype: str, ephemeral: bool
+) -> list[tuple[str, str, dict]]:
+    """
+    :param dict data: Incoming interaction data
+    :return: Method, url and arguments of the requests replacing a deferred response with its result
+    """
+    followup_url = f"{config.BASE_URL}/{client_id}/{data['token']}"
+    sent = {"data": body, "headers": {"Content-Type": mimetype}}
+    if not ephemeral:
+        return [("PATCH", f"{followup_url}/messages/@original", sent)]
+    requests = []
+    if data["type"] == InteractionType.APPLICATION_COMMAND:
+        # the deferred response is public, so it gets replaced by an ephemeral followup
+        requests.append(("DELETE", f"{followup_url}/messages/@original", {}))
+    requests.append(("POST", followup_url, sent))
+    return requests
+
+
+def followup_delays() -> list[float]:
+    """
+    :return: Seconds to wait before every attempt of a followup request, later ones are only made after a 404
+    """
+    delay = config.Interactions.FOLLOWUP_RETRY_DELAY
+    return [0.0] + [delay * 2**attempt for attempt in range(config.Interactions.FOLLOWUP_RETRIES)]
@@ -0,0 +1,352 @@
+"""
+Shared HTTP client for all requests to Discord
+
+Connections are kept alive per host and the ``X-RateLimit`` headers of every response
+are tracked per route, so requests wait for their bucket to refill instead of being
+rejected with a 429.
+"""
+import asyncio
+import re
+import threading
+from dataclasses import dataclass
+from os import getpid
+from time import monotonic, sleep
+from urllib.parse import urlsplit
+
+import config
+import metrics
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# ids in these positions select their own rate limit bucket
+MAJOR_PARAMETERS = re.compile(r"^/(?:api/v\d+/)?((?:channels|guilds)/\d+|webhooks/\d+(?:/[^/]+)?)")
+SNOWFLAKE = re.compile(r"/\d{16,20}")
+WEBHOOK_TOKEN = re.compile(r"(/webhooks/\{id\})/[^/]+")
+
+
+class RateLimited(Exception):
+    """
+    Exception raised when a request would have to wait longer than allowed for its bucket
+
+    :ivar float retry_after: Seconds until the bucket refills
+    """
+
+    def __init__(self, route: str, retry_after: float):
+        super().__init__(route, retry_after)
+        self.route = route
+        self.retry_after = retry_after
+
+    def __str__(self) -> str:
+        return f"Rate limited on {self.route} for {self.retry_after:.1f}s"
+
+
+@dataclass
+class Bucket:
+    """
+    :ivar int remaining: Requests left until the bucket resets, None if unknown
+    :ivar float reset_at: Monotonic time the bucket resets at
+    """
+
+    remaining: int = None
+    reset_at: float = 0.0
+
+
+def route_key(method: str, url: str) -> tuple[str, str]:
+    """
+    Builds the rate limit route of a request
+
+    Discord limits per route and per major parameter, the route has every id and webhook
+    token replaced by a placeholder while the major parameter keeps the channel, guild or
+    webhook, including its token.
+
+    :param str method: HTTP method
+    :param str url: Request url
+    :return: The request's route and its major parameter, empty if it has none
+    """
+    parts = urlsplit(url)
+    major = MAJOR_PARAMETERS.match(parts.path)
+    return f"{method.upper()} {parts.netloc}{route_template(url)}", major.group(1) if major else ""
+
+
+def route_template(url: str) -> str:
+    """
+    :return: The request's path with ids and webhook tokens replaced by placeholders
+    """
+    return WEBHOOK_TOKEN.sub(r"\1/{token}", SNOWFLAKE.sub("/{id}", urlsplit(url).path))
+
+
+def record(method: str, url: str, status, duration: float) -> None:
+    """
+    Records the duration and status of a request to Discord
+    """
+    route = route_template(url)
+    metrics.DISCORD_REQUEST_DURATION.observe(duration, method, route)
+    metrics.DISCORD_RESPONSES.inc(method, route, status)
+
+
+class RateLimiter:
+    """
+    Keeps track of Discord's rate limit buckets
+
+    Routes sharing a bucket according to the ``X-RateLimit-Bucket`` header share its counters,
+    separately per major parameter like Discord counts them. Buckets are forgotten once they
+    reset, so unique webhook and interaction tokens don't pile up.
+
+    :param float prune_interval: Seconds between two sweeps of the buckets that reset
+    """
+
+    def __init__(self, prune_interval: float = 10.0):
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._buckets = {}
+        self._global_reset_at = 0.0
+        self._pruned_at = monotonic()
+
+    def _key(self, route: str, major: str) -> tuple[str, str]:
+        return self._routes.get(route, route), major
+
+    def _prune(self, now: float) -> None:
+        if now - self._pruned_at < self.prune_interval:
+            return
+        self._pruned_at = now
+        # a bucket that reset doesn't limit anything until the next response tells its state again
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket.reset_at > now}
+
+    def reserve(self, route: str, major: str = "") -> float:
+        """
+        Takes a request from the route's bucket if it has one left
+
+        :return: 0 if the request may be sent, otherwise the seconds to wait before trying again
+        """
+        with self._lock:
+            now = monotonic()
+            wait = max(self._global_reset_at - now, 0.0)
+            bucket = self._buckets.get(self._key(route, major))
+            if bucket is None or bucket.reset_at <= now or bucket.remaining is None:
+                return wait
+            if bucket.remaining <= 0:
+                wait = max(wait, bucket.reset_at - now)
+            if wait <= 0:
+                bucket.remaining -= 1
+            return wait
+
+    def acquire(self, route: str, major: str, max_wait: float) -> None:
+        """
+        Blocks until a request on the route may be sent
+
+        :raises RateLimited: In case that would take longer than ``max_wait`` seconds
+        """
+        while True:
+            wait = self.reserve(route, major)
+            if wait <= 0:
+                return
+            if wait > max_wait:
+                raise RateLimited(route, wait)
+            sleep(wait)
+
+    def update(self, route: str, major: str, status_code: int, headers) -> None:
+        """
+        Updates the route's bucket from the status and headers of a response
+        """
+        with self._lock:
+            now = monotonic()
+            self._prune(now)
+            if "X-RateLimit-Bucket" in headers:
+                self._routes[route] = headers["X-RateLimit-Bucket"]
+            bucket = self._buckets.setdefault(self._key(route, major), Bucket())
+            if "X-RateLimit-Remaining" in headers:
+                bucket.remaining = int(headers["X-RateLimit-Remaining"])
+            if "X-RateLimit-Reset-After" in headers:
+                bucket.reset_at = now + float(headers["X-RateLimit-Reset-After"])
+            if status_code == 429:
+                retry_after = float(headers.get("Retry-After", 0))
+                if headers.get("X-RateLimit-Global", "").lower() == "true":
+                    self._global_reset_at = now + retry_after
+                else:
+                    bucket.remaining = 0
+                    bucket.reset_at = max(bucket.reset_at, now + retry_after)
+
+    def stats(self) -> dict:
+        """
+        :return: Number of known buckets and routes
+        """
+        with self._lock:
+            return {"buckets": len(self._buckets), "routes": len(self._routes)}
+
+
+class Client:
+    """
+    A keep-alive HTTP session that respects Discord's rate limits
+
+    :param int pool_size: Connections kept open per host
+    :param float timeout: Default request timeout in seconds
+    :param float max_wait: Longest time a request waits for its rate limit bucket
+    """
+
+    def __init__(self, pool_size: int, timeout: float, max_wait: float):
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.pid = getpid()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.rate_limits = RateLimiter()
+
+    def request(self, method: str, url: str, max_wait: float = None, **kwargs) -> requests.Response:
+        """
+        Sends a request once its rate limit bucket allows it
+
+        :param str method: HTTP method
+        :param str url: Request url
+        :param float max_wait: Overrides the client's maximum rate limit wait
+        :param kwargs: Passed to :meth:`requests.Session.request`
+        :raises RateLimited: In case the bucket doesn't refill in time
+        :return: The response
+        """
+        route, major = route_key(method, url)
+        self.rate_limits.acquire(route, major, self.max_wait if max_wait is None else max_wait)
+        kwargs.setdefault("timeout", self.timeout)
+        started = monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            record(method, url, "error", monotonic() - started)
+            raise
+        record(method, url, response.status_code, monotonic() - started)
+        self.rate_limits.update(route, major, response.status_code, response.headers)
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Sends a GET request"""
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """Sends a POST request"""
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> requests.Response:
+        """Sends a PATCH request"""
+        return self.request("PATCH", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        """Sends a PUT request"""
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        """Sends a DELETE request"""
+        return self.request("DELETE", url, **kwargs)
+
+
+_client: Client = None  # pylint: disable=invalid-name
+_client_lock = threading.Lock()
+
+
+def get_client() -> Client:
+    """
+    Returns the HTTP client of the current process, creating it on first use
+    """
+    global _client  # pylint: disable=global-statement
+    if _client is None or _client.pid != getpid():
+        with _client_lock:
+            if _client is None or _client.pid != getpid():
+                _client = Client(config.Http.POOL_SIZE, config.Http.TIMEOUT, config.Http.MAX_RATE_LIMIT_WAIT)
+    return _client
+
+
+class AsyncClient:
+    """
+    Non-blocking counterpart of :class:`Client` for the async serving mode
+
+    Requests share the rate limit buckets of the process' blocking client, which
+    keeps posting to the starboards in the background.
+
+    :param int connections: Maximum number of open connections
+    :param float timeout: Default request timeout in seconds
+    :param float max_wait: Longest time a request waits for its rate limit bucket
+    :param RateLimiter rate_limits: Buckets to share
+    """
+
+    def __init__(self, connections: int, timeout: float, max_wait: float, rate_limits: RateLimiter):
+        if aiohttp is None:
+            raise ImportError("The aiohttp module is required for the async serving mode")
+        self.max_wait = max_wait
+        self.rate_limits = rate_limits
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=connections), timeout=aiohttp.ClientTimeout(total=timeout)
+        )
+
+    async def request(self, method: str, url: str, max_wait: float = None, **kwargs):
+        """
+        Sends a request once its rate limit bucket allows it
+
+        :param str method: HTTP method
+        :param str url: Request url
+        :param float max_wait: Overrides the client's maximum rate limit wait
+        :param kwargs: Passed to :meth:`aiohttp.ClientSession.request`
+        :raises RateLimited: In case the bucket doesn't refill in time
+        :return: The response with its body already read
+        """
+        route, major = route_key(method, url)
+        max_wait = self.max_wait if max_wait is None else max_wait
+        while (wait := self.rate_limits.reserve(route, major)) > 0:
+            if wait > max_wait:
+                raise RateLimited(route, wait)
+            await asyncio.sleep(wait)
+        started = monotonic()
+        try:
+            async with self.session.request(method, url, **kwargs) as response:
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            record(method, url, "error", monotonic() - started)
+            raise
+        record(method, url, response.status, monotonic() - started)
+        self.rate_limits.update(route, major, response.status, response.headers)
+        return response
+
+    async def post(self, url: str, **kwargs):
+        """Sends a POST request"""
+        return await self.request("POST", url, **kwargs)
+
+    async def patch(self, url: str, **kwargs):
+        """Sends a PATCH request"""
+        return await self.request("PATCH", url, **kwargs)
+
+    async def delete(self, url: str, **kwargs):
+        """Sends a DELETE request"""
+        return await self.request("DELETE", url, **kwargs)
+
+    async def close(self) -> None:
+        """Closes all connections"""
+        await self.session.close()
+
+
+_async_clients = {}
+
+
+def get_async_client() -> AsyncClient:
+    """
+    Returns the async HTTP client of the running event loop, creating it on first use
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncClient(
+            config.Asgi.HTTP_CONNECTIONS, config.Http.TIMEOUT, config.Http.MAX_RATE_LIMIT_WAIT, get_client().rate_limits
+        )
+    return client
+
+
+async def close_async_client() -> None:
+    """
+    Closes the async HTTP client of the running event loop
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
@@ -0,0 +1,179 @@
+"""
+Metrics in the Prometheus text format
+
+Counters and histograms are plain in-process numbers behind a lock, so recording is
+cheap enough to always be on. Gauges are read from their callback when scraped. Every
+worker process keeps its own metrics.
+"""
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import monotonic
+
+# seconds, from a cached guild lookup up to a stalled webhook
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def escape(value) -> str:
+    """Escapes a label value"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    """
+    :return: The label set of a sample, empty if there are no labels
+    """
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    A value that only goes up
+
+    :param str name: Metric name
+    :param str documentation: Help text
+    :param tuple labels: Names of the labels
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *values, amount: float = 1) -> None:
+        """Increments the counter of the label values"""
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def samples(self):
+        """Yields the lines of every label set"""
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}_total{format_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    """
+    Distribution of observed values in fixed buckets
+
+    :param str name: Metric name
+    :param str documentation: Help text
+    :param tuple labels: Names of the labels
+    :param tuple buckets: Upper bounds of the buckets
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, amount: float, *values) -> None:
+        """Records a value for the label values"""
+        index = bisect_left(self.buckets, amount)
+        with self._lock:
+            counts = self._values.get(values)
+            if counts is None:
+                # one count per bucket, the overflow bucket, and the sum
+                counts = self._values[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += amount
+
+    @contextmanager
+    def time(self, *values):
+        """Context manager observing the duration of its block"""
+        started = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(monotonic() - started, *values)
+
+    def samples(self):
+        """Yields the cumulative bucket, sum and count lines of every label set"""
+        with self._lock:
+            values = [(label_values, list(counts)) for label_values, counts in self._values.items()]
+        for label_values, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = format_labels(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {counts[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:  # pylint: disable=too-few-public-methods
+    """
+    A value read when scraped
+
+    :param str name: Metric name
+    :param str documentation: Help text
+    :param tuple labels: Names of the labels
+    :param collect: Returns the current values by their label values
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.collect = collect
+        _registry.append(self)
+
+    def samples(self):
+        """Yields the current value of every label set"""
+        for label_values, value in self.collect().items():
+            yield f"{self.name}{format_labels(self.labels, label_values)} {value}"
+
+
+def render() -> str:
+    """
+    :return: All metrics in the Prometheus text format, gauges that fail to collect are left out
+    """
+    lines = []
+    for metric in _registry:
+        try:
+            samples = list(metric.samples())
+        except Exception:  # pylint: disable=broad-except
+            continue
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_DURATION = Histogram(
+    "starboard_handler_duration_seconds", "Time commands and component handlers took", ("handler",)
+)
+HANDLER_DEFERRED = Counter("starboard_handler_deferred", "Responses deferred for missing the deadline", ("handler",))
+HANDLER_ERRORS = Counter("starboard_handler_errors", "Commands and handlers that raised", ("handler",))
+DUPLICATE_INTERACTIONS = Counter(
+    "starboard_duplicate_interactions", "Interactions received again, answered or still pending", ("outcome",)
+)
+DB_QUERY_DURATION = Histogram("starboard_db_query_duration_seconds", "Time database calls took", ("function",))
+DB_QUERIES = Histogram(
+    "starboard_db_queries", "Statements run per interaction", ("handler",), (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50)
+)
+DISCORD_REQUEST_DURATION = Histogram(
+    "starboard_discord_request_duration_seconds", "Time requests to Discord took", ("method", "route")
+)
+DISCORD_RESPONSES = Counter("starboard_discord_responses", "Responses from Discord", ("method", "route", "status"))
+STARBOARD_POSTS = Counter("starboard_posts", "Messages queued for the starboard", ("guild",))
@@ -0,0 +1,307 @@
+"""
+Versioned database migrations
+
+Run with ``python3 migrations.py`` from the app directory, or set ``DATABASE_MIGRATE=true``
+to apply them when the bot starts. The steps below are those of the MySQL backend and
+are applied in the order of their version, each one once. The applied versions are kept
+in the schema_migrations table. The SQLite backend keeps its own steps in
+:mod:`resources.sqlite_backend`.
+"""
+import argparse
+import logging
+
+import config
+from resources import database
+from resources.storage import get_backend
+
+BATCH_SIZE = 500
+# the lock the workers starting at the same time wait for, in seconds
+LOCK_TIMEOUT = 60
+
+
+def has_column(table: str, column: str) -> bool:
+    """
+    :return: Whether the table of the current database has the column
+    """
+    return (
+        database.fetchone(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema=DATABASE() AND table_name=%s AND column_name=%s",
+            (table, column),
+        )
+        is not None
+    )
+
+
+def has_index(table: str, index: str) -> bool:
+    """
+    :return: Whether the table of the current database has the index
+    """
+    return (
+        database.fetchone(
+            "SELECT 1 FROM information_schema.statistics "
+            "WHERE table_schema=DATABASE() AND table_name=%s AND index_name=%s",
+            (table, index),
+        )
+        is not None
+    )
+
+
+def add_column(table: str, column: str, definition: str) -> None:
+    """
+    Adds a column unless the table has it already, MySQL doesn't know ``ADD COLUMN IF NOT EXISTS``
+    """
+    if not has_column(table, column):
+        database.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def add_index(table: str, index: str, columns: str) -> None:
+    """
+    Adds an index unless the table has it already, MySQL doesn't know ``ADD INDEX IF NOT EXISTS``
+    """
+    if not has_index(table, index):
+        database.execute(f"ALTER TABLE {table} ADD INDEX {index} ({columns})")
+
+
+def create_base_tables() -> None:
+    """
+    Creates the guilds and messages tables in the shape they had before there were migrations
+    """
+    database.execute(
+        "CREATE TABLE IF NOT EXISTS guilds ("
+        "id VARCHAR(32) NOT NULL PRIMARY KEY, "
+        "webhook_id VARCHAR(32), "
+        "webhook_token VARCHAR(128), "
+        "required_stars INT NOT NULL DEFAULT 3, "
+        "flags INT NOT NULL DEFAULT 0)"
+    )
+    database.execute(
+        "CREATE TABLE IF NOT EXISTS messages (id VARCHAR(32) NOT NULL PRIMARY KEY, flags INT NOT NULL DEFAULT 0)"
+    )
+
+
+def create_star_votes() -> None:
+    """
+    Creates the star_votes table and the stars counter of messages
+    """
+    database.execute(
+        "CREATE TABLE IF NOT EXISTS star_votes ("
+        "message_id BIGINT UNSIGNED NOT NULL, "
+        "user_id BIGINT UNSIGNED NOT NULL, "
+        "PRIMARY KEY (message_id, user_id))"
+    )
+    add_column("messages", "stars", "INT UNSIGNED NOT NULL DEFAULT 0")
+
+
+def convert_star_users() -> None:
+    """
+    Moves the ``;`` separated star_users strings into star_votes and drops the old column
+    """
+    if database.fetchone("SHOW COLUMNS FROM messages LIKE 'star_users'") is None:
+        return
+    last_id = ""
+    converted = 0
+    while True:
+        records = database.fetchall(
+            "SELECT id, star_users FROM messages WHERE id > %s ORDER BY id LIMIT %s", (last_id, BATCH_SIZE)
+        )
+        if not records:
+            break
+        with database.transaction() as cur:
+            for record in records:
+                users = {user for user in (record["star_users"] or "").split(";") if user}
+                cur.executemany(
+                    "INSERT IGNORE INTO star_votes (message_id, user_id) VALUES (%s, %s)",
+                    [(record["id"], user) for user in users],
+                )
+                cur.execute(
+                    "UPDATE messages SET stars=(SELECT COUNT(*) FROM star_votes WHERE message_id=%s) WHERE id=%s",
+                    (record["id"], record["id"]),
+                )
+        converted += len(records)
+        last_id = records[-1]["id"]
+    database.execute("ALTER TABLE messages DROP COLUMN star_users")
+    logging.info("Converted the star users of %s messages", converted)
+
+
+def create_outbox() -> None:
+    """
+    Creates the table of starboard posts waiting for delivery
+    """
+    database.execute(
+        "CREATE TABLE IF NOT EXISTS outbox ("
+        "id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY, "
+        "message_id BIGINT UNSIGNED NOT NULL, "
+        "url VARCHAR(255) NOT NULL, "
+        "payload MEDIUMTEXT NOT NULL, "
+        "attempts SMALLINT UNSIGNED NOT NULL DEFAULT 0, "
+        "failed BOOLEAN NOT NULL DEFAULT 0, "
+        "last_error VARCHAR(255), "
+        "created_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6), "
+        "next_attempt_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6), "
+        "delivered_at DATETIME(6), "
+        "INDEX pending (delivered_at, failed, next_attempt_at))"
+    )
+
+
+def create_scheduled_tasks() -> None:
+    """
+    Creates the table of persisted scheduled tasks
+    """
+    database.execute(
+        "CREATE TABLE IF NOT EXISTS scheduled_tasks ("
+        "id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY, "
+        "name VARCHAR(64) NOT NULL, "
+        "run_at DOUBLE NOT NULL, "
+        "kwargs TEXT NOT NULL)"
+    )
+
+
+def add_retention_columns() -> None:
+    """
+    Adds the guild of a message and the retention of a guild
+    """
+    add_column("messages", "guild_id", "BIGINT UNSIGNED")
+    add_column("guilds", "retention_days", "SMALLINT UNSIGNED")
+
+
+def use_bigint_snowflakes() -> None:
+    """
+    Stores the snowflakes of guilds and messages as numbers and shrinks the other columns
+
+    A BIGINT takes 8 bytes instead of up to 33, and is what star_votes and outbox already
+    compare the message ids with.
+    """
+    database.execute(
+        "ALTER TABLE guilds "
+        "MODIFY id BIGINT UNSIGNED NOT NULL, "
+        "MODIFY webhook_id BIGINT UNSIGNED, "
+        "MODIFY webhook_token VARCHAR(128) CHARACTER SET ascii COLLATE ascii_bin, "
+        "MODIFY required_stars SMALLINT UNSIGNED NOT NULL DEFAULT 3, "
+        "MODIFY flags TINYINT UNSIGNED NOT NULL DEFAULT 0"
+    )
+    database.execute(
+        "ALTER TABLE messages "
+        "MODIFY id BIGINT UNSIGNED NOT NULL, "
+        "MODIFY flags TINYINT UNSIGNED NOT NULL DEFAULT 0"
+    )
+
+
+def add_outbox_purge_index() -> None:
+    """
+    Indexes the creation time of posts, which the purge of finished posts looks them up by
+    """
+    add_index("outbox", "created", "created_at")
+
+
+def add_star_stats() -> None:
+    """
+    Adds the author and channel of messages and the star statistics of users
+
+    Messages starred earlier have no author, so they only show up in the top messages.
+    """
+    add_column("messages", "author_id", "BIGINT UNSIGNED")
+    add_column("messages", "channel_id", "BIGINT UNSIGNED")
+    add_index("messages", "top_messages", "guild_id, stars")
+    database.execute(
+        "CREATE TABLE IF NOT EXISTS star_stats ("
+        "guild_id BIGINT UNSIGNED NOT NULL, "
+        "user_id BIGINT UNSIGNED NOT NULL, "
+        "stars INT NOT NULL DEFAULT 0, "
+        "posts INT NOT NULL DEFAULT 0, "
+        "PRIMARY KEY (guild_id, user_id), "
+        "INDEX top_users (guild_id, stars))"
+    )
+
+
+def create_interactions() -> None:
+    """
+    Creates the table of recently handled interactions and their responses
+    """
+    database.execute(
+        "CREATE TABLE IF NOT EXISTS interactions ("
+        "id BIGINT UNSIGNED NOT NULL PRIMARY KEY, "
+        "response MEDIUMTEXT, "
+        "created_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6), "
+        "INDEX created (created_at))"
+    )
+
+
+# append only: a deployed version is never changed or reused
+MIGRATIONS = (
+    (1, create_base_tables),
+    (2, create_star_votes),
+    (3, convert_star_users),
+    (4, create_outbox),
+    (5, create_scheduled_tasks),
+    (6, add_retention_columns),
+    (7, use_bigint_snowflakes),
+    (8, add_outbox_purge_index),
+    (9, add_star_stats),
+    (10, create_interactions),
+)
+
+
+def applied_versions() -> set:
+    """
+    :return: The versions applied to the MySQL database
+    """
+    database.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version SMALLINT UNSIGNED NOT NULL PRIMARY KEY, "
+        "name VARCHAR(64) NOT NULL, "
+        "applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+    return {record["version"] for record in database.fetchall("SELECT version FROM schema_migrations")}
+
+
+def migrate_mysql() -> None:
+    """
+    Applies the pending migrations of the MySQL backend
+
+    Migrations from before the versions were recorded are written to be repeatable, so a
+    database without the schema_migrations table goes through all of them.
+    """
+    with get_backend().exclusive("starboard_migrations", wait=LOCK_TIMEOUT) as acquired:
+        if not acquired:
+            raise TimeoutError("Another worker is still migrating the database")
+        applied = applied_versions()
+        pending = [(version, step) for version, step in MIGRATIONS if version not in applied]
+        for version, step in pending:
+            logging.info("Applying migration %s (%s)", version, step.__name__)
+            # MySQL commits schema changes right away, so a failed step is retried as a whole
+            step()
+            database.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, step.__name__))
+        logging.info("The MySQL database is at version %s, %s migrations applied", MIGRATIONS[-1][0], len(pending))
+
+
+def mysql_status() -> list[tuple]:
+    """
+    :return: Version, name and whether it is applied of every migration of the MySQL backend
+    """
+    applied = applied_versions()
+    return [(version, step.__name__, version in applied) for version, step in MIGRATIONS]
+
+
+def migrate() -> None:
+    """
+    Brings the schema of the configured storage backend up to date
+    """
+    get_backend().migrate()
+
+
+def main() -> None:
+    """Migrates or lists the migrations with the options of the command line"""
+    logging.basicConfig(level=logging.INFO, format=config.LOG_FORMAT)
+    parser = argparse.ArgumentParser(description="Apply the pending database migrations")
+    parser.add_argument("--list", action="store_true", help="only list the migrations and whether they are applied")
+    args = parser.parse_args()
+    if args.list:
+        for version, name, applied in get_backend().migrations():
+            print(f"{version:>4} {'applied' if applied else 'pending'} {name}")
+    else:
+        migrate()
+
+
+if __name__ == "__main__":
+    main()
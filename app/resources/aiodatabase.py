@@ -0,0 +1,131 @@
+"""
+Non-blocking database access for the async serving mode
+
+The functions mirror :mod:`resources.database`, queries and their placeholders are the same.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+import config
+import metrics
+import tracing
+from resources.database import PoolTimeout
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+_pools = {}
+_pool_locks = {}
+
+
+async def get_pool():
+    """
+    Returns the connection pool of the running event loop, creating it on first use
+    """
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        async with _pool_locks.setdefault(loop, asyncio.Lock()):
+            pool = _pools.get(loop)
+            if pool is None:
+                if aiomysql is None:
+                    raise ImportError("The aiomysql module is required for the async serving mode")
+                pool = _pools[loop] = await aiomysql.create_pool(
+                    minsize=1,
+                    maxsize=config.Asgi.DB_POOL_SIZE,
+                    autocommit=True,
+                    pool_recycle=3600,
+                    host=config.DATABASE_ARGS["host"],
+                    port=config.DATABASE_ARGS["port"],
+                    user=config.DATABASE_ARGS["user"],
+                    password=config.DATABASE_ARGS["passwd"] or "",
+                    db=config.DATABASE_ARGS["database"],
+                )
+    return pool
+
+
+async def close_pool() -> None:
+    """
+    Closes the connection pool of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    _pool_locks.pop(loop, None)
+    pool = _pools.pop(loop, None)
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+
+
+@asynccontextmanager
+async def connection(function: str = "connection"):
+    """
+    Context manager borrowing a connection for the duration of the block
+
+    :param str function: Name the time of the block is recorded under
+    :raises PoolTimeout: In case no connection got free in time
+    """
+    with metrics.DB_QUERY_DURATION.time(f"aiodatabase.{function}"):
+        pool = await get_pool()
+        try:
+            con = await asyncio.wait_for(pool.acquire(), config.Database.POOL_TIMEOUT)
+        except asyncio.TimeoutError as error:
+            raise PoolTimeout() from error
+        try:
+            yield con
+        finally:
+            pool.release(con)
+
+
+async def execute(query: str, args=None) -> int:
+    """
+    Executes a query
+
+    :return: The number of affected rows
+    """
+    async with connection("execute") as con:
+        async with con.cursor() as cur:
+            with tracing.statement(query, args):
+                await cur.execute(query, args)
+            return cur.rowcount
+
+
+async def fetchall(query: str, args=None) -> list:
+    """
+    Fetches all results from a query
+    """
+    async with connection("fetchall") as con:
+        async with con.cursor(aiomysql.DictCursor) as cur:
+            with tracing.statement(query, args):
+                await cur.execute(query, args)
+            return await cur.fetchall()
+
+
+async def fetchone(query: str, args=None) -> dict:
+    """
+    Fetches a single result from a query
+    """
+    async with connection("fetchone") as con:
+        async with con.cursor(aiomysql.DictCursor) as cur:
+            with tracing.statement(query, args):
+                await cur.execute(query, args)
+            return await cur.fetchone()
+
+
+@asynccontextmanager
+async def transaction():
+    """
+    Context manager yielding a cursor whose statements are committed together
+
+    Everything is rolled back if the block raises. The statements are traced one by one.
+    """
+    async with connection("transaction") as con:
+        await con.begin()
+        try:
+            async with con.cursor(aiomysql.DictCursor) as cur:
+                yield tracing.AsyncTracedCursor(cur)
+        except BaseException:
+            await con.rollback()
+            raise
+        await con.commit()
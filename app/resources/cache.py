@@ -0,0 +1,94 @@
+"""
+In-process caches for rarely changing rows
+"""
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class TTLCache:
+    """
+    A thread safe LRU cache whose entries expire after a fixed time
+
+    :param int maxsize: Maximum number of entries before the least recently used one is evicted
+    :param float ttl: Seconds an entry stays valid
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        :return: The cached value or None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self) -> int:
+        """
+        :return: A counter of the invalidations, taken before loading a value to pass to :meth:`set`
+        """
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, generation: int = None) -> None:
+        """
+        Stores a value, evicting the least recently used entry if the cache is full
+
+        :param int generation: The :meth:`generation` from before the value was loaded, a value loaded
+            before an invalidation may be outdated and isn't stored
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key) -> None:
+        """
+        Removes a single entry
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+
+    def clear(self) -> None:
+        """
+        Removes all entries
+        """
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+    def stats(self) -> dict:
+        """
+        :return: Size and hit rate counters of the cache
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
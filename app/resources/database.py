@@ -1,27 +1,211 @@
 """
 This module contains the database connection
 """
+import logging
+import threading
+from contextlib import contextmanager
+from os import getpid
+from time import monotonic
+
 import config
+import metrics
 import mysql.connector
+import tracing
+from mysql.connector import errors
+
+
+class PoolTimeout(Exception):
+    """
+    Exception raised when no connection could be borrowed from the pool in time
+    """
+
+    def __str__(self) -> str:
+        return "Timed out waiting for a database connection"
 
 
-def execute(query: str, args=None) -> None:
+class ConnectionPool:
+    """
+    A small blocking connection pool
+
+    Connections are created lazily up to ``size``, pinged when borrowed and
+    replaced transparently if the server dropped them in the meantime.
+
+    :param int size: Maximum number of open connections
+    :param float timeout: Seconds to wait for a free connection before giving up
+    :param connect_args: Arguments passed to :func:`mysql.connector.connect`
+    """
+
+    def __init__(self, size: int, timeout: float, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.connect_args = connect_args
+        self.pid = getpid()
+        self._idle = []
+        self._lock = threading.Condition()
+        self._checked_out = 0
+        self._waiting = 0
+        self._created = 0
+        self._reconnects = 0
+
+    def _connect(self):
+        con = mysql.connector.connect(**self.connect_args)
+        con.autocommit = True
+        with self._lock:
+            self._created += 1
+        return con
+
+    def _healthy(self, con) -> bool:
+        try:
+            con.ping(reconnect=True, attempts=1)
+        except errors.Error:
+            return False
+        return True
+
+    def acquire(self):
+        """
+        Borrow a connection, blocking up to ``timeout`` seconds
+
+        :raises PoolTimeout: In case no connection got free in time
+        :return: An open connection
+        """
+        deadline = monotonic() + self.timeout
+        with self._lock:
+            self._waiting += 1
+            try:
+                while not self._idle and self._checked_out >= self.size:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0 or not self._lock.wait(remaining):
+                        raise PoolTimeout()
+                self._checked_out += 1
+                con = self._idle.pop() if self._idle else None
+            finally:
+                self._waiting -= 1
+        try:
+            if con is None:
+                return self._connect()
+            if not self._healthy(con):
+                logging.info("Replacing a dropped database connection")
+                self._discard(con)
+                with self._lock:
+                    self._reconnects += 1
+                return self._connect()
+        except Exception:
+            with self._lock:
+                self._checked_out -= 1
+                self._lock.notify()
+            raise
+        return con
+
+    def release(self, con, broken: bool = False) -> None:
+        """
+        Return a connection to the pool
+
+        :param con: The connection to return
+        :param bool broken: Close the connection instead of keeping it
+        """
+        if broken:
+            self._discard(con)
+        with self._lock:
+            self._checked_out -= 1
+            if not broken:
+                self._idle.append(con)
+            self._lock.notify()
+
+    @staticmethod
+    def _discard(con) -> None:
+        try:
+            con.close()
+        except errors.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager borrowing a connection for the duration of the block
+        """
+        con = self.acquire()
+        try:
+            yield con
+        except (errors.OperationalError, errors.InterfaceError):
+            self.release(con, broken=True)
+            raise
+        except Exception:
+            if con.in_transaction:
+                con.rollback()
+            self.release(con)
+            raise
+        self.release(con)
+
+    def close(self) -> None:
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for con in idle:
+            self._discard(con)
+
+    def stats(self) -> dict:
+        """
+        :return: A snapshot of the pool's counters
+        """
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "checked_out": self._checked_out,
+                "waiting": self._waiting,
+                "created": self._created,
+                "reconnects": self._reconnects,
+            }
+
+
+_pool: ConnectionPool = None  # pylint: disable=invalid-name
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Returns the connection pool of the current process, creating it on first use
+    """
+    global _pool  # pylint: disable=global-statement
+    # a forked worker must not reuse the sockets of its parent
+    if _pool is None or _pool.pid != getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != getpid():
+                _pool = ConnectionPool(config.Database.POOL_SIZE, config.Database.POOL_TIMEOUT, **config.DATABASE_ARGS)
+    return _pool
+
+
+def pool_stats() -> dict:
+    """
+    :return: Statistics of the current process' connection pool
+    """
+    return get_pool().stats()
+
+
+def execute(query: str, args=None) -> int:
     """
     Executes a query
+
+    :return: The number of affected rows
     """
-    with mysql.connector.connect(**config.DATABASE_ARGS) as con:
+    with metrics.DB_QUERY_DURATION.time("database.execute"), get_pool().connection() as con:
         with con.cursor(dictionary=True) as cur:
-            cur.execute(query, args)
+            with tracing.statement(query, args):
+                cur.execute(query, args)
             con.commit()
+            return cur.rowcount
 
 
 def fetchall(query: str, args=None) -> list:
     """
     Fetches all results from a query
     """
-    with mysql.connector.connect(**config.DATABASE_ARGS) as con:
+    with metrics.DB_QUERY_DURATION.time("database.fetchall"), get_pool().connection() as con:
         with con.cursor(dictionary=True) as cur:
-            cur.execute(query, args)
+            with tracing.statement(query, args):
+                cur.execute(query, args)
             return cur.fetchall()
 
 
@@ -29,17 +213,37 @@ def fetchmany(query: str, args=None, size=None) -> list:
     """
     Fetches a limited number of results from a query
     """
-    with mysql.connector.connect(**config.DATABASE_ARGS) as con:
-        with con.cursor(dictionary=True) as cur:
-            cur.execute(query, args)
+    with metrics.DB_QUERY_DURATION.time("database.fetchmany"), get_pool().connection() as con:
+        with con.cursor(dictionary=True, buffered=True) as cur:
+            with tracing.statement(query, args):
+                cur.execute(query, args)
             return cur.fetchmany(size)
 
 
+@contextmanager
+def transaction():
+    """
+    Context manager yielding a cursor whose statements are committed together
+
+    Everything is rolled back if the block raises. The statements are traced one by one.
+    """
+    with metrics.DB_QUERY_DURATION.time("database.transaction"), get_pool().connection() as con:
+        con.start_transaction()
+        try:
+            with con.cursor(dictionary=True, buffered=True) as cur:
+                yield tracing.TracedCursor(cur)
+        except Exception:
+            con.rollback()
+            raise
+        con.commit()
+
+
 def fetchone(query: str, args=None) -> dict:
     """
     Fetches a single result from a query
     """
-    with mysql.connector.connect(**config.DATABASE_ARGS) as con:
-        with con.cursor(dictionary=True) as cur:
-            cur.execute(query, args)
+    with metrics.DB_QUERY_DURATION.time("database.fetchone"), get_pool().connection() as con:
+        with con.cursor(dictionary=True, buffered=True) as cur:
+            with tracing.statement(query, args):
+                cur.execute(query, args)
             return cur.fetchone()
@@ -2,10 +2,14 @@
 """
 Discord servers
 """
-from dataclasses import dataclass
-import logging
+from dataclasses import asdict, dataclass, replace
+from typing import Iterator
 
-from resources import database
+import config
+from resources.cache import TTLCache
+from resources.storage import get_backend
+
+cache = TTLCache(config.Cache.GUILD_SIZE, config.Cache.GUILD_TTL)
 
 
 @dataclass
@@ -16,6 +20,7 @@ class Guild:
     :ivar str webhook_token: token of the webhook used to send messages to discord
     :ivar int required_stars: stars required to send the message
     :ivar int flags: flags of the guild
+    :ivar int retention_days: days starred messages are kept, None for the default
 
     Flag documentation
     ^^^^^^^^^^^^^^^^^^
@@ -28,6 +33,7 @@ class Guild:
     webhook_token: str
     required_stars: int = 3
     flags: int = 0
+    retention_days: int = None
 
     def __iter__(self):
         self._n = 0
@@ -61,20 +67,18 @@ class Guild:
         :param bool value: True if self stars are allowed
         """
         if value:
-            self.flags |= 1 << 0
+            update(self, set_flags=1 << 0)
         else:
-            self.flags &= ~(1 << 0)
-        update(self, flags=self.flags)
+            update(self, clear_flags=1 << 0)
 
     def set_delete_own_messages(self, value):
         """
         :param bool value: True if own messages should be deleted
         """
         if value:
-            self.flags |= 1 << 1
+            update(self, set_flags=1 << 1)
         else:
-            self.flags &= ~(1 << 1)
-        update(self, flags=self.flags)
+            update(self, clear_flags=1 << 1)
 
 
 def exists(id: str) -> bool:
@@ -84,66 +88,163 @@ def exists(id: str) -> bool:
     :param str name: A name to check
     :return: A bool defining whether that guild exists
     """
-    return database.fetchone("SELECT * FROM guilds WHERE id=%s", (id,)) is not None
+    return get_backend().guild(id) is not None
 
 
 def get(id: str) -> Guild:
     """
-    Gets a guild from the database
+    Gets a guild from the cache or the database
 
     :param str id: The desired guild's id, can be None
     :raises GuildNotFound: In case a guild with this name doesn't exist
     :return: The desired guild
     """
-    if not exists(id):
-        raise GuildNotFound()
-    record = database.fetchone("SELECT * FROM guilds WHERE id=%s", (id,))
-    guild = Guild(**record)
-    return guild
+    guild = cache.get(id)
+    if guild is None:
+        generation = cache.generation()
+        record = get_backend().guild(id)
+        if record is None:
+            raise GuildNotFound()
+        guild = Guild(**record)
+        cache.set(id, guild, generation)
+    # callers modify the guild they get, so the cached one is never handed out
+    return replace(guild)
+
+
+async def get_async(id: str) -> Guild:
+    """
+    Gets a guild from the cache or the database without blocking, see :func:`get`
+    """
+    guild = cache.get(id)
+    if guild is None:
+        generation = cache.generation()
+        record = await get_backend().guild_async(id)
+        if record is None:
+            raise GuildNotFound()
+        guild = Guild(**record)
+        cache.set(id, guild, generation)
+    return replace(guild)
 
 
 def get_all() -> list[Guild]:
     """
-    :return: A list of all registered guilds
+    :return: A list of all registered guilds, prefer :func:`iterate` for anything but small tables
+    """
+    return list(iterate())
+
+
+def iterate(batch_size: int = None) -> Iterator[Guild]:
+    """
+    Yields all guilds ordered by id, loading one page of ``batch_size`` guilds at a time
+
+    Pages continue after the last id of the previous one, so no page gets slower the
+    further the iteration got and no connection is held in between.
+
+    :param int batch_size: Guilds per page, defaults to the configured batch size
     """
-    records = database.fetchall("SELECT * from guilds")
-    return [Guild(**record) for record in records]
+    batch_size = batch_size or config.Database.BATCH_SIZE
+    after = None
+    while True:
+        records = get_backend().guild_page(after, batch_size)
+        for record in records:
+            yield Guild(**record)
+        if len(records) < batch_size:
+            return
+        after = records[-1]["id"]
 
 
-def insert(guild: Guild):
+def insert_many(guilds: list[Guild]) -> int:
     """
-    Add a new guild
+    Adds guilds in one transaction, leaving existing ones untouched
+
+    :return: Number of added guilds
+    """
+    count = get_backend().import_guilds([asdict(guild) for guild in guilds])
+    for guild in guilds:
+        cache.invalidate(guild.id)
+    return count
+
+
+def insert(guild: Guild) -> bool:
+    """
+    Add a new guild, leaving an existing one untouched
 
     :param Guild guild: The guild to insert
-    :return: The guild's id
+    :return: False if the guild already existed
+    """
+    added = get_backend().insert_guild(asdict(guild))
+    cache.invalidate(guild.id)
+    return added
+
+
+def upsert_webhook(id: str, webhook_id: str, webhook_token: str) -> None:
+    """
+    Inserts a guild or replaces the webhook of an existing one in a single statement
+
+    :param str id: The guild's id
+    :param str webhook_id: id of the new webhook
+    :param str webhook_token: token of the new webhook
     """
-    attrs = vars(guild)
-    placeholders = ", ".join(["%s"] * len(attrs))
-    columns = ", ".join(attrs.keys())
-    sql = f"INSERT INTO guilds ({columns}) VALUES ({placeholders})"
-    database.execute(sql, tuple(guild))
+    get_backend().upsert_webhook(id, webhook_id, webhook_token)
+    cache.invalidate(id)
 
 
 def update(
-    guild: Guild, webhook_id: str = None, webhook_token: str = None, required_stars: int = None, flags: int = None
+    guild: Guild,
+    *,
+    webhook_id: str = None,
+    webhook_token: str = None,
+    required_stars: int = None,
+    set_flags: int = 0,
+    clear_flags: int = 0,
+    retention_days: int = None,
 ) -> None:
     """
-    Updates a guild in the database
-
-    Same as in players, not documented until fixed
-    """
-    if webhook_id is not None:
-        database.execute("UPDATE guilds SET webhook_id=%s WHERE id=%s", (webhook_id, guild.id))
-        guild.webhook_id = webhook_id
-    if webhook_token is not None:
-        database.execute("UPDATE guilds SET webhook_token=%s WHERE id=%s", (webhook_token, guild.id))
-        guild.webhook_token = webhook_token
-    if required_stars is not None:
-        database.execute("UPDATE guilds SET required_stars=%s WHERE id=%s", (required_stars, guild.id))
-        guild.required_stars = required_stars
-    if flags is not None:
-        database.execute("UPDATE guilds SET flags=%s WHERE id=%s", (flags, guild.id))
-        guild.flags = flags
+    Updates the given columns of a guild in a single statement
+
+    Flags are set and cleared by the statement itself instead of being overwritten, so
+    two settings changed at the same time don't undo each other.
+
+    :param int set_flags: Flags to set
+    :param int clear_flags: Flags to clear
+    """
+    changes = changed_columns(
+        webhook_id=webhook_id,
+        webhook_token=webhook_token,
+        required_stars=required_stars,
+        retention_days=retention_days,
+    )
+    if changes or set_flags or clear_flags:
+        get_backend().update_guild(guild.id, changes, set_flags, clear_flags)
+        apply_changes(guild, changes, set_flags, clear_flags)
+    cache.invalidate(guild.id)
+
+
+async def update_async(guild: Guild, *, required_stars: int = None, set_flags: int = 0, clear_flags: int = 0) -> None:
+    """
+    Updates the settings of a guild without blocking, see :func:`update`
+    """
+    changes = changed_columns(required_stars=required_stars)
+    if changes or set_flags or clear_flags:
+        await get_backend().update_guild_async(guild.id, changes, set_flags, clear_flags)
+        apply_changes(guild, changes, set_flags, clear_flags)
+    cache.invalidate(guild.id)
+
+
+def apply_changes(guild: Guild, changes: dict, set_flags: int, clear_flags: int) -> None:
+    """
+    Applies an update to the guild object it was made for
+    """
+    for column, value in changes.items():
+        setattr(guild, column, value)
+    guild.flags = (guild.flags | set_flags) & ~clear_flags
+
+
+def changed_columns(**columns) -> dict:
+    """
+    :return: The columns that are not None
+    """
+    return {column: value for column, value in columns.items() if value is not None}
 
 
 class GuildNotFound(Exception):
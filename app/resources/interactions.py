@@ -0,0 +1,116 @@
+"""
+Responses of recently handled interactions
+
+An interaction is claimed before its command or handler runs and its response is stored
+afterwards. A duplicate, like a request retried after a timeout, gets the stored response
+instead of running the command or handler a second time. Responses are kept in memory for
+``INTERACTION_WINDOW`` seconds, and the database's primary key catches the duplicates that
+reach another worker.
+"""
+import asyncio
+from time import monotonic, sleep
+
+import config
+from resources.cache import TTLCache
+from resources.storage import get_backend
+
+# cached for interactions this process is still handling, unlike any stored response, even an empty one
+PENDING = object()
+# seconds between two looks at a duplicate that is still being handled
+POLL_INTERVAL = 0.05
+
+cache = TTLCache(config.Idempotency.CACHE_SIZE, config.Idempotency.WINDOW)
+
+
+def claim(id: str, wait: float) -> str:
+    """
+    Claims an interaction unless it was received before
+
+    :param str id: The interaction's id
+    :param float wait: Seconds to wait for the response of a duplicate that is still being handled
+    :raises InteractionPending: In case the duplicate's response isn't there in time
+    :return: None if the interaction is new and has to be handled, the JSON encoded response otherwise
+    """
+    deadline = monotonic() + wait
+    while True:
+        response = cache.get(id)
+        if response is None:
+            if get_backend().claim_interaction(id):
+                cache.set(id, PENDING)
+                return None
+            response = get_backend().interaction_response(id)
+        if response is not None and response is not PENDING:
+            cache.set(id, response)
+            return response
+        if monotonic() >= deadline:
+            raise InteractionPending()
+        sleep(POLL_INTERVAL)
+
+
+async def claim_async(id: str, wait: float) -> str:
+    """
+    Claims an interaction without blocking, see :func:`claim`
+    """
+    deadline = monotonic() + wait
+    while True:
+        response = cache.get(id)
+        if response is None:
+            if await get_backend().claim_interaction_async(id):
+                cache.set(id, PENDING)
+                return None
+            response = await get_backend().interaction_response_async(id)
+        if response is not None and response is not PENDING:
+            cache.set(id, response)
+            return response
+        if monotonic() >= deadline:
+            raise InteractionPending()
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def storable(response: str) -> bool:
+    """
+    :param str response: The JSON encoded response of a claimed interaction
+    :return: Whether the response is small enough to be kept for duplicates
+    """
+    return len(response) <= config.Idempotency.MAX_RESPONSE_SIZE
+
+
+def store(id: str, response: str) -> None:
+    """
+    Stores the JSON encoded response of a claimed interaction
+    """
+    get_backend().store_interaction_response(id, response)
+    cache.set(id, response)
+
+
+async def store_async(id: str, response: str) -> None:
+    """
+    Stores the response of a claimed interaction without blocking
+    """
+    await get_backend().store_interaction_response_async(id, response)
+    cache.set(id, response)
+
+
+def release(id: str) -> None:
+    """
+    Forgets a claimed interaction that failed, so a retry runs it again
+    """
+    cache.invalidate(id)
+    get_backend().release_interaction(id)
+
+
+async def release_async(id: str) -> None:
+    """
+    Forgets a claimed interaction that failed without blocking
+    """
+    cache.invalidate(id)
+    await get_backend().release_interaction_async(id)
+
+
+class InteractionPending(Exception):
+    """
+    Exception raised when a duplicate interaction is still being handled
+    """
+
+    def __str__(self) -> str:
+        return "The interaction is still being handled"
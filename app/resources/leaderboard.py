@@ -0,0 +1,67 @@
+"""
+Most starred messages and users of a guild
+
+The statistics are kept up to date by the storage backend with every star, post and
+purge, so reading a leaderboard never scans a guild's history. :func:`rebuild` recounts
+them from the star votes in case they ever drift apart.
+"""
+from dataclasses import dataclass, field
+
+import config
+from resources import guilds
+from resources.storage import get_backend
+
+# entries of each list
+SIZE = 10
+
+
+@dataclass
+class Leaderboard:
+    """
+    :ivar list messages: (message id, channel id, stars) of the most starred messages
+    :ivar list users: (user id, stars, posts) of the users whose messages got the most stars
+    """
+
+    messages: list = field(default_factory=list)
+    users: list = field(default_factory=list)
+
+
+def from_records(records: dict) -> Leaderboard:
+    """
+    :return: The leaderboard of the records returned by a backend
+    """
+    return Leaderboard(
+        [(record["id"], record["channel_id"], record["stars"]) for record in records["messages"]],
+        [(record["user_id"], record["stars"], record["posts"]) for record in records["users"]],
+    )
+
+
+def get(guild_id: str, size: int = SIZE) -> Leaderboard:
+    """
+    :param str guild_id: The guild's id
+    :param int size: Entries of each list
+    """
+    return from_records(get_backend().leaderboard(guild_id, size))
+
+
+async def get_async(guild_id: str, size: int = SIZE) -> Leaderboard:
+    """
+    Gets the leaderboard of a guild without blocking, see :func:`get`
+    """
+    return from_records(await get_backend().leaderboard_async(guild_id, size))
+
+
+def rebuild(guild_id: str = None, batch_size: int = None) -> int:
+    """
+    Recounts the stars of messages from their votes and the statistics from the messages
+
+    Every guild is rebuilt in its own transaction.
+
+    :param str guild_id: The guild to rebuild, None for all of them
+    :return: Number of users with statistics
+    """
+    if guild_id is not None:
+        return get_backend().rebuild_stats(guild_id)
+    return sum(
+        get_backend().rebuild_stats(guild.id) for guild in guilds.iterate(batch_size or config.Database.BATCH_SIZE)
+    )
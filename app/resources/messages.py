@@ -2,24 +2,34 @@
 """
 Discord servers
 """
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from time import time
+from typing import Callable, Iterator
 
-from resources import database
+import config
+from resources import outbox
+from resources.storage import get_backend
+
+
+def snowflake(timestamp: float) -> int:
+    """Pseudo id from a message sent at a unix timestamp"""
+    return int(timestamp * 1000.0 - 1420070400000) << 22
 
 
 def max_timestamp() -> int:
     """Pseudo id from a message 30 days ago"""
-    return int((time() - 30 * 24 * 60 * 60) * 1000.0 - 1420070400000) << 22
+    return snowflake(time() - 30 * 24 * 60 * 60)
 
 
 @dataclass
 class Message:
     """
     :ivar str id: Internal message id
-    :ivar int stars: stars of the message
     :ivar int flags: flags of the message
-    :ivar str star_users: users who already starred
+    :ivar int stars: stars of the message, kept in sync with the star_votes table
+    :ivar str guild_id: id of the guild the message was sent in
+    :ivar str author_id: id of the user who wrote the message, whose statistics its stars count in
+    :ivar str channel_id: id of the channel the message was sent in
 
     Flag documentation
     ^^^^^^^^^^^^^^^^^^
@@ -28,7 +38,10 @@ class Message:
 
     id: str
     flags: int = 0
-    star_users: str = ""
+    stars: int = 0
+    guild_id: str = None
+    author_id: str = None
+    channel_id: str = None
 
     def __iter__(self):
         self._n = 0
@@ -41,22 +54,28 @@ class Message:
             return self.__getattribute__(attr)
         raise StopIteration
 
-    def add_star_user(self, id: int) -> None:
+    def add_star_user(self, id: str, required_stars: int = None) -> "StarResult":
+        """
+        Add a star of a user to the message, see :func:`star`
+        """
+        result = star(self.id, id, required_stars)
+        self.stars = result.stars
+        if result.sent:
+            self.flags |= 1 << 0
+        return result
+
+    def has_starred(self, id: str) -> bool:
         """
-        Add a user to the star_users list
+        :param str id: A user's id
+        :return: True if the user already starred this message
         """
-        update(self, star_users=f"{self.star_users};{id}")
+        return get_backend().has_starred(self.id, id)
 
     def mark_sent(self) -> None:
         """
         Mark the message as sent to starboard
         """
-        update(self, flags=self.flags | 1 << 0)
-
-    @property
-    def stars(self):
-        """Number of stars a message has"""
-        return len(self.star_users.split(";"))
+        update(self, set_flags=1 << 0)
 
     @property
     def sent(self):
@@ -64,6 +83,53 @@ class Message:
         return self.flags & 1 << 0
 
 
+@dataclass
+class StarResult:
+    """
+    Outcome of a star click
+
+    :ivar bool added: False if the user already starred the message or it was already sent
+    :ivar int stars: The message's star count after the click
+    :ivar bool sent: Whether the message is marked as sent to starboard
+    :ivar bool claimed: True only for the one click that marked the message as sent
+    """
+
+    added: bool
+    stars: int
+    sent: bool
+    claimed: bool = False
+
+
+def star(
+    id: str, user_id: str, required_stars: int = None, build_post: Callable[[], tuple[str, dict]] = None
+) -> StarResult:
+    """
+    Adds a user's star to a message in a single transaction
+
+    The message row is locked while the vote is inserted, so concurrent clicks are
+    serialized. The click that reaches ``required_stars`` also marks the message as
+    sent and queues its starboard post in the outbox, which makes sure only one
+    worker ever posts it to the starboard.
+
+    :param str id: The starred message's id
+    :param str user_id: The starring user's id
+    :param int required_stars: Stars needed to send the message, None to never send it
+    :param build_post: Returns webhook url and payload of the starboard post, only called for the claiming click
+    :raises MessageNotFound: In case the message doesn't exist
+    :return: The authoritative result of the click
+    """
+    return StarResult(**get_backend().star(id, user_id, required_stars, outbox.serialized(build_post)))
+
+
+async def star_async(
+    id: str, user_id: str, required_stars: int = None, build_post: Callable[[], tuple[str, dict]] = None
+) -> StarResult:
+    """
+    Adds a user's star to a message without blocking, see :func:`star`
+    """
+    return StarResult(**await get_backend().star_async(id, user_id, required_stars, outbox.serialized(build_post)))
+
+
 def exists(id: str) -> bool:
     """
     Checks if a message is found in the database
@@ -71,9 +137,7 @@ def exists(id: str) -> bool:
     :param str name: A name to check
     :return: A bool defining whether that message exists
     """
-    if len(database.fetchall("SELECT * FROM messages WHERE id=%s", (id,))) == 1:
-        return True
-    return False
+    return get_backend().message(id) is not None
 
 
 def get(id: str) -> Message:
@@ -84,56 +148,111 @@ def get(id: str) -> Message:
     :raises MessageNotFound: In case a message with this name doesn't exist
     :return: The desired message
     """
-    if not exists(id):
+    record = get_backend().message(id)
+    if record is None:
         raise MessageNotFound()
-    record = database.fetchone("SELECT * FROM messages WHERE id=%s", (id,))
-    message = Message(**record)
-    return message
+    return Message(**record)
 
 
 def get_all() -> list[Message]:
     """
-    :return: A list of all registered messages
+    :return: A list of all registered messages, prefer :func:`iterate` for anything but small tables
     """
-    records = database.fetchall("SELECT * from messages")
-    return [Message(**record) for record in records]
+    return list(iterate())
+
 
+def iterate(batch_size: int = None) -> Iterator[Message]:
+    """
+    Yields all messages ordered by id, loading one page of ``batch_size`` messages at a time
 
-def insert(message: Message):
+    :param int batch_size: Messages per page, defaults to the configured batch size
     """
-    Add a new message
+    batch_size = batch_size or config.Database.BATCH_SIZE
+    after = None
+    while True:
+        records = get_backend().message_page(after, batch_size)
+        for record in records:
+            yield Message(**record)
+        if len(records) < batch_size:
+            return
+        after = records[-1]["id"]
+
+
+def iterate_votes(batch_size: int = None) -> Iterator[tuple[str, str]]:
+    """
+    Yields the message and user id of all star votes, loading one page of ``batch_size`` votes at a time
+
+    :param int batch_size: Votes per page, defaults to the configured batch size
+    """
+    batch_size = batch_size or config.Database.BATCH_SIZE
+    after = None
+    while True:
+        records = get_backend().vote_page(after, batch_size)
+        for record in records:
+            yield record["message_id"], record["user_id"]
+        if len(records) < batch_size:
+            return
+        after = records[-1]["message_id"], records[-1]["user_id"]
+
+
+def insert_many(messages: list[Message]) -> int:
+    """
+    Adds messages in one transaction, leaving existing ones untouched
+
+    :return: Number of added messages
+    """
+    return get_backend().import_messages([asdict(message) for message in messages])
+
+
+def insert_votes(votes: list[tuple[str, str]]) -> int:
+    """
+    Adds star votes of message and user ids in one transaction, skipping existing ones
+
+    :return: Number of added votes
+    """
+    return get_backend().import_votes([{"message_id": message_id, "user_id": user_id} for message_id, user_id in votes])
+
+
+def insert(message: Message, star_user: str = None) -> bool:
+    """
+    Add a new message, leaving an already existing one untouched
 
     :param Message message: The message to insert
-    :return: The message's id
+    :param str star_user: id of a user whose star is added together with the message
+    :return: False if a message with this id already existed
+    """
+    if star_user is not None:
+        message.stars = 1
+    return get_backend().insert_message(asdict(message), star_user)
+
+
+async def insert_async(message: Message, star_user: str = None) -> bool:
+    """
+    Add a new message without blocking, see :func:`insert`
     """
-    attrs = vars(message)
-    placeholders = ", ".join(["%s"] * len(attrs))
-    columns = ", ".join(attrs.keys())
-    sql = f"INSERT INTO messages ({columns}) VALUES ({placeholders})"
-    database.execute(sql, tuple(message))
+    if star_user is not None:
+        message.stars = 1
+    return await get_backend().insert_message_async(asdict(message), star_user)
 
 
-def update(message: Message, flags: int = None, star_users: str = None) -> None:
+def update(message: Message, set_flags: int = 0) -> None:
     """
     Updates a message in the database
 
-    Same as in players, not documented until fixed
+    :param int set_flags: Flags to set, the statement keeps the others as they are
     """
-    if flags is not None:
-        database.execute("UPDATE messages SET flags=%s WHERE id=%s", (flags, message.id))
-        message.flags = flags
-    if star_users is not None:
-        database.execute("UPDATE messages SET star_users=%s WHERE id=%s", (star_users, message.id))
-        message.star_users = star_users
+    if set_flags:
+        get_backend().set_message_flags(message.id, set_flags)
+        message.flags |= set_flags
 
 
 def delete(message: Message) -> None:
     """
-    Deletes a message from the database
+    Deletes a message and its stars from the database
 
     :param Message message: The message to delete
     """
-    database.execute("DELETE FROM messages WHERE id=%s", (message.id,))
+    get_backend().delete_message(message.id)
 
 
 class MessageNotFound(Exception):
@@ -0,0 +1,450 @@
+"""
+Storage in a MySQL or MariaDB database
+
+Blocking calls go through the connection pool of :mod:`resources.database`, the async
+variants used by the async serving mode through :mod:`resources.aiodatabase`.
+
+Snowflakes are passed to the statements as numbers: compared with a string, a BIGINT
+column is compared as a double, which can't tell neighbouring snowflakes apart.
+"""
+from contextlib import contextmanager
+
+from resources import aiodatabase, database
+from resources.messages import MessageNotFound
+from resources.storage import Backend, with_snowflakes
+
+# flags are only changed bitwise, see assignments
+GUILD_COLUMNS = ("webhook_id", "webhook_token", "required_stars", "retention_days")
+
+# adds stars and posts to a user's statistics, negative numbers subtract them
+ADD_STATS = (
+    "INSERT INTO star_stats (guild_id, user_id, stars, posts) VALUES (%s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE stars=stars+VALUES(stars), posts=posts+VALUES(posts)"
+)
+# statements of the methods that have an async variant
+GUILD = "SELECT * FROM guilds WHERE id=%s"
+FIRST_VOTE = "INSERT INTO star_votes (message_id, user_id) VALUES (%s, %s)"
+ADD_VOTE = "INSERT IGNORE INTO star_votes (message_id, user_id) VALUES (%s, %s)"
+LOCK_MESSAGE = "SELECT stars, flags, guild_id, author_id FROM messages WHERE id=%s FOR UPDATE"
+SET_STARS = "UPDATE messages SET stars=%s, flags=flags | %s WHERE id=%s"
+QUEUE_POST = "INSERT INTO outbox (message_id, url, payload) VALUES (%s, %s, %s)"
+CLAIM_INTERACTION = "INSERT IGNORE INTO interactions (id) VALUES (%s)"
+INTERACTION_RESPONSE = "SELECT response FROM interactions WHERE id=%s"
+STORE_INTERACTION_RESPONSE = "UPDATE interactions SET response=%s WHERE id=%s"
+RELEASE_INTERACTION = "DELETE FROM interactions WHERE id=%s"
+# both read the first rows of an index on guild_id and stars
+TOP_MESSAGES = (
+    "SELECT id, channel_id, stars FROM messages WHERE guild_id=%s AND stars > 0 ORDER BY stars DESC, id DESC LIMIT %s"
+)
+TOP_USERS = (
+    "SELECT user_id, stars, posts FROM star_stats WHERE guild_id=%s AND stars > 0 "
+    "ORDER BY stars DESC, user_id DESC LIMIT %s"
+)
+
+
+def assignments(changes: dict, set_flags: int = 0, clear_flags: int = 0) -> tuple[str, tuple]:
+    """
+    :return: The SET clause of an update of the given guild columns and flags, and its parameters
+    """
+    unknown = set(changes) - set(GUILD_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown guild columns {', '.join(sorted(unknown))}")
+    clauses = [f"{column}=%s" for column in changes]
+    params = tuple(changes.values())
+    if set_flags or clear_flags:
+        clauses.append("flags=(flags | %s) & ~%s")
+        params += (set_flags, clear_flags)
+    return ", ".join(clauses), params
+
+
+def insert_ignore(table: str, record: dict) -> tuple[str, tuple]:
+    """
+    :return: The statement inserting a record unless its key exists, and its parameters
+    """
+    placeholders = ", ".join(["%s"] * len(record))
+    return f"INSERT IGNORE INTO {table} ({', '.join(record.keys())}) VALUES ({placeholders})", tuple(record.values())
+
+
+def guild_update(id: str, changes: dict, set_flags: int = 0, clear_flags: int = 0) -> tuple[str, tuple]:
+    """
+    :return: The statement updating the given guild columns and flags, and its parameters
+    """
+    clause, params = assignments(changes, set_flags, clear_flags)
+    return f"UPDATE guilds SET {clause} WHERE id=%s", (*params, int(id))
+
+
+def subtract_stats(cur, messages: str = "messages", where: str = "TRUE", args=None) -> None:
+    """
+    Subtracts the stars and posts of messages about to be deleted from their authors' statistics
+
+    :param cur: Cursor of the transaction deleting the messages
+    :param str messages: The messages table or one of its partitions, like ``messages PARTITION (p202301)``
+    :param str where: Condition selecting the messages
+    :param args: Parameters of the condition
+    """
+    cur.execute(
+        "SELECT guild_id, author_id, SUM(stars) AS stars, SUM(flags & 1) AS posts "
+        f"FROM {messages} WHERE ({where}) AND guild_id IS NOT NULL AND author_id IS NOT NULL "
+        "GROUP BY guild_id, author_id",
+        args,
+    )
+    removed = [
+        (record["guild_id"], record["author_id"], -int(record["stars"]), -int(record["posts"]))
+        for record in cur.fetchall()
+    ]
+    if removed:
+        cur.executemany(ADD_STATS, removed)
+
+
+def import_rows(table: str, records: list[dict]) -> int:
+    """
+    Inserts records with the same columns in one statement, skipping existing rows
+
+    :return: Number of inserted rows
+    """
+    if not records:
+        return 0
+    columns = list(records[0])
+    with database.transaction() as cur:
+        cur.executemany(
+            f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+            [tuple(record[column] for column in columns) for record in records],
+        )
+        return cur.rowcount
+
+
+# implements the whole interface of Backend
+class MySQLBackend(Backend):  # pylint: disable=too-many-public-methods
+    """
+    Storage in the database of the ``MYSQL_*`` variables, set up by ``migrations.py``
+    """
+
+    name = "mysql"
+
+    def ping(self) -> None:
+        database.fetchone("SELECT 1")
+
+    async def ping_async(self) -> None:
+        await aiodatabase.fetchone("SELECT 1")
+
+    def stats(self) -> dict:
+        return database.pool_stats()
+
+    def migrate(self) -> None:
+        # pylint: disable=import-outside-toplevel
+        import migrations
+
+        migrations.migrate_mysql()
+
+    def migrations(self) -> list[tuple]:
+        # pylint: disable=import-outside-toplevel
+        import migrations
+
+        return migrations.mysql_status()
+
+    @contextmanager
+    def exclusive(self, name: str, wait: float = 0):
+        # named locks belong to the connection, so it is held until the block finished
+        with database.get_pool().connection() as con:
+            with con.cursor() as cur:
+                cur.execute("SELECT GET_LOCK(%s, %s)", (name, wait))
+                acquired = cur.fetchone()[0] == 1
+                try:
+                    yield acquired
+                finally:
+                    if acquired:
+                        cur.execute("SELECT RELEASE_LOCK(%s)", (name,))
+                        cur.fetchone()
+
+    def guild(self, id: str) -> dict:
+        return with_snowflakes(database.fetchone(GUILD, (int(id),)))
+
+    async def guild_async(self, id: str) -> dict:
+        return with_snowflakes(await aiodatabase.fetchone(GUILD, (int(id),)))
+
+    def insert_guild(self, record: dict) -> bool:
+        return database.execute(*insert_ignore("guilds", record)) == 1
+
+    def upsert_webhook(self, id: str, webhook_id: str, webhook_token: str) -> None:
+        database.execute(
+            "INSERT INTO guilds (id, webhook_id, webhook_token) VALUES (%s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE webhook_id=VALUES(webhook_id), webhook_token=VALUES(webhook_token)",
+            (int(id), webhook_id, webhook_token),
+        )
+
+    def update_guild(self, id: str, changes: dict, set_flags: int = 0, clear_flags: int = 0) -> None:
+        database.execute(*guild_update(id, changes, set_flags, clear_flags))
+
+    async def update_guild_async(self, id: str, changes: dict, set_flags: int = 0, clear_flags: int = 0) -> None:
+        await aiodatabase.execute(*guild_update(id, changes, set_flags, clear_flags))
+
+    def guild_page(self, after: str, limit: int) -> list[dict]:
+        if after is None:
+            records = database.fetchall("SELECT * FROM guilds ORDER BY id LIMIT %s", (limit,))
+        else:
+            records = database.fetchall("SELECT * FROM guilds WHERE id > %s ORDER BY id LIMIT %s", (int(after), limit))
+        return [with_snowflakes(record) for record in records]
+
+    def import_guilds(self, records: list[dict]) -> int:
+        return import_rows("guilds", records)
+
+    def message(self, id: str) -> dict:
+        return with_snowflakes(database.fetchone("SELECT * FROM messages WHERE id=%s", (int(id),)))
+
+    def insert_message(self, record: dict, star_user: str = None) -> bool:
+        with database.transaction() as cur:
+            cur.execute(*insert_ignore("messages", record))
+            if cur.rowcount == 0:
+                return False
+            if star_user is not None:
+                cur.execute(FIRST_VOTE, (record["id"], star_user))
+                if record.get("guild_id") is not None and record.get("author_id") is not None:
+                    cur.execute(ADD_STATS, (record["guild_id"], record["author_id"], 1, 0))
+        return True
+
+    async def insert_message_async(self, record: dict, star_user: str = None) -> bool:
+        async with aiodatabase.transaction() as cur:
+            await cur.execute(*insert_ignore("messages", record))
+            if cur.rowcount == 0:
+                return False
+            if star_user is not None:
+                await cur.execute(FIRST_VOTE, (record["id"], star_user))
+                if record.get("guild_id") is not None and record.get("author_id") is not None:
+                    await cur.execute(ADD_STATS, (record["guild_id"], record["author_id"], 1, 0))
+        return True
+
+    def set_message_flags(self, id: str, flags: int) -> None:
+        with database.transaction() as cur:
+            cur.execute("SELECT flags, guild_id, author_id FROM messages WHERE id=%s FOR UPDATE", (int(id),))
+            record = cur.fetchone()
+            if record is None or flags & ~record["flags"] == 0:
+                return
+            cur.execute("UPDATE messages SET flags=flags | %s WHERE id=%s", (flags, int(id)))
+            if flags & ~record["flags"] & 1 << 0 and record["guild_id"] is not None and record["author_id"] is not None:
+                cur.execute(ADD_STATS, (record["guild_id"], record["author_id"], 0, 1))
+
+    def delete_message(self, id: str) -> None:
+        self.delete_messages([id])
+
+    def has_starred(self, message_id: str, user_id: str) -> bool:
+        return (
+            database.fetchone(
+                "SELECT 1 FROM star_votes WHERE message_id=%s AND user_id=%s", (int(message_id), int(user_id))
+            )
+            is not None
+        )
+
+    def star(self, id: str, user_id: str, required_stars: int = None, build_post=None) -> dict:
+        id = int(id)
+        with database.transaction() as cur:
+            cur.execute(LOCK_MESSAGE, (id,))
+            record = cur.fetchone()
+            if record is None:
+                raise MessageNotFound()
+            stars, flags = record["stars"], record["flags"]
+            if flags & 1 << 0:
+                return {"added": False, "stars": stars, "sent": True}
+            cur.execute(ADD_VOTE, (id, user_id))
+            if cur.rowcount == 0:
+                return {"added": False, "stars": stars, "sent": False}
+            stars += 1
+            claimed = required_stars is not None and stars >= required_stars
+            cur.execute(SET_STARS, (stars, (1 << 0) if claimed else 0, id))
+            if record["guild_id"] is not None and record["author_id"] is not None:
+                cur.execute(ADD_STATS, (record["guild_id"], record["author_id"], 1, int(claimed)))
+            if claimed and build_post is not None:
+                url, payload = build_post()
+                cur.execute(QUEUE_POST, (id, url, payload))
+        return {"added": True, "stars": stars, "sent": claimed, "claimed": claimed}
+
+    async def star_async(self, id: str, user_id: str, required_stars: int = None, build_post=None) -> dict:
+        id = int(id)
+        async with aiodatabase.transaction() as cur:
+            await cur.execute(LOCK_MESSAGE, (id,))
+            record = await cur.fetchone()
+            if record is None:
+                raise MessageNotFound()
+            stars, flags = record["stars"], record["flags"]
+            if flags & 1 << 0:
+                return {"added": False, "stars": stars, "sent": True}
+            await cur.execute(ADD_VOTE, (id, user_id))
+            if cur.rowcount == 0:
+                return {"added": False, "stars": stars, "sent": False}
+            stars += 1
+            claimed = required_stars is not None and stars >= required_stars
+            await cur.execute(SET_STARS, (stars, (1 << 0) if claimed else 0, id))
+            if record["guild_id"] is not None and record["author_id"] is not None:
+                await cur.execute(ADD_STATS, (record["guild_id"], record["author_id"], 1, int(claimed)))
+            if claimed and build_post is not None:
+                url, payload = build_post()
+                await cur.execute(QUEUE_POST, (id, url, payload))
+        return {"added": True, "stars": stars, "sent": claimed, "claimed": claimed}
+
+    def message_page(self, after: str, limit: int) -> list[dict]:
+        if after is None:
+            records = database.fetchall("SELECT * FROM messages ORDER BY id LIMIT %s", (limit,))
+        else:
+            records = database.fetchall(
+                "SELECT * FROM messages WHERE id > %s ORDER BY id LIMIT %s", (int(after), limit)
+            )
+        return [with_snowflakes(record) for record in records]
+
+    def vote_page(self, after: tuple, limit: int) -> list[dict]:
+        if after is None:
+            records = database.fetchall(
+                "SELECT message_id, user_id FROM star_votes ORDER BY message_id, user_id LIMIT %s", (limit,)
+            )
+        else:
+            records = database.fetchall(
+                "SELECT message_id, user_id FROM star_votes WHERE (message_id, user_id) > (%s, %s) "
+                "ORDER BY message_id, user_id LIMIT %s",
+                (int(after[0]), int(after[1]), limit),
+            )
+        return [with_snowflakes(record) for record in records]
+
+    def import_messages(self, records: list[dict]) -> int:
+        return import_rows("messages", records)
+
+    def import_votes(self, records: list[dict]) -> int:
+        return import_rows("star_votes", records)
+
+    def longest_retention(self) -> int:
+        return database.fetchone("SELECT MAX(retention_days) AS days FROM guilds")["days"]
+
+    def expired_candidates(self, after: int, below: int, limit: int) -> list[dict]:
+        records = database.fetchall(
+            "SELECT m.id, g.retention_days FROM messages m LEFT JOIN guilds g ON g.id=m.guild_id "
+            "WHERE m.id > %s AND m.id < %s ORDER BY m.id LIMIT %s",
+            (after, below, limit),
+        )
+        return [with_snowflakes(record) for record in records]
+
+    def delete_messages(self, ids: list) -> tuple[int, int]:
+        placeholders = ", ".join(["%s"] * len(ids))
+        ids = [int(id) for id in ids]
+        with database.transaction() as cur:
+            subtract_stats(cur, where=f"id IN ({placeholders})", args=ids)
+            cur.execute(f"DELETE FROM star_votes WHERE message_id IN ({placeholders})", ids)
+            votes = cur.rowcount
+            cur.execute(f"DELETE FROM messages WHERE id IN ({placeholders})", ids)
+            return votes, cur.rowcount
+
+    def leaderboard(self, guild_id: str, limit: int) -> dict:
+        return {
+            "messages": [with_snowflakes(record) for record in database.fetchall(TOP_MESSAGES, (int(guild_id), limit))],
+            "users": [with_snowflakes(record) for record in database.fetchall(TOP_USERS, (int(guild_id), limit))],
+        }
+
+    async def leaderboard_async(self, guild_id: str, limit: int) -> dict:
+        top_messages = await aiodatabase.fetchall(TOP_MESSAGES, (int(guild_id), limit))
+        top_users = await aiodatabase.fetchall(TOP_USERS, (int(guild_id), limit))
+        return {
+            "messages": [with_snowflakes(record) for record in top_messages],
+            "users": [with_snowflakes(record) for record in top_users],
+        }
+
+    def rebuild_stats(self, guild_id: str) -> int:
+        with database.transaction() as cur:
+            cur.execute(
+                "UPDATE messages m SET stars=(SELECT COUNT(*) FROM star_votes v WHERE v.message_id=m.id) "
+                "WHERE m.guild_id=%s",
+                (int(guild_id),),
+            )
+            cur.execute("DELETE FROM star_stats WHERE guild_id=%s", (int(guild_id),))
+            cur.execute(
+                "INSERT INTO star_stats (guild_id, user_id, stars, posts) "
+                "SELECT guild_id, author_id, SUM(stars), SUM(flags & 1) FROM messages "
+                "WHERE guild_id=%s AND author_id IS NOT NULL GROUP BY guild_id, author_id",
+                (int(guild_id),),
+            )
+            return cur.rowcount
+
+    def claim_posts(self, limit: int, lease: float) -> list[dict]:
+        with database.transaction() as cur:
+            cur.execute(
+                "SELECT id, message_id, url, payload, attempts, "
+                "TIMESTAMPDIFF(MICROSECOND, created_at, NOW(6)) / 1000000 AS age FROM outbox "
+                "WHERE delivered_at IS NULL AND failed=0 AND next_attempt_at <= NOW(6) "
+                "ORDER BY next_attempt_at LIMIT %s FOR UPDATE SKIP LOCKED",
+                (limit,),
+            )
+            records = cur.fetchall()
+            if not records:
+                return []
+            ids = [record["id"] for record in records]
+            cur.execute(
+                f"UPDATE outbox SET next_attempt_at=NOW(6) + INTERVAL %s MICROSECOND "
+                f"WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                (int(lease * 1000000), *ids),
+            )
+        return [with_snowflakes(record, ("message_id",)) for record in records]
+
+    def mark_delivered(self, id: int) -> None:
+        database.execute("UPDATE outbox SET delivered_at=NOW(6) WHERE id=%s", (id,))
+
+    def reschedule_post(self, id: int, delay: float, error: str, count_attempt: bool = True) -> None:
+        database.execute(
+            "UPDATE outbox SET attempts=attempts+%s, next_attempt_at=NOW(6) + INTERVAL %s MICROSECOND, last_error=%s "
+            "WHERE id=%s",
+            (int(count_attempt), int(delay * 1000000), error, id),
+        )
+
+    def mark_failed(self, id: int, error: str) -> None:
+        database.execute("UPDATE outbox SET attempts=attempts+1, failed=1, last_error=%s WHERE id=%s", (error, id))
+
+    def outbox_depth(self) -> int:
+        return database.fetchone("SELECT COUNT(*) AS depth FROM outbox WHERE delivered_at IS NULL AND failed=0")[
+            "depth"
+        ]
+
+    def purge_posts(self, days: int, limit: int) -> int:
+        return database.execute(
+            "DELETE FROM outbox WHERE (delivered_at IS NOT NULL OR failed=1) "
+            "AND created_at < NOW() - INTERVAL %s DAY LIMIT %s",
+            (days, limit),
+        )
+
+    def claim_interaction(self, id: str) -> bool:
+        return database.execute(CLAIM_INTERACTION, (int(id),)) == 1
+
+    async def claim_interaction_async(self, id: str) -> bool:
+        return await aiodatabase.execute(CLAIM_INTERACTION, (int(id),)) == 1
+
+    def interaction_response(self, id: str) -> str:
+        record = database.fetchone(INTERACTION_RESPONSE, (int(id),))
+        return None if record is None else record["response"]
+
+    async def interaction_response_async(self, id: str) -> str:
+        record = await aiodatabase.fetchone(INTERACTION_RESPONSE, (int(id),))
+        return None if record is None else record["response"]
+
+    def store_interaction_response(self, id: str, response: str) -> None:
+        database.execute(STORE_INTERACTION_RESPONSE, (response, int(id)))
+
+    async def store_interaction_response_async(self, id: str, response: str) -> None:
+        await aiodatabase.execute(STORE_INTERACTION_RESPONSE, (response, int(id)))
+
+    def release_interaction(self, id: str) -> None:
+        database.execute(RELEASE_INTERACTION, (int(id),))
+
+    async def release_interaction_async(self, id: str) -> None:
+        await aiodatabase.execute(RELEASE_INTERACTION, (int(id),))
+
+    def purge_interactions(self, seconds: float, limit: int) -> int:
+        return database.execute(
+            "DELETE FROM interactions WHERE created_at < NOW(6) - INTERVAL %s MICROSECOND LIMIT %s",
+            (int(seconds * 1000000), limit),
+        )
+
+    def insert_task(self, name: str, run_at: float, kwargs: str) -> int:
+        with database.transaction() as cur:
+            cur.execute(
+                "INSERT INTO scheduled_tasks (name, run_at, kwargs) VALUES (%s, %s, %s)", (name, run_at, kwargs)
+            )
+            return cur.lastrowid
+
+    def tasks(self) -> list[dict]:
+        return database.fetchall("SELECT id, name, run_at, kwargs FROM scheduled_tasks")
+
+    def delete_task(self, id: int) -> bool:
+        return database.execute("DELETE FROM scheduled_tasks WHERE id=%s", (id,)) == 1
@@ -0,0 +1,98 @@
+"""
+Starboard posts waiting to be delivered to a guild webhook
+"""
+import json
+from dataclasses import dataclass
+from typing import Callable
+
+from resources.storage import get_backend
+
+LEASE_SECONDS = 60
+
+
+@dataclass
+class Post:
+    """
+    :ivar int id: Internal post id
+    :ivar str message_id: id of the starred message
+    :ivar str url: Webhook url to post to
+    :ivar dict payload: Message payload to post
+    :ivar int attempts: Number of failed delivery attempts
+    :ivar float age: Seconds since the post was queued
+    """
+
+    id: int
+    message_id: str
+    url: str
+    payload: dict
+    attempts: int = 0
+    age: float = 0.0
+
+
+def serialized(build_post: Callable[[], tuple[str, dict]]) -> Callable[[], tuple[str, str]]:
+    """
+    :param build_post: Returns webhook url and payload of a post, can be None
+    :return: A function returning the url and the JSON encoded payload, None if ``build_post`` is None
+    """
+    if build_post is None:
+        return None
+
+    def build() -> tuple[str, str]:
+        url, payload = build_post()
+        return url, json.dumps(payload)
+
+    return build
+
+
+def claim_due(limit: int) -> list[Post]:
+    """
+    Lease posts that are due for delivery so no other worker picks them up meanwhile
+
+    :param int limit: Maximum number of posts to claim
+    :return: The claimed posts
+    """
+    records = get_backend().claim_posts(limit, LEASE_SECONDS)
+    return [
+        Post(
+            id=record["id"],
+            message_id=record["message_id"],
+            url=record["url"],
+            payload=json.loads(record["payload"]),
+            attempts=record["attempts"],
+            age=float(record["age"]),
+        )
+        for record in records
+    ]
+
+
+def mark_delivered(post: Post) -> None:
+    """
+    Mark a post as delivered
+    """
+    get_backend().mark_delivered(post.id)
+
+
+def reschedule(post: Post, delay: float, error: str, count_attempt: bool = True) -> None:
+    """
+    Schedule another delivery attempt
+
+    :param Post post: The post that failed
+    :param float delay: Seconds to wait before the next attempt
+    :param str error: Reason of the failure
+    :param bool count_attempt: Whether the failure counts towards the attempts before the post is given up
+    """
+    get_backend().reschedule_post(post.id, delay, error[:255], count_attempt)
+
+
+def mark_failed(post: Post, error: str) -> None:
+    """
+    Give up on a post
+    """
+    get_backend().mark_failed(post.id, error[:255])
+
+
+def depth() -> int:
+    """
+    :return: Number of posts that still wait for delivery
+    """
+    return get_backend().outbox_depth()
@@ -0,0 +1,559 @@
+"""
+Storage in an embedded SQLite database
+
+Meant for single node deployments: lookups don't leave the process, and the database
+is a single file created on first use. It runs in WAL mode, so readers never wait for
+the writer. Writes of all workers are serialized by SQLite, which ``BEGIN IMMEDIATE``
+relies on in place of MySQL's row locks.
+"""
+import fcntl
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import monotonic, sleep, time
+
+import config
+import metrics
+import tracing
+from resources.messages import MessageNotFound
+from resources.storage import SNOWFLAKES, Backend, with_snowflakes
+
+# flags are only changed bitwise, see update_guild
+GUILD_COLUMNS = ("webhook_id", "webhook_token", "required_stars", "retention_days")
+
+# the version of a database file is its user_version, append only like migrations.MIGRATIONS
+BASE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS guilds ("
+    "id INTEGER NOT NULL PRIMARY KEY, "
+    "webhook_id INTEGER, "
+    "webhook_token TEXT, "
+    "required_stars INTEGER NOT NULL DEFAULT 3, "
+    "flags INTEGER NOT NULL DEFAULT 0, "
+    "retention_days INTEGER)",
+    "CREATE TABLE IF NOT EXISTS messages ("
+    "id INTEGER NOT NULL PRIMARY KEY, "
+    "flags INTEGER NOT NULL DEFAULT 0, "
+    "stars INTEGER NOT NULL DEFAULT 0, "
+    "guild_id INTEGER)",
+    "CREATE TABLE IF NOT EXISTS star_votes ("
+    "message_id INTEGER NOT NULL, "
+    "user_id INTEGER NOT NULL, "
+    "PRIMARY KEY (message_id, user_id)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS outbox ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "message_id INTEGER NOT NULL, "
+    "url TEXT NOT NULL, "
+    "payload TEXT NOT NULL, "
+    "attempts INTEGER NOT NULL DEFAULT 0, "
+    "failed INTEGER NOT NULL DEFAULT 0, "
+    "last_error TEXT, "
+    "created_at REAL NOT NULL, "
+    "next_attempt_at REAL NOT NULL, "
+    "delivered_at REAL)",
+    "CREATE INDEX IF NOT EXISTS pending ON outbox (delivered_at, failed, next_attempt_at)",
+    "CREATE TABLE IF NOT EXISTS scheduled_tasks ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "name TEXT NOT NULL, "
+    "run_at REAL NOT NULL, "
+    "kwargs TEXT NOT NULL)",
+)
+MIGRATIONS = (
+    (1, "create_tables", BASE_SCHEMA),
+    (2, "add_outbox_purge_index", ("CREATE INDEX IF NOT EXISTS created ON outbox (created_at)",)),
+    (
+        3,
+        "add_star_stats",
+        (
+            "ALTER TABLE messages ADD COLUMN author_id INTEGER",
+            "ALTER TABLE messages ADD COLUMN channel_id INTEGER",
+            "CREATE INDEX IF NOT EXISTS top_messages ON messages (guild_id, stars)",
+            "CREATE TABLE IF NOT EXISTS star_stats ("
+            "guild_id INTEGER NOT NULL, "
+            "user_id INTEGER NOT NULL, "
+            "stars INTEGER NOT NULL DEFAULT 0, "
+            "posts INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (guild_id, user_id)) WITHOUT ROWID",
+            "CREATE INDEX IF NOT EXISTS top_users ON star_stats (guild_id, stars)",
+        ),
+    ),
+    (
+        4,
+        "create_interactions",
+        (
+            "CREATE TABLE IF NOT EXISTS interactions ("
+            "id INTEGER NOT NULL PRIMARY KEY, "
+            "response TEXT, "
+            "created_at REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS interactions_created ON interactions (created_at)",
+        ),
+    ),
+)
+# adds stars and posts to a user's statistics, negative numbers subtract them
+ADD_STATS = (
+    "INSERT INTO star_stats (guild_id, user_id, stars, posts) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (guild_id, user_id) DO UPDATE SET stars=stars+excluded.stars, posts=posts+excluded.posts"
+)
+
+
+def record(row: sqlite3.Row, snowflakes: tuple = SNOWFLAKES) -> dict:
+    """
+    :return: A row as dict, with the snowflakes as strings
+    """
+    return None if row is None else with_snowflakes(dict(zip(row.keys(), row)), snowflakes)
+
+
+def placeholders(count: int) -> str:
+    """
+    :return: ``count`` comma separated placeholders
+    """
+    return ", ".join(["?"] * count)
+
+
+# implements the whole interface of Backend
+class SQLiteBackend(Backend):  # pylint: disable=too-many-public-methods
+    """
+    Storage in an SQLite database file, with a connection per thread
+
+    :param str path: Location of the database file, ``SQLITE_PATH`` by default, it is created and migrated if needed
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = None):
+        self.path = path or config.Database.SQLITE_PATH
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = 0
+        self._busy = 0
+        self.apply_migrations()
+
+    def _connect(self) -> sqlite3.Connection:
+        # transactions are started explicitly, everything else commits right away
+        con = sqlite3.connect(
+            self.path, timeout=config.Database.POOL_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        # durable at checkpoints, a power loss may only lose the latest commits
+        con.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self._connections += 1
+        return con
+
+    @contextmanager
+    def connection(self, function: str = "connection"):
+        """
+        Context manager yielding the connection of the current thread
+
+        :param str function: Name the time of the block is recorded under
+        """
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = self._connect()
+        with metrics.DB_QUERY_DURATION.time(f"sqlite.{function}"):
+            try:
+                yield con
+            except sqlite3.OperationalError as error:
+                if "locked" in str(error):
+                    with self._lock:
+                        self._busy += 1
+                raise
+
+    @staticmethod
+    def execute(con: sqlite3.Connection, query: str, args=()) -> sqlite3.Cursor:
+        """
+        Executes a traced statement
+
+        :return: The cursor of the statement
+        """
+        with tracing.statement(query, args):
+            return con.execute(query, args)
+
+    @contextmanager
+    def transaction(self, function: str):
+        """
+        Context manager yielding the connection inside a write transaction
+
+        The write lock is taken right away, so a transaction never fails half way because
+        another worker wrote in the meantime. Everything is rolled back if the block raises.
+        """
+        with self.connection(function) as con:
+            # like with MySQL, only the statements in between are traced
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.rollback()
+                raise
+            con.execute("COMMIT")
+
+    def fetchone(self, function: str, query: str, args=()) -> dict:
+        """
+        :return: The first row of a query
+        """
+        with self.connection(function) as con:
+            return record(self.execute(con, query, args).fetchone())
+
+    def fetchall(self, function: str, query: str, args=(), snowflakes: tuple = SNOWFLAKES) -> list[dict]:
+        """
+        :return: All rows of a query
+        """
+        with self.connection(function) as con:
+            return [record(row, snowflakes) for row in self.execute(con, query, args).fetchall()]
+
+    def run(self, function: str, query: str, args=()) -> int:
+        """
+        Runs a single statement
+
+        :return: The number of changed rows
+        """
+        with self.connection(function) as con:
+            return self.execute(con, query, args).rowcount
+
+    def ping(self) -> None:
+        self.fetchone("ping", "SELECT 1")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"connections": self._connections, "busy": self._busy}
+
+    def apply_migrations(self) -> int:
+        """
+        Applies the pending migrations, each in a transaction together with the new version
+
+        :return: Number of applied migrations
+        """
+        applied = 0
+        for version, name, statements in MIGRATIONS:
+            with self.transaction("migrate") as con:
+                # read after the write lock is taken, another worker may have just applied it
+                if con.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    continue
+                logging.info("Applying migration %s (%s) to %s", version, name, self.path)
+                for statement in statements:
+                    con.execute(statement)
+                con.execute(f"PRAGMA user_version={version}")
+                applied += 1
+        return applied
+
+    def migrate(self) -> None:
+        applied = self.apply_migrations()
+        logging.info(
+            "The SQLite database at %s is at version %s, %s migrations applied", self.path, MIGRATIONS[-1][0], applied
+        )
+
+    def migrations(self) -> list[tuple]:
+        with self.connection("migrations") as con:
+            current = con.execute("PRAGMA user_version").fetchone()[0]
+        return [(version, name, version <= current) for version, name, _ in MIGRATIONS]
+
+    @contextmanager
+    def exclusive(self, name: str, wait: float = 0):
+        with open(f"{self.path}.{name}.lock", "w", encoding="utf-8") as lock:
+            deadline = monotonic() + wait
+            while True:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if monotonic() >= deadline:
+                        yield False
+                        return
+                    sleep(0.1)
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def guild(self, id: str) -> dict:
+        return self.fetchone("guild", "SELECT * FROM guilds WHERE id=?", (id,))
+
+    def insert_guild(self, record: dict) -> bool:  # pylint: disable=redefined-outer-name
+        return (
+            self.run(
+                "insert_guild",
+                f"INSERT OR IGNORE INTO guilds ({', '.join(record)}) VALUES ({placeholders(len(record))})",
+                tuple(record.values()),
+            )
+            == 1
+        )
+
+    def upsert_webhook(self, id: str, webhook_id: str, webhook_token: str) -> None:
+        self.run(
+            "upsert_webhook",
+            "INSERT INTO guilds (id, webhook_id, webhook_token) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET webhook_id=excluded.webhook_id, webhook_token=excluded.webhook_token",
+            (id, webhook_id, webhook_token),
+        )
+
+    def update_guild(self, id: str, changes: dict, set_flags: int = 0, clear_flags: int = 0) -> None:
+        unknown = set(changes) - set(GUILD_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown guild columns {', '.join(sorted(unknown))}")
+        assignments = [f"{column}=?" for column in changes]
+        params = tuple(changes.values())
+        if set_flags or clear_flags:
+            assignments.append("flags=(flags | ?) & ~?")
+            params += (set_flags, clear_flags)
+        self.run("update_guild", f"UPDATE guilds SET {', '.join(assignments)} WHERE id=?", (*params, id))
+
+    def guild_page(self, after: str, limit: int) -> list[dict]:
+        if after is None:
+            return self.fetchall("guild_page", "SELECT * FROM guilds ORDER BY id LIMIT ?", (limit,))
+        return self.fetchall("guild_page", "SELECT * FROM guilds WHERE id > ? ORDER BY id LIMIT ?", (after, limit))
+
+    def import_guilds(self, records: list[dict]) -> int:
+        return self.import_rows("import_guilds", "guilds", records)
+
+    def message(self, id: str) -> dict:
+        return self.fetchone("message", "SELECT * FROM messages WHERE id=?", (id,))
+
+    def insert_message(self, record: dict, star_user: str = None) -> bool:  # pylint: disable=redefined-outer-name
+        with self.transaction("insert_message") as con:
+            cur = self.execute(
+                con,
+                f"INSERT OR IGNORE INTO messages ({', '.join(record)}) VALUES ({placeholders(len(record))})",
+                tuple(record.values()),
+            )
+            if cur.rowcount == 0:
+                return False
+            if star_user is not None:
+                self.execute(
+                    con, "INSERT INTO star_votes (message_id, user_id) VALUES (?, ?)", (record["id"], star_user)
+                )
+                if record.get("guild_id") is not None and record.get("author_id") is not None:
+                    self.execute(con, ADD_STATS, (record["guild_id"], record["author_id"], 1, 0))
+        return True
+
+    def set_message_flags(self, id: str, flags: int) -> None:
+        with self.transaction("set_message_flags") as con:
+            row = self.execute(con, "SELECT flags, guild_id, author_id FROM messages WHERE id=?", (id,)).fetchone()
+            if row is None or flags & ~row["flags"] == 0:
+                return
+            self.execute(con, "UPDATE messages SET flags=flags | ? WHERE id=?", (flags, id))
+            if flags & ~row["flags"] & 1 << 0 and row["guild_id"] is not None and row["author_id"] is not None:
+                self.execute(con, ADD_STATS, (row["guild_id"], row["author_id"], 0, 1))
+
+    def delete_message(self, id: str) -> None:
+        self.delete_messages([id])
+
+    def has_starred(self, message_id: str, user_id: str) -> bool:
+        return (
+            self.fetchone(
+                "has_starred", "SELECT 1 FROM star_votes WHERE message_id=? AND user_id=?", (message_id, user_id)
+            )
+            is not None
+        )
+
+    def star(self, id: str, user_id: str, required_stars: int = None, build_post=None) -> dict:
+        with self.transaction("star") as con:
+            row = self.execute(
+                con, "SELECT stars, flags, guild_id, author_id FROM messages WHERE id=?", (id,)
+            ).fetchone()
+            if row is None:
+                raise MessageNotFound()
+            stars, flags = row["stars"], row["flags"]
+            if flags & 1 << 0:
+                return {"added": False, "stars": stars, "sent": True}
+            cur = self.execute(
+                con, "INSERT OR IGNORE INTO star_votes (message_id, user_id) VALUES (?, ?)", (id, user_id)
+            )
+            if cur.rowcount == 0:
+                return {"added": False, "stars": stars, "sent": False}
+            stars += 1
+            claimed = required_stars is not None and stars >= required_stars
+            self.execute(
+                con, "UPDATE messages SET stars=?, flags=flags | ? WHERE id=?", (stars, (1 << 0) if claimed else 0, id)
+            )
+            if row["guild_id"] is not None and row["author_id"] is not None:
+                self.execute(con, ADD_STATS, (row["guild_id"], row["author_id"], 1, int(claimed)))
+            if claimed and build_post is not None:
+                url, payload = build_post()
+                now = time()
+                self.execute(
+                    con,
+                    "INSERT INTO outbox (message_id, url, payload, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+                    (id, url, payload, now, now),
+                )
+        return {"added": True, "stars": stars, "sent": claimed, "claimed": claimed}
+
+    def message_page(self, after: str, limit: int) -> list[dict]:
+        if after is None:
+            return self.fetchall("message_page", "SELECT * FROM messages ORDER BY id LIMIT ?", (limit,))
+        return self.fetchall("message_page", "SELECT * FROM messages WHERE id > ? ORDER BY id LIMIT ?", (after, limit))
+
+    def vote_page(self, after: tuple, limit: int) -> list[dict]:
+        if after is None:
+            return self.fetchall(
+                "vote_page", "SELECT message_id, user_id FROM star_votes ORDER BY message_id, user_id LIMIT ?", (limit,)
+            )
+        return self.fetchall(
+            "vote_page",
+            "SELECT message_id, user_id FROM star_votes WHERE (message_id, user_id) > (?, ?) "
+            "ORDER BY message_id, user_id LIMIT ?",
+            (*after, limit),
+        )
+
+    def import_rows(self, function: str, table: str, records: list[dict]) -> int:
+        """
+        Inserts records with the same columns in one transaction, skipping existing rows
+
+        :return: Number of inserted rows
+        """
+        if not records:
+            return 0
+        columns = list(records[0])
+        query = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders(len(columns))})"
+        rows = [tuple(record[column] for column in columns) for record in records]
+        with self.transaction(function) as con, tracing.statement(query, rows):
+            return con.executemany(query, rows).rowcount
+
+    def import_messages(self, records: list[dict]) -> int:
+        return self.import_rows("import_messages", "messages", records)
+
+    def import_votes(self, records: list[dict]) -> int:
+        return self.import_rows("import_votes", "star_votes", records)
+
+    def longest_retention(self) -> int:
+        return self.fetchone("longest_retention", "SELECT MAX(retention_days) AS days FROM guilds")["days"]
+
+    def expired_candidates(self, after: int, below: int, limit: int) -> list[dict]:
+        return self.fetchall(
+            "expired_candidates",
+            "SELECT m.id, g.retention_days FROM messages m LEFT JOIN guilds g ON g.id=m.guild_id "
+            "WHERE m.id > ? AND m.id < ? ORDER BY m.id LIMIT ?",
+            (after, below, limit),
+        )
+
+    def delete_messages(self, ids: list) -> tuple[int, int]:
+        with self.transaction("delete_messages") as con:
+            removed = [
+                (row["guild_id"], row["author_id"], -row["stars"], -row["posts"])
+                for row in self.execute(
+                    con,
+                    "SELECT guild_id, author_id, SUM(stars) AS stars, SUM(flags & 1) AS posts FROM messages "
+                    f"WHERE id IN ({placeholders(len(ids))}) AND guild_id IS NOT NULL AND author_id IS NOT NULL "
+                    "GROUP BY guild_id, author_id",
+                    ids,
+                )
+            ]
+            if removed:
+                with tracing.statement(ADD_STATS, removed):
+                    con.executemany(ADD_STATS, removed)
+            votes = self.execute(con, f"DELETE FROM star_votes WHERE message_id IN ({placeholders(len(ids))})", ids)
+            deleted = self.execute(con, f"DELETE FROM messages WHERE id IN ({placeholders(len(ids))})", ids)
+            return votes.rowcount, deleted.rowcount
+
+    def leaderboard(self, guild_id: str, limit: int) -> dict:
+        return {
+            "messages": self.fetchall(
+                "leaderboard",
+                "SELECT id, channel_id, stars FROM messages WHERE guild_id=? AND stars > 0 "
+                "ORDER BY stars DESC, id DESC LIMIT ?",
+                (guild_id, limit),
+            ),
+            "users": self.fetchall(
+                "leaderboard",
+                "SELECT user_id, stars, posts FROM star_stats WHERE guild_id=? AND stars > 0 "
+                "ORDER BY stars DESC, user_id DESC LIMIT ?",
+                (guild_id, limit),
+            ),
+        }
+
+    def rebuild_stats(self, guild_id: str) -> int:
+        with self.transaction("rebuild_stats") as con:
+            self.execute(
+                con,
+                "UPDATE messages SET stars=(SELECT COUNT(*) FROM star_votes WHERE message_id=messages.id) "
+                "WHERE guild_id=?",
+                (guild_id,),
+            )
+            self.execute(con, "DELETE FROM star_stats WHERE guild_id=?", (guild_id,))
+            return self.execute(
+                con,
+                "INSERT INTO star_stats (guild_id, user_id, stars, posts) "
+                "SELECT guild_id, author_id, SUM(stars), SUM(flags & 1) FROM messages "
+                "WHERE guild_id=? AND author_id IS NOT NULL GROUP BY guild_id, author_id",
+                (guild_id,),
+            ).rowcount
+
+    def claim_posts(self, limit: int, lease: float) -> list[dict]:
+        now = time()
+        with self.transaction("claim_posts") as con:
+            rows = self.execute(
+                con,
+                "SELECT id, message_id, url, payload, attempts, ? - created_at AS age FROM outbox "
+                "WHERE delivered_at IS NULL AND failed=0 AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            if not rows:
+                return []
+            ids = [row["id"] for row in rows]
+            self.execute(
+                con, f"UPDATE outbox SET next_attempt_at=? WHERE id IN ({placeholders(len(ids))})", (now + lease, *ids)
+            )
+        return [record(row, ("message_id",)) for row in rows]
+
+    def mark_delivered(self, id: int) -> None:
+        self.run("mark_delivered", "UPDATE outbox SET delivered_at=? WHERE id=?", (time(), id))
+
+    def reschedule_post(self, id: int, delay: float, error: str, count_attempt: bool = True) -> None:
+        self.run(
+            "reschedule_post",
+            "UPDATE outbox SET attempts=attempts+?, next_attempt_at=?, last_error=? WHERE id=?",
+            (int(count_attempt), time() + delay, error, id),
+        )
+
+    def mark_failed(self, id: int, error: str) -> None:
+        self.run("mark_failed", "UPDATE outbox SET attempts=attempts+1, failed=1, last_error=? WHERE id=?", (error, id))
+
+    def outbox_depth(self) -> int:
+        return self.fetchone(
+            "outbox_depth", "SELECT COUNT(*) AS depth FROM outbox WHERE delivered_at IS NULL AND failed=0"
+        )["depth"]
+
+    def purge_posts(self, days: int, limit: int) -> int:
+        return self.run(
+            "purge_posts",
+            "DELETE FROM outbox WHERE id IN (SELECT id FROM outbox "
+            "WHERE (delivered_at IS NOT NULL OR failed=1) AND created_at < ? LIMIT ?)",
+            (time() - days * 24 * 60 * 60, limit),
+        )
+
+    def claim_interaction(self, id: str) -> bool:
+        return (
+            self.run(
+                "claim_interaction", "INSERT OR IGNORE INTO interactions (id, created_at) VALUES (?, ?)", (id, time())
+            )
+            == 1
+        )
+
+    def interaction_response(self, id: str) -> str:
+        row = self.fetchone("interaction_response", "SELECT response FROM interactions WHERE id=?", (id,))
+        return None if row is None else row["response"]
+
+    def store_interaction_response(self, id: str, response: str) -> None:
+        self.run("store_interaction_response", "UPDATE interactions SET response=? WHERE id=?", (response, id))
+
+    def release_interaction(self, id: str) -> None:
+        self.run("release_interaction", "DELETE FROM interactions WHERE id=?", (id,))
+
+    def purge_interactions(self, seconds: float, limit: int) -> int:
+        return self.run(
+            "purge_interactions",
+            "DELETE FROM interactions WHERE id IN (SELECT id FROM interactions WHERE created_at < ? LIMIT ?)",
+            (time() - seconds, limit),
+        )
+
+    def insert_task(self, name: str, run_at: float, kwargs: str) -> int:
+        with self.connection("insert_task") as con:
+            return self.execute(
+                con, "INSERT INTO scheduled_tasks (name, run_at, kwargs) VALUES (?, ?, ?)", (name, run_at, kwargs)
+            ).lastrowid
+
+    def tasks(self) -> list[dict]:
+        return self.fetchall("tasks", "SELECT id, name, run_at, kwargs FROM scheduled_tasks", snowflakes=())
+
+    def delete_task(self, id: int) -> bool:
+        return self.run("delete_task", "DELETE FROM scheduled_tasks WHERE id=?", (id,)) == 1
@@ -0,0 +1,415 @@
+"""
+Storage backends of guilds, messages, star votes, outbox posts and persisted tasks
+
+The backend is picked with ``STORAGE_BACKEND``: ``mysql`` stores everything in the
+MySQL or MariaDB database of the ``MYSQL_*`` variables, ``sqlite`` in an embedded SQLite
+database at ``SQLITE_PATH`` for single node deployments. The modules in :mod:`resources`
+build their objects from the plain records a backend returns.
+
+The MySQL backend needs MySQL 8.0 or MariaDB 10.6 or newer, which know the
+``FOR UPDATE SKIP LOCKED`` the workers claim outbox posts with.
+"""
+import asyncio
+import threading
+from importlib import import_module
+from os import getpid
+
+import config
+
+
+# columns holding snowflakes, which are handed out as strings whatever the column type
+SNOWFLAKES = ("id", "guild_id", "webhook_id", "message_id", "user_id", "author_id", "channel_id")
+
+
+def with_snowflakes(record: dict, columns: tuple = SNOWFLAKES) -> dict:
+    """
+    :return: The record with the snowflakes of the given columns as strings, None if there is no record
+    """
+    if record is None:
+        return None
+    for column in columns:
+        if record.get(column) is not None:
+            record[column] = str(record[column])
+    return record
+
+
+# the storage is swapped as a whole, so the interface is one class rather than one per concern
+class Backend:  # pylint: disable=too-many-public-methods
+    """
+    Everything a storage backend has to implement
+
+    Records are dicts keyed by column. Snowflakes are returned as strings, timestamps of
+    outbox posts as seconds. The async variants run the blocking ones in a thread unless
+    a backend has a non-blocking implementation.
+
+    The star statistics of a guild's users always add up to the stars and sent flags of the
+    guild's stored messages with an author: every method changing those changes the
+    statistics in the same transaction.
+    """
+
+    name = None
+
+    def ping(self) -> None:
+        """
+        Makes sure the storage is reachable
+
+        :raises Exception: In case it isn't
+        """
+        raise NotImplementedError
+
+    async def ping_async(self) -> None:
+        """Makes sure the storage is reachable without blocking"""
+        await asyncio.to_thread(self.ping)
+
+    def stats(self) -> dict:
+        """
+        :return: Counters of the backend's connections
+        """
+        raise NotImplementedError
+
+    def migrate(self) -> None:
+        """Applies the pending schema migrations"""
+        raise NotImplementedError
+
+    def migrations(self) -> list[tuple]:
+        """
+        :return: Version, name and whether it is applied of every schema migration
+        """
+        raise NotImplementedError
+
+    def exclusive(self, name: str, wait: float = 0):
+        """
+        Context manager holding a lock shared by all workers for the duration of its block
+
+        :param float wait: Seconds to wait for the lock if another worker holds it
+        :return: Whether the lock was acquired
+        """
+        raise NotImplementedError
+
+    # guilds
+
+    def guild(self, id: str) -> dict:
+        """
+        :return: The record of a guild, None if it doesn't exist
+        """
+        raise NotImplementedError
+
+    async def guild_async(self, id: str) -> dict:
+        """
+        :return: The record of a guild without blocking, None if it doesn't exist
+        """
+        return await asyncio.to_thread(self.guild, id)
+
+    def insert_guild(self, record: dict) -> bool:
+        """
+        Adds a guild, leaving an existing one untouched
+
+        :return: False if the guild already existed
+        """
+        raise NotImplementedError
+
+    def upsert_webhook(self, id: str, webhook_id: str, webhook_token: str) -> None:
+        """Adds a guild or replaces the webhook of an existing one in a single statement"""
+        raise NotImplementedError
+
+    def update_guild(self, id: str, changes: dict, set_flags: int = 0, clear_flags: int = 0) -> None:
+        """
+        Changes columns of a guild in a single statement
+
+        Flags are set and cleared within the statement, so changes of other flags made at the
+        same time are kept.
+
+        :param dict changes: New values by column
+        :param int set_flags: Flags to set
+        :param int clear_flags: Flags to clear
+        """
+        raise NotImplementedError
+
+    async def update_guild_async(self, id: str, changes: dict, set_flags: int = 0, clear_flags: int = 0) -> None:
+        """Changes columns of a guild without blocking"""
+        await asyncio.to_thread(self.update_guild, id, changes, set_flags, clear_flags)
+
+    def guild_page(self, after: str, limit: int) -> list[dict]:
+        """
+        :param str after: id of the last guild of the previous page, None for the first page
+        :return: Up to ``limit`` guilds ordered by id
+        """
+        raise NotImplementedError
+
+    def import_guilds(self, records: list[dict]) -> int:
+        """
+        Adds guilds in one transaction, leaving existing ones untouched
+
+        :return: Number of added guilds
+        """
+        raise NotImplementedError
+
+    # messages and their votes
+
+    def message(self, id: str) -> dict:
+        """
+        :return: The record of a message, None if it doesn't exist
+        """
+        raise NotImplementedError
+
+    def insert_message(self, record: dict, star_user: str = None) -> bool:
+        """
+        Adds a message together with the star of a user, leaving an existing one untouched
+
+        The star is counted in the statistics of the message's author.
+
+        :return: False if the message already existed
+        """
+        raise NotImplementedError
+
+    async def insert_message_async(self, record: dict, star_user: str = None) -> bool:
+        """Adds a message without blocking, see :meth:`insert_message`"""
+        return await asyncio.to_thread(self.insert_message, record, star_user)
+
+    def set_message_flags(self, id: str, flags: int) -> None:
+        """
+        Sets flags of a message within the statement, keeping the others
+
+        Setting the sent flag counts a post in the statistics of the message's author.
+        """
+        raise NotImplementedError
+
+    def delete_message(self, id: str) -> None:
+        """Deletes a message and its votes"""
+        raise NotImplementedError
+
+    def has_starred(self, message_id: str, user_id: str) -> bool:
+        """
+        :return: Whether the user starred the message
+        """
+        raise NotImplementedError
+
+    def star(self, id: str, user_id: str, required_stars: int = None, build_post=None) -> dict:
+        """
+        Adds a user's star to a message, serialized with concurrent stars of the same message
+
+        The star reaching ``required_stars`` marks the message as sent and queues the post
+        returned by ``build_post`` in the outbox, all in one transaction. Stars and posts
+        are counted in the statistics of the message's author.
+
+        :param build_post: Returns webhook url and JSON encoded payload of the starboard post
+
+        :raises MessageNotFound: In case the message doesn't exist
+        :return: The fields of a :class:`resources.messages.StarResult`
+        """
+        raise NotImplementedError
+
+    async def star_async(self, id: str, user_id: str, required_stars: int = None, build_post=None) -> dict:
+        """Adds a user's star to a message without blocking, see :meth:`star`"""
+        return await asyncio.to_thread(self.star, id, user_id, required_stars, build_post)
+
+    def message_page(self, after: str, limit: int) -> list[dict]:
+        """
+        :param str after: id of the last message of the previous page, None for the first page
+        :return: Up to ``limit`` messages ordered by id
+        """
+        raise NotImplementedError
+
+    def vote_page(self, after: tuple, limit: int) -> list[dict]:
+        """
+        :param tuple after: message_id and user_id of the last vote of the previous page, None for the first page
+        :return: Up to ``limit`` votes ordered by message_id and user_id
+        """
+        raise NotImplementedError
+
+    def import_messages(self, records: list[dict]) -> int:
+        """
+        Adds messages in one transaction, leaving existing ones untouched
+
+        :return: Number of added messages
+        """
+        raise NotImplementedError
+
+    def import_votes(self, records: list[dict]) -> int:
+        """
+        Adds the votes of message_id and user_id records in one transaction, skipping existing ones
+
+        :return: Number of added votes
+        """
+        raise NotImplementedError
+
+    def longest_retention(self) -> int:
+        """
+        :return: The longest retention_days of a guild, None if no guild changed its retention
+        """
+        raise NotImplementedError
+
+    def expired_candidates(self, after: int, below: int, limit: int) -> list[dict]:
+        """
+        :return: id and the guild's retention_days of the next messages with ids in the range, ordered by id
+        """
+        raise NotImplementedError
+
+    def delete_messages(self, ids: list) -> tuple[int, int]:
+        """
+        Deletes messages and their votes in one transaction, and their stars and posts from the statistics
+
+        :return: Number of deleted votes and messages
+        """
+        raise NotImplementedError
+
+    # star statistics
+
+    def leaderboard(self, guild_id: str, limit: int) -> dict:
+        """
+        :return: The ``messages`` with the most stars as records of id, channel_id and stars, and
+            the ``users`` whose messages got the most stars as records of user_id, stars and posts
+        """
+        raise NotImplementedError
+
+    async def leaderboard_async(self, guild_id: str, limit: int) -> dict:
+        """The leaderboard of a guild without blocking, see :meth:`leaderboard`"""
+        return await asyncio.to_thread(self.leaderboard, guild_id, limit)
+
+    def rebuild_stats(self, guild_id: str) -> int:
+        """
+        Recounts the stars of a guild's messages from their votes and the statistics from the messages
+
+        :return: Number of users with statistics
+        """
+        raise NotImplementedError
+
+    # outbox
+
+    def claim_posts(self, limit: int, lease: float) -> list[dict]:
+        """
+        Leases due posts so no other worker picks them up meanwhile
+
+        :return: The posts' records with their age in seconds
+        """
+        raise NotImplementedError
+
+    def mark_delivered(self, id: int) -> None:
+        """Marks a post as delivered"""
+        raise NotImplementedError
+
+    def reschedule_post(self, id: int, delay: float, error: str, count_attempt: bool = True) -> None:
+        """Counts a failed attempt unless told otherwise and schedules the next one"""
+        raise NotImplementedError
+
+    def mark_failed(self, id: int, error: str) -> None:
+        """Counts a failed attempt and gives up on a post"""
+        raise NotImplementedError
+
+    def outbox_depth(self) -> int:
+        """
+        :return: Number of posts that still wait for delivery
+        """
+        raise NotImplementedError
+
+    def purge_posts(self, days: int, limit: int) -> int:
+        """
+        Deletes delivered and failed posts older than ``days``
+
+        :return: Number of deleted posts, at most ``limit``
+        """
+        raise NotImplementedError
+
+    # handled interactions
+
+    def claim_interaction(self, id: str) -> bool:
+        """
+        Records that an interaction is being handled
+
+        :return: False if it was recorded before
+        """
+        raise NotImplementedError
+
+    async def claim_interaction_async(self, id: str) -> bool:
+        """Records that an interaction is being handled without blocking, see :meth:`claim_interaction`"""
+        return await asyncio.to_thread(self.claim_interaction, id)
+
+    def interaction_response(self, id: str) -> str:
+        """
+        :return: The stored response of an interaction, None if it is still being handled or wasn't claimed
+        """
+        raise NotImplementedError
+
+    async def interaction_response_async(self, id: str) -> str:
+        """The stored response of an interaction without blocking, see :meth:`interaction_response`"""
+        return await asyncio.to_thread(self.interaction_response, id)
+
+    def store_interaction_response(self, id: str, response: str) -> None:
+        """Stores the JSON encoded response of a claimed interaction"""
+        raise NotImplementedError
+
+    async def store_interaction_response_async(self, id: str, response: str) -> None:
+        """Stores the response of a claimed interaction without blocking"""
+        await asyncio.to_thread(self.store_interaction_response, id, response)
+
+    def release_interaction(self, id: str) -> None:
+        """Forgets a claimed interaction, so it can be claimed again"""
+        raise NotImplementedError
+
+    async def release_interaction_async(self, id: str) -> None:
+        """Forgets a claimed interaction without blocking"""
+        await asyncio.to_thread(self.release_interaction, id)
+
+    def purge_interactions(self, seconds: float, limit: int) -> int:
+        """
+        Deletes interactions claimed more than ``seconds`` ago
+
+        :return: Number of deleted interactions, at most ``limit``
+        """
+        raise NotImplementedError
+
+    # persisted tasks
+
+    def insert_task(self, name: str, run_at: float, kwargs: str) -> int:
+        """
+        :param str kwargs: JSON encoded arguments
+        :return: The task's id
+        """
+        raise NotImplementedError
+
+    def tasks(self) -> list[dict]:
+        """
+        :return: The records of all persisted tasks
+        """
+        raise NotImplementedError
+
+    def delete_task(self, id: int) -> bool:
+        """
+        :return: False if the task was already deleted
+        """
+        raise NotImplementedError
+
+
+# modules and classes of the backends, only the configured one is imported along with its driver
+BACKENDS = {
+    "mysql": ("resources.mysql_backend", "MySQLBackend"),
+    "sqlite": ("resources.sqlite_backend", "SQLiteBackend"),
+}
+
+_backend: Backend = None  # pylint: disable=invalid-name
+_backend_pid = None  # pylint: disable=invalid-name
+_backend_lock = threading.Lock()
+
+
+def create_backend(name: str) -> Backend:
+    """
+    :param str name: ``mysql`` or ``sqlite``
+    :return: A new backend of the given kind
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend {name!r}, use mysql or sqlite")
+    module, cls = BACKENDS[name]
+    return getattr(import_module(module), cls)()
+
+
+def get_backend() -> Backend:
+    """
+    Returns the configured backend of the current process, creating it on first use
+    """
+    global _backend, _backend_pid  # pylint: disable=global-statement
+    if _backend is None or _backend_pid != getpid():
+        with _backend_lock:
+            if _backend is None or _backend_pid != getpid():
+                _backend = create_backend(config.Database.BACKEND)
+                _backend_pid = getpid()
+    return _backend
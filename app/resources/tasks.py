@@ -0,0 +1,51 @@
+"""
+Scheduled tasks that survive restarts
+"""
+import json
+from dataclasses import dataclass
+
+from resources.storage import get_backend
+
+
+@dataclass
+class Task:
+    """
+    :ivar int id: Internal task id
+    :ivar str name: Name of the registered task
+    :ivar float run_at: Unix time the task is due
+    :ivar dict kwargs: Arguments of the task
+    """
+
+    id: int
+    name: str
+    run_at: float
+    kwargs: dict
+
+
+def insert(name: str, run_at: float, kwargs: dict) -> int:
+    """
+    Persists a task
+
+    :return: The task's id
+    """
+    return get_backend().insert_task(name, run_at, json.dumps(kwargs))
+
+
+def get_all() -> list[Task]:
+    """
+    :return: All persisted tasks that didn't run yet
+    """
+    records = get_backend().tasks()
+    return [
+        Task(id=record["id"], name=record["name"], run_at=record["run_at"], kwargs=json.loads(record["kwargs"]))
+        for record in records
+    ]
+
+
+def claim(id: int) -> bool:
+    """
+    Removes a task before it is run
+
+    :return: False if another worker already claimed it
+    """
+    return get_backend().delete_task(id)
@@ -0,0 +1,184 @@
+"""
+Response payloads built directly as plain dicts
+
+Building the payloads without the library's models avoids constructing and dumping
+embed and component objects on every click and serializes each response only once.
+"""
+import dataclasses
+import json
+from functools import lru_cache
+
+import config
+from flask_discord_interactions.models.embed import Embed
+from flask_discord_interactions.models.message import Message
+from translations import t
+
+# keys of received embeds that may be sent back to Discord
+EMBED_KEYS = (
+    "title",
+    "type",
+    "description",
+    "url",
+    "timestamp",
+    "color",
+    "footer",
+    "image",
+    "thumbnail",
+    "author",
+    "fields",
+)
+STAR_EMOJI = {"name": "⭐"}
+SETUP_URL = (
+    "https://discord.com/api/oauth2/authorize?client_id=966294455726506035&permissions=0"
+    "&redirect_uri=https%3A%2F%2Fstarboard.rfive.de%2Fapi%2Fsetup&response_type=code&scope=webhook.incoming"
+)
+
+
+@dataclasses.dataclass
+class RawMessage(Message):
+    """
+    A message whose payload is already a plain dict
+
+    :ivar dict payload: The message data as sent to Discord
+    """
+
+    payload: dict = None
+
+    def encode(self, followup=False):
+        payload = self.payload if followup else {"type": self.response_type, "data": self.payload}
+        return json.dumps(payload).encode("utf-8"), "application/json"
+
+
+@dataclasses.dataclass
+class EncodedMessage(Message):
+    """
+    A response that has already been encoded, like the stored one of a duplicate interaction
+
+    :ivar str body: The JSON encoded response
+    """
+
+    body: str = None
+
+    def encode(self, followup=False):
+        return self.body.encode("utf-8"), "application/json"
+
+
+def message_payload(content: str = None, embeds: list = None, components: list = None, ephemeral=False) -> dict:
+    """
+    :return: The data of a message
+    """
+    payload = {"flags": 64 if ephemeral else 0}
+    if content is not None:
+        payload["content"] = content
+    if embeds is not None:
+        payload["embeds"] = embeds
+    if components is not None:
+        payload["components"] = components
+    return payload
+
+
+def jump_url(guild_id: str, channel_id: str, message_id: str) -> str:
+    """
+    :return: Link to a message
+    """
+    return f"https://discord.com/channels/{guild_id}/{channel_id}/{message_id}"
+
+
+def jump_button(url: str, locale: str = None) -> dict:
+    """
+    :return: The button linking to the starred message
+    """
+    return {"type": 2, "style": 5, "label": t("message.jump", locale=locale), "url": url}
+
+
+def star_components(message_id: str, stars: int, url: str, locale: str = None, disabled: bool = False) -> list:
+    """
+    :return: The action row with the star button and the jump button
+    """
+    return [
+        {
+            "type": 1,
+            "components": [
+                {
+                    "type": 2,
+                    "style": 2,
+                    "label": str(stars),
+                    "emoji": STAR_EMOJI,
+                    "custom_id": f"star\n{message_id}\n{stars}",
+                    "disabled": disabled,
+                },
+                jump_button(url, locale),
+            ],
+        }
+    ]
+
+
+def clean_embeds(embeds: list) -> list:
+    """
+    :return: Received embeds reduced to the keys that can be sent again
+    """
+    # parsing the context turns the embeds of the received message into Embed objects in place
+    embeds = [embed.dump() if isinstance(embed, Embed) else embed for embed in embeds]
+    return [{key: embed[key] for key in EMBED_KEYS if key in embed} for embed in embeds]
+
+
+def with_footer(embeds: list, footer: str, **extra) -> list:
+    """
+    :return: A copy of the received embeds with the first one's footer replaced
+    """
+    embeds = clean_embeds(embeds)
+    embeds[0] = {**embeds[0], "footer": {"text": footer}, **extra}
+    return embeds
+
+
+def star_update(content: str, embeds: list, components: list) -> RawMessage:
+    """
+    :return: The update of the clicked star message
+    """
+    return RawMessage(update=True, payload=message_payload(content, embeds, components))
+
+
+def starboard_post(embeds: list, message_id: str, url: str, timestamp: str, locale: str) -> dict:
+    """
+    :return: The payload posted to the starboard webhook
+    """
+    return message_payload(
+        embeds=with_footer(embeds, message_id, timestamp=timestamp),
+        components=[{"type": 1, "components": [jump_button(url, locale)]}],
+    )
+
+
+@lru_cache(maxsize=None)
+def guild_not_found(locale: str) -> bytes:
+    """
+    :return: The serialized response prompting for the webhook setup, built once per locale
+    """
+    data = message_payload(
+        embeds=[
+            {
+                "title": t("guild_not_found.title", locale=locale),
+                "description": t("guild_not_found.body", locale=locale),
+                "color": config.EMBED_COLOR,
+                "fields": [
+                    {
+                        "name": t("guild_not_found.explanation.name", locale=locale),
+                        "value": t("guild_not_found.explanation.value", locale=locale),
+                    },
+                    {
+                        "name": t("guild_not_found.warning.name", locale=locale),
+                        "value": t("guild_not_found.warning.value", locale=locale),
+                    },
+                ],
+            }
+        ],
+        components=[
+            {
+                "type": 1,
+                "components": [
+                    {"type": 2, "style": 5, "label": t("guild_not_found.button", locale=locale), "url": SETUP_URL}
+                ],
+            }
+        ],
+        ephemeral=True,
+    )
+    return json.dumps({"type": 4, "data": data}).encode("utf-8")
@@ -0,0 +1,282 @@
+"""
+Purging of expired messages
+
+Run with ``python3 retention.py`` from the app directory, see ``--help`` for the options.
+"""
+import argparse
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from os import getpid
+from time import monotonic, time
+
+import config
+from resources import database, guilds, messages
+from resources.storage import get_backend
+from scheduler import scheduler
+
+DAY = 24 * 60 * 60
+# stars are accepted for 30 days, so nothing younger may be purged
+MIN_RETENTION_DAYS = 30
+
+
+# messages below this snowflake were purged by an earlier run of this process
+_purged_below = 0  # pylint: disable=invalid-name
+
+
+@dataclass
+class PurgeReport:
+    """
+    :ivar int messages: Purged messages
+    :ivar int votes: Purged star votes
+    :ivar int posts: Purged delivered or failed outbox posts
+    :ivar int interactions: Purged interactions older than the deduplication window
+    :ivar int partitions: Dropped partitions
+    :ivar int batches: Number of batches
+    :ivar float duration: Seconds the purge took
+    """
+
+    messages: int = 0
+    votes: int = 0
+    posts: int = 0
+    interactions: int = 0
+    partitions: int = 0
+    batches: int = 0
+    duration: float = 0.0
+
+
+def cutoff(retention_days: int = None) -> int:
+    """
+    :param int retention_days: Days messages are kept, None for the default
+    :return: The snowflake below which messages are expired
+    """
+    days = max(retention_days or config.Retention.DAYS, MIN_RETENTION_DAYS)
+    return messages.snowflake(time() - days * DAY)
+
+
+def expired_everywhere() -> int:
+    """
+    :return: The snowflake below which messages are expired in every guild
+    """
+    return cutoff(max(get_backend().longest_retention() or 0, config.Retention.DAYS))
+
+
+def expired_batch(after: int, batch_size: int) -> tuple[list[int], int]:
+    """
+    Finds expired messages in the next id range
+
+    Only ids older than the shortest possible retention are scanned, the retention
+    of each message's guild is applied afterwards.
+
+    :param int after: Last id of the previous batch
+    :param int batch_size: Number of messages to scan
+    :return: The expired ids and the last scanned id, None if nothing was left
+    """
+    records = get_backend().expired_candidates(after, cutoff(MIN_RETENTION_DAYS), batch_size)
+    if not records:
+        return [], None
+    expired = [int(record["id"]) for record in records if int(record["id"]) < cutoff(record["retention_days"])]
+    return expired, int(records[-1]["id"])
+
+
+def month_start(year: int, month: int) -> datetime:
+    """
+    :return: The first moment of a month in UTC, months past December roll over
+    """
+    return datetime(year + (month - 1) // 12, (month - 1) % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partitions() -> dict[str, str]:
+    """
+    :return: Upper snowflake bounds of the partitions of messages by name, empty if unpartitioned
+
+    Only tables of the MySQL backend can be partitioned.
+    """
+    if get_backend().name != "mysql":
+        return {}
+    records = database.fetchall(
+        "SELECT PARTITION_NAME AS name, PARTITION_DESCRIPTION AS bound FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='messages' AND PARTITION_NAME IS NOT NULL"
+    )
+    return {record["name"]: record["bound"] for record in records}
+
+
+def ensure_partitions(months_ahead: int = 3) -> None:
+    """
+    Range partitions messages and star_votes by month of the message snowflake
+
+    Unpartitioned tables get partitioned, partitioned ones get the partitions of the
+    coming months split off their catch-all partition. This requires numeric message ids.
+
+    :param int months_ahead: Number of future months to prepare partitions for
+    """
+    now = datetime.now(timezone.utc)
+    existing = partitions()
+    definitions = []
+    # unpartitioned tables start with a partition for everything older than the star window
+    first = -1 if existing else -2
+    for offset in range(first, months_ahead + 1):
+        first_day = month_start(now.year, now.month + offset)
+        if f"p{first_day:%Y%m}" in existing:
+            continue
+        bound = messages.snowflake(month_start(now.year, now.month + offset + 1).timestamp())
+        definitions.append(f"PARTITION p{first_day:%Y%m} VALUES LESS THAN ({bound})")
+    if not definitions:
+        return
+    definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    for table, column in (("messages", "id"), ("star_votes", "message_id")):
+        if existing:
+            database.execute(f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO ({', '.join(definitions)})")
+        else:
+            database.execute(f"ALTER TABLE {table} PARTITION BY RANGE ({column}) ({', '.join(definitions)})")
+    logging.info("Prepared %s partitions", len(definitions) - 1)
+
+
+def forget_stats(partition: str) -> None:
+    """
+    Subtracts the stars and posts of the messages in a partition from the star statistics
+
+    Expired messages can't be starred anymore, so nothing changes them in the meantime.
+    """
+    # pylint: disable=import-outside-toplevel
+    from resources.mysql_backend import subtract_stats
+
+    with database.transaction() as cur:
+        subtract_stats(cur, f"messages PARTITION ({partition})")
+
+
+def drop_expired_partitions() -> int:
+    """
+    Drops whole partitions whose messages are expired in every guild
+
+    :return: Number of dropped partitions
+    """
+    limit = expired_everywhere()
+    dropped = 0
+    for name, bound in partitions().items():
+        if bound != "MAXVALUE" and int(bound) <= limit:
+            forget_stats(name)
+            database.execute(f"ALTER TABLE star_votes DROP PARTITION {name}")
+            database.execute(f"ALTER TABLE messages DROP PARTITION {name}")
+            dropped += 1
+    return dropped
+
+
+def purge(batch_size: int = None, dry_run: bool = False) -> PurgeReport:
+    """
+    Deletes expired messages, their votes, old outbox posts and interactions in small batches
+
+    Every batch is its own short transaction, so no long lasting locks are held. Messages
+    expired in every guild are all gone after a purge, so the next purge of the process
+    starts scanning where they ended.
+
+    :param int batch_size: Number of rows handled per batch
+    :param bool dry_run: Only count what would be purged
+    :return: What has been purged
+    """
+    global _purged_below  # pylint: disable=global-statement
+    batch_size = batch_size or config.Retention.BATCH_SIZE
+    report = PurgeReport()
+    started = monotonic()
+    purged_below = expired_everywhere()
+    if not dry_run and partitions():
+        report.partitions = drop_expired_partitions()
+        ensure_partitions()
+    after = max(_purged_below - 1, 0)
+    while True:
+        expired, after = expired_batch(after, batch_size)
+        if after is None:
+            break
+        report.batches += 1
+        if not expired:
+            continue
+        if dry_run:
+            report.messages += len(expired)
+            continue
+        votes, purged = get_backend().delete_messages(expired)
+        report.votes += votes
+        report.messages += purged
+    if not dry_run:
+        _purged_below = purged_below
+    while not dry_run:
+        purged = get_backend().purge_posts(config.Retention.DAYS, batch_size)
+        report.posts += purged
+        report.batches += 1
+        if purged < batch_size:
+            break
+    while not dry_run:
+        purged = get_backend().purge_interactions(config.Idempotency.WINDOW, batch_size)
+        report.interactions += purged
+        report.batches += 1
+        if purged < batch_size:
+            break
+    report.duration = monotonic() - started
+    logging.info(
+        "Purged %s messages, %s votes, %s posts, %s interactions and %s partitions in %s batches within %.2fs",
+        report.messages,
+        report.votes,
+        report.posts,
+        report.interactions,
+        report.partitions,
+        report.batches,
+        report.duration,
+    )
+    return report
+
+
+@scheduler.task(recurring=True)
+def purge_expired() -> None:
+    """Purges expired messages and schedules the next run"""
+    try:
+        # only one worker needs to purge at a time
+        with get_backend().exclusive("starboard_retention") as acquired:
+            if acquired:
+                purge()
+    finally:
+        scheduler.schedule("purge_expired", config.Retention.INTERVAL, persist=False)
+
+
+_scheduled_in = None  # pylint: disable=invalid-name
+
+
+def start() -> None:
+    """
+    Schedules the periodic purge in the current process if it is enabled
+    """
+    global _scheduled_in  # pylint: disable=global-statement
+    if config.Retention.INTERVAL <= 0 or _scheduled_in == getpid():
+        return
+    _scheduled_in = getpid()
+    scheduler.schedule("purge_expired", config.Retention.INTERVAL, persist=False)
+
+
+def main() -> None:
+    """Purges or changes a guild's retention with the options of the command line"""
+    logging.basicConfig(level=logging.INFO, format=config.LOG_FORMAT)
+    parser = argparse.ArgumentParser(description="Purge expired messages")
+    parser.add_argument("--batch-size", type=int, help="rows handled per batch")
+    parser.add_argument("--dry-run", action="store_true", help="only count the expired messages")
+    parser.add_argument(
+        "--set-guild", nargs=2, metavar=("GUILD_ID", "DAYS"), help="change the retention of a guild instead"
+    )
+    parser.add_argument("--partition", action="store_true", help="partition the messages by month instead")
+    args = parser.parse_args()
+    if args.partition:
+        if get_backend().name != "mysql":
+            parser.error("only the tables of the MySQL backend can be partitioned")
+        ensure_partitions()
+    elif args.set_guild:
+        guild_id, retention_days = args.set_guild[0], int(args.set_guild[1])
+        if retention_days < MIN_RETENTION_DAYS:
+            parser.error(f"the retention must be at least {MIN_RETENTION_DAYS} days")
+        try:
+            guild = guilds.get(guild_id)
+        except guilds.GuildNotFound:
+            parser.error(f"there is no guild with the id {guild_id}")
+        guilds.update(guild, retention_days=retention_days)
+    else:
+        purge(args.batch_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Delayed task execution shared by all handlers
+
+Tasks are registered by name so they can optionally be persisted and picked up
+again by any worker after a restart.
+"""
+import atexit
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import getpid
+from time import time
+
+import config
+from resources import tasks
+
+
+class Scheduler:
+    """
+    Runs registered tasks after a delay using a timer heap and a bounded worker pool
+
+    :param int workers: Maximum number of tasks running at once
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.pid = None
+        self._tasks = {}
+        self._recurring = set()
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Condition()
+        self._running = False
+        self._timer = None
+        self._executor = None
+        self._closed_in = None
+
+    def task(self, func=None, *, recurring: bool = False):
+        """
+        Decorator registering a function that can be scheduled by its name
+
+        :param bool recurring: The task schedules its next run itself, so it's dropped on shutdown instead of run
+        """
+
+        def register(func):
+            self._tasks[func.__name__] = func
+            if recurring:
+                self._recurring.add(func.__name__)
+            return func
+
+        return register if func is None else register(func)
+
+    def start(self) -> None:
+        """
+        Starts the timer thread of the current process and loads persisted tasks
+        """
+        if self._running and self.pid == getpid():
+            return
+        with self._lock:
+            if self._running and self.pid == getpid():
+                return
+            self.pid = getpid()
+            self._running = True
+            self._heap = []
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="scheduler")
+            self._timer = threading.Thread(target=self._run, name="scheduler-timer", daemon=True)
+        if config.Scheduler.PERSIST:
+            try:
+                for record in tasks.get_all():
+                    self._push(record.run_at, record.name, record.kwargs, record.id)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to load persisted tasks")
+        self._timer.start()
+
+    def schedule(self, name: str, delay: float, persist: bool = None, **kwargs) -> bool:
+        """
+        Schedules a registered task
+
+        :param str name: Name of the task
+        :param float delay: Seconds to wait before running it
+        :param bool persist: Store the task so it survives restarts, defaults to the configured value
+        :param kwargs: Arguments of the task, must be JSON serializable if persisted
+        :return: Whether the task was scheduled, nothing is scheduled once the scheduler shut down
+        """
+        if name not in self._tasks:
+            raise ValueError(f"Unknown task {name}")
+        if self._closed_in == getpid():
+            logging.info("Not scheduling %s, the scheduler shut down", name)
+            return False
+        self.start()
+        run_at = time() + delay
+        task_id = None
+        if config.Scheduler.PERSIST if persist is None else persist:
+            task_id = tasks.insert(name, run_at, kwargs)
+        self._push(run_at, name, kwargs, task_id)
+        return True
+
+    def _push(self, run_at: float, name: str, kwargs: dict, task_id: int = None) -> None:
+        with self._lock:
+            heapq.heappush(self._heap, (run_at, next(self._counter), name, kwargs, task_id))
+            self._lock.notify()
+
+    def _run(self) -> None:
+        with self._lock:
+            while self._running:
+                if not self._heap:
+                    self._lock.wait()
+                    continue
+                run_at, _, name, kwargs, task_id = self._heap[0]
+                if run_at > time():
+                    self._lock.wait(run_at - time())
+                    continue
+                heapq.heappop(self._heap)
+                self._executor.submit(self._execute, name, kwargs, task_id)
+
+    def _execute(self, name: str, kwargs: dict, task_id: int = None) -> None:
+        # another worker may have loaded the same persisted task
+        if task_id is not None and not tasks.claim(task_id):
+            return
+        try:
+            self._tasks[name](**kwargs)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Scheduled task %s failed", name)
+
+    def pending(self) -> int:
+        """
+        :return: Number of tasks waiting for their time
+        """
+        with self._lock:
+            return len(self._heap)
+
+    def shutdown(self, drain: bool = True, timeout: float = 5) -> None:
+        """
+        Stops the scheduler, tasks scheduled afterwards are refused
+
+        :param bool drain: Run pending tasks that aren't persisted or recurring right away instead of dropping them
+        :param float timeout: Seconds to wait for the timer thread
+        """
+        with self._lock:
+            self._closed_in = getpid()
+            if not self._running:
+                return
+            self._running = False
+            heap, self._heap = self._heap, []
+            self._lock.notify_all()
+        self._timer.join(timeout)
+        if drain:
+            for _, _, name, kwargs, task_id in sorted(heap):
+                # persisted tasks are picked up again after the restart, recurring ones are started again
+                if task_id is None and name not in self._recurring:
+                    self._executor.submit(self._execute, name, kwargs)
+        self._executor.shutdown(wait=True)
+
+
+scheduler = Scheduler(config.Scheduler.WORKERS)
+atexit.register(scheduler.shutdown)
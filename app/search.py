@@ -0,0 +1,123 @@
+"""
+Ranked fuzzy search over titled documents, used for autocompletion
+"""
+import re
+from dataclasses import dataclass, field
+from heapq import nlargest
+
+WORD = re.compile(r"\w+")
+
+EXACT_SCORE = 100.0
+PREFIX_SCORE = 80.0
+WORD_PREFIX_SCORE = 60.0
+TITLE_TRIGRAM_SCORE = 40.0
+BODY_TRIGRAM_SCORE = 15.0
+# body trigrams found in more documents than this share carry no information
+COMMON_TRIGRAM_RATIO = 0.5
+
+
+def normalize(text: str) -> str:
+    """Lowercases a text and collapses everything but words into single spaces"""
+    return " ".join(WORD.findall(text.lower().replace("_", " ")))
+
+
+def trigrams(text: str) -> set[str]:
+    """
+    :return: The trigrams of every word of a normalized text, padded so short words have some too
+    """
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+@dataclass
+class TrieNode:
+    """
+    :ivar dict children: Child nodes by character
+    :ivar set documents: Ids of the documents with a title word starting with this node's prefix
+    """
+
+    children: dict = field(default_factory=dict)
+    documents: set = field(default_factory=set)
+
+
+class SearchIndex:
+    """
+    Precomputed search index over a fixed set of documents
+
+    Titles are indexed in a prefix trie and by trigrams, bodies by trigrams only,
+    so typos and words from the page content still find the right document.
+
+    :param documents: Tuples of the result to return, the title and the body of every document
+    """
+
+    def __init__(self, documents):
+        self.results = []
+        self.titles = []
+        self.trie = TrieNode()
+        self.title_trigrams = {}
+        self.body_trigrams = {}
+        for doc_id, (result, title, body) in enumerate(documents):
+            title = normalize(title)
+            self.results.append(result)
+            self.titles.append(title)
+            for word in {title, *title.split()}:
+                node = self.trie
+                for char in word:
+                    node = node.children.setdefault(char, TrieNode())
+                    node.documents.add(doc_id)
+            for gram in trigrams(title):
+                self.title_trigrams.setdefault(gram, []).append(doc_id)
+            for gram in trigrams(normalize(body)):
+                self.body_trigrams.setdefault(gram, []).append(doc_id)
+        common = max(len(self.results) * COMMON_TRIGRAM_RATIO, 1)
+        self.body_trigrams = {gram: ids for gram, ids in self.body_trigrams.items() if len(ids) <= common}
+        self.alphabetical = sorted(range(len(self.results)), key=self.titles.__getitem__)
+
+    def prefix_documents(self, prefix: str) -> set:
+        """
+        :return: Ids of the documents with a title or title word starting with the prefix
+        """
+        node = self.trie
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.documents
+
+    def search(self, query: str, limit: int = 25) -> list:
+        """
+        Finds the best matching documents
+
+        :param str query: What the user typed so far
+        :param int limit: Maximum number of results
+        :return: The results of the best documents, best first
+        """
+        query = normalize(query)
+        if not query:
+            return [self.results[doc_id] for doc_id in self.alphabetical[:limit]]
+        scores = {}
+        for doc_id in self.prefix_documents(query):
+            title = self.titles[doc_id]
+            if title == query:
+                scores[doc_id] = EXACT_SCORE
+            elif title.startswith(query):
+                scores[doc_id] = PREFIX_SCORE
+            else:
+                scores[doc_id] = WORD_PREFIX_SCORE
+        query_trigrams = trigrams(query)
+        for postings, weight in ((self.title_trigrams, TITLE_TRIGRAM_SCORE), (self.body_trigrams, BODY_TRIGRAM_SCORE)):
+            share = weight / len(query_trigrams)
+            for gram in query_trigrams:
+                for doc_id in postings.get(gram, ()):
+                    scores[doc_id] = scores.get(doc_id, 0.0) + share
+        # trigram matches below a third of the query are noise
+        threshold = BODY_TRIGRAM_SCORE / 3
+        best = nlargest(
+            limit,
+            (doc_id for doc_id, score in scores.items() if score >= threshold),
+            key=lambda doc_id: (scores[doc_id], -len(self.titles[doc_id])),
+        )
+        return [self.results[doc_id] for doc_id in best]
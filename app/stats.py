@@ -0,0 +1,33 @@
+"""
+Rebuild of the star statistics behind the leaderboard
+
+Run with ``python3 stats.py`` from the app directory, see ``--help`` for the options. The
+statistics are kept up to date with every star, so a rebuild is only needed after they
+drifted apart from the star votes, like after an import or a partial partition drop.
+"""
+import argparse
+import logging
+from time import monotonic
+
+import config
+from resources import leaderboard
+from resources.storage import get_backend
+
+
+def main() -> None:
+    """Rebuilds the statistics with the options of the command line"""
+    logging.basicConfig(level=logging.INFO, format=config.LOG_FORMAT)
+    parser = argparse.ArgumentParser(description="Recount the star statistics from the star votes")
+    parser.add_argument("--guild", help="only rebuild the statistics of this guild")
+    parser.add_argument("--batch-size", type=int, help="guilds loaded at a time")
+    args = parser.parse_args()
+    started = monotonic()
+    with get_backend().exclusive("starboard_stats") as acquired:
+        if not acquired:
+            parser.error("another rebuild is running")
+        users = leaderboard.rebuild(args.guild, args.batch_size)
+    logging.info("Rebuilt the statistics of %s users within %.2fs", users, monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Tracing of the database statements every interaction runs
+
+Statements are recorded by :mod:`resources.database` and :mod:`resources.aiodatabase`
+into the trace of the interaction currently handled, which lives in a context variable
+like the locale. A summary is logged once the handler finished, and statements slower
+than the configured threshold are logged right away, also outside of interactions.
+"""
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+
+import config
+import metrics
+
+# most statements one interaction may run per handler, checked by the tests and the load test,
+# the guild lookup is counted even though it's usually cached
+QUERY_BUDGETS = {"Star message": 4, "star": 7, "settings": 3, "manual:autocomplete": 0}
+
+_current = ContextVar("trace", default=None)
+
+
+def shape(args) -> str:
+    """
+    :return: The types of a statement's parameters, never their values
+    """
+    if args is None:
+        return "()"
+    if isinstance(args, dict):
+        return "{" + ", ".join(f"{name}: {type(value).__name__}" for name, value in args.items()) + "}"
+    if isinstance(args, list):
+        # the parameter sets of executemany
+        return f"{len(args)} x {shape(args[0]) if args else '()'}"
+    return "(" + ", ".join(type(value).__name__ for value in args) + ")"
+
+
+def statement_text(query: str) -> str:
+    """
+    :return: The statement on a single line
+    """
+    return " ".join(query.split())
+
+
+class Trace:
+    """
+    The statements run on behalf of one interaction
+
+    :param str interaction_id: id of the interaction
+    :param str handler: Name of the command or custom id of the handler
+    """
+
+    def __init__(self, interaction_id: str, handler: str):
+        self.interaction_id = interaction_id
+        self.handler = handler
+        self.queries = []
+
+    @property
+    def duration(self) -> float:
+        """Seconds spent executing the statements"""
+        return sum(duration for _, _, duration in self.queries)
+
+    def describe(self) -> str:
+        """
+        :return: Every statement with its parameters' shape and duration, one per line
+        """
+        return "\n".join(
+            f"  {duration * 1000:.1f}ms {statement_text(query)} {shape(args)}" for query, args, duration in self.queries
+        )
+
+
+def record(query: str, args, duration: float) -> None:
+    """
+    Adds an executed statement to the current trace and logs it if it was slow
+    """
+    current = _current.get()
+    if current is not None:
+        current.queries.append((query, args, duration))
+    if duration < config.Tracing.SLOW_QUERY:
+        return
+    if current is None:
+        logging.warning("Slow query (%.1fms): %s %s", duration * 1000, statement_text(query), shape(args))
+    else:
+        logging.warning(
+            "Slow query (%.1fms) in %s of interaction %s: %s %s",
+            duration * 1000,
+            current.handler,
+            current.interaction_id,
+            statement_text(query),
+            shape(args),
+        )
+
+
+@contextmanager
+def statement(query: str, args=None):
+    """
+    Context manager recording the statement executed in its block
+    """
+    started = monotonic()
+    try:
+        yield
+    finally:
+        record(query, args, monotonic() - started)
+
+
+class TracedCursor:
+    """
+    Cursor of a transaction recording the statements executed through it
+
+    :param cursor: The wrapped cursor
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, query: str, args=None):
+        """Executes a statement"""
+        with statement(query, args):
+            return self._cursor.execute(query, args)
+
+    def executemany(self, query: str, args: list):
+        """Executes a statement once for every set of parameters"""
+        with statement(query, args):
+            return self._cursor.executemany(query, args)
+
+
+class AsyncTracedCursor:
+    """
+    Cursor of an async transaction recording the statements executed through it
+
+    :param cursor: The wrapped cursor
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def execute(self, query: str, args=None):
+        """Executes a statement"""
+        with statement(query, args):
+            return await self._cursor.execute(query, args)
+
+    async def executemany(self, query: str, args: list):
+        """Executes a statement once for every set of parameters"""
+        with statement(query, args):
+            return await self._cursor.executemany(query, args)
+
+
+@contextmanager
+def trace(interaction_id: str, handler: str):
+    """
+    Context manager tracing the statements of an interaction's handler, logging a summary afterwards
+
+    :param str interaction_id: id of the interaction
+    :param str handler: Name of the command or custom id of the handler
+    """
+    current = Trace(interaction_id, handler)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+        metrics.DB_QUERIES.observe(len(current.queries), handler)
+        if config.Tracing.SUMMARY:
+            logging.info(
+                "Interaction %s (%s) ran %d queries in %.1fms",
+                interaction_id,
+                handler,
+                len(current.queries),
+                current.duration * 1000,
+            )
+        if current.queries and logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Queries of interaction %s:\n%s", interaction_id, current.describe())
+
+
+class TooManyQueries(AssertionError):
+    """
+    Exception raised when a block ran more statements than allowed
+    """
+
+    def __init__(self, limit: int, exceeded: Trace):
+        super().__init__(limit, exceeded)
+        self.limit = limit
+        self.trace = exceeded
+
+    def __str__(self) -> str:
+        return f"{len(self.trace.queries)} queries ran, at most {self.limit} are allowed:\n{self.trace.describe()}"
+
+
+@contextmanager
+def max_queries(limit: int, handler: str = "test"):
+    """
+    Context manager asserting that its block runs at most ``limit`` statements, for use in tests::
+
+        with tracing.max_queries(4):
+            star_button(ctx, message_id, stars)
+
+    The statements still count towards an enclosing trace.
+
+    :raises TooManyQueries: In case the block ran more statements
+    """
+    outer = _current.get()
+    current = Trace(outer.interaction_id if outer else "-", handler)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+        if outer is not None:
+            outer.queries.extend(current.queries)
+    if len(current.queries) > limit:
+        raise TooManyQueries(limit, current)
@@ -0,0 +1,134 @@
+"""
+Precompiled translations with a request scoped locale
+
+The locale files are flattened into one dict per locale when they are loaded and
+every string with placeholders is split into its parts once, so a lookup is a
+dict access and formatting a join.
+"""
+import re
+import threading
+from contextvars import ContextVar
+from os import listdir
+
+import config
+import yaml
+
+PLACEHOLDER = re.compile(r"%\{(\w+)\}")
+
+_locale: ContextVar[str] = ContextVar("locale", default=config.I18n.FALLBACK)
+_catalog: dict = None  # pylint: disable=invalid-name
+_localizations: dict = None  # pylint: disable=invalid-name
+_load_lock = threading.Lock()
+
+
+class Template:  # pylint: disable=too-few-public-methods
+    """
+    A translation with placeholders, split into literal parts and placeholder names
+
+    :param str text: The translation with ``%{name}`` placeholders
+    """
+
+    __slots__ = ("text", "parts")
+
+    def __init__(self, text: str):
+        self.text = text
+        # odd indices are placeholder names
+        self.parts = PLACEHOLDER.split(text)
+
+    def format(self, values: dict) -> str:
+        """
+        :return: The translation with the placeholders replaced, unknown ones are kept
+        """
+        parts = self.parts
+        return "".join(
+            part if i % 2 == 0 else str(values[part]) if part in values else f"%{{{part}}}"
+            for i, part in enumerate(parts)
+        )
+
+
+def flatten(data: dict, prefix: str = "") -> dict:
+    """
+    :return: The nested translations as a dict with dotted keys
+    """
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            text = str(value)
+            flat[f"{prefix}{key}"] = Template(text) if PLACEHOLDER.search(text) else text
+    return flat
+
+
+def load(path: str = config.I18n.PATH) -> None:
+    """
+    Compiles all locale files, missing keys are filled in from the fallback locale
+    """
+    global _catalog, _localizations  # pylint: disable=global-statement
+    compiled = {}
+    for filename in listdir(path):
+        locale, _, extension = filename.rpartition(".")
+        if extension not in ("yml", "yaml") or locale not in config.I18n.AVAILABLE_LOCALES:
+            continue
+        with open(f"{path}/{filename}", "r", encoding="utf8") as locale_file:
+            compiled[locale] = flatten(yaml.safe_load(locale_file) or {})
+    fallback = compiled.get(config.I18n.FALLBACK, {})
+    for locale, translations in compiled.items():
+        compiled[locale] = {**fallback, **translations}
+    by_key = {}
+    for key in fallback:
+        by_key[key] = {
+            locale: str(translations[key].text if isinstance(translations[key], Template) else translations[key])
+            for locale, translations in compiled.items()
+        }
+    with _load_lock:
+        _catalog, _localizations = compiled, by_key
+
+
+def catalog() -> dict:
+    """
+    :return: The compiled translations per locale, loading them on first use
+    """
+    if _catalog is None:
+        load()
+    return _catalog
+
+
+def set_locale(locale: str) -> None:
+    """
+    Sets the locale of the current request, unknown locales fall back to the default
+    """
+    _locale.set(locale if locale in catalog() else config.I18n.FALLBACK)
+
+
+def get_locale() -> str:
+    """
+    :return: The locale of the current request
+    """
+    return _locale.get()
+
+
+def t(key: str, locale: str = None, **kwargs) -> str:
+    """
+    Translates a key
+
+    :param str key: Dotted key of the translation
+    :param str locale: Locale to use instead of the current request's one
+    :param kwargs: Values of the placeholders
+    :return: The translation, or the key itself if there is none
+    """
+    translations = catalog().get(locale or _locale.get())
+    if translations is None:
+        translations = _catalog[config.I18n.FALLBACK]
+    translation = translations.get(key, key)
+    if isinstance(translation, Template):
+        return translation.format(kwargs)
+    return translation
+
+
+def localizations(key: str) -> dict:
+    """
+    :return: The translations of a key in all available locales
+    """
+    catalog()
+    return dict(_localizations.get(key, {}))
@@ -1,16 +1,49 @@
 """
 Some utility functions
 """
+import threading
+from collections import deque
+
 from flask_discord_interactions import Context
-import i18n
 import logging
 
+import translations
+
 
 def get_localizations(key: str) -> dict:
     """
     Returns all localizations for a string
     """
-    localizations = {}
-    for locale in i18n.get("available_locales"):
-        localizations[locale] = i18n.t(key, locale=locale)
-    return localizations
+    return translations.localizations(key)
+
+
+class HandlerTimings:
+    """
+    Rolling window of the durations of every command and handler
+
+    :param int window: Number of recent durations kept per handler
+    :param float quantile: Quantile reported as the expected duration
+    """
+
+    def __init__(self, window: int = 50, quantile: float = 0.9):
+        self.window = window
+        self.quantile = quantile
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration: float) -> None:
+        """
+        Adds the duration of a finished run
+        """
+        with self._lock:
+            self._durations.setdefault(name, deque(maxlen=self.window)).append(duration)
+
+    def expected(self, name: str) -> float:
+        """
+        :return: The configured quantile of the recent durations, 0 if unknown
+        """
+        with self._lock:
+            durations = sorted(self._durations.get(name, ()))
+        if not durations:
+            return 0.0
+        return durations[min(int(len(durations) * self.quantile), len(durations) - 1)]
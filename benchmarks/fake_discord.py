@@ -0,0 +1,285 @@
+"""
+Local stand-in for the parts of Discord's API the bot calls
+
+Webhook posts, interaction followups and the OAuth token exchange are answered after
+an optional delay, with ``X-RateLimit`` headers of a bucket per route and webhook. Application
+commands are kept in memory and returned the way Discord does, with unset fields left out. ``GET /_stats``
+returns what has been received, including every starboard post per message so duplicate
+deliveries show up. Started by ``loadtest.py``, can be run on its own with
+``python3 benchmarks/fake_discord.py --port 9300``.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep, time
+
+WEBHOOK = re.compile(r"^/api/v\d+/webhooks/(\d+)/([^/?]+)(/messages/[^/?]+)?")
+COMMANDS = re.compile(r"^/api/v\d+/applications/(\d+)(?:/guilds/(\d+))?/commands(?:/(\d+))?(\?.*)?$")
+
+
+def bucket_hash(method: str, route: str) -> str:
+    """
+    :return: An opaque hash of a route the way Discord names its rate limit buckets
+    """
+    return hashlib.sha1(f"{method} {route}".encode()).hexdigest()[:16]
+
+
+class State:
+    """
+    Everything the fake has received, shared by the request threads
+
+    :param float latency: Seconds every request takes
+    :param int limit: Requests per bucket and webhook and window before answering with 429, 0 for no limit
+    :param float window: Seconds after which a bucket refills
+    :param str application_id: id of the bot, whose webhook receives the interaction followups
+    """
+
+    def __init__(self, latency: float, limit: int, window: float, application_id: str):
+        self.latency = latency
+        self.application_id = application_id
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.requests = {}
+        self.rate_limited = 0
+        self.posts = {}
+        self.commands = {}
+        self.ids = itertools.count(1000)
+
+    def take(self, bucket: str) -> tuple[int, float]:
+        """
+        Takes a request from a bucket
+
+        :return: The remaining requests and the seconds until the bucket resets, remaining is -1 if it was empty
+        """
+        with self.lock:
+            now = monotonic()
+            remaining, reset_at = self.buckets.get(bucket, (self.limit, now + self.window))
+            if reset_at <= now:
+                remaining, reset_at = self.limit, now + self.window
+            if remaining <= 0:
+                self.rate_limited += 1
+                return -1, reset_at - now
+            self.buckets[bucket] = (remaining - 1, reset_at)
+            return remaining - 1, reset_at - now
+
+    def record(self, kind: str, payload: dict = None) -> None:
+        """
+        Counts a request and keeps track of the starboard posts per message
+        """
+        with self.lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+            if kind == "webhook_post" and payload:
+                # the starboard post's footer is the starred message's id
+                footer = (payload.get("embeds") or [{}])[0].get("footer", {}).get("text")
+                self.posts[footer] = self.posts.get(footer, 0) + 1
+
+    def register(self, scope: tuple, payload: dict, command_id: str = None) -> dict:
+        """
+        Adds or edits a command of an application or guild like Discord does
+
+        :param tuple scope: Application id and guild id, None for global commands
+        :return: The command as Discord returns it
+        """
+        with self.lock:
+            commands = self.commands.setdefault(scope, {})
+            if command_id is None:
+                # creating a command with the name of an existing one overwrites it
+                key = (payload["name"], payload.get("type", 1))
+                command_id = next((c["id"] for c in commands.values() if (c["name"], c["type"]) == key), None)
+            current = commands.get(command_id, {"id": str(next(self.ids)), "type": 1})
+            command = stored({**current, **payload})
+            command.update(application_id=scope[0], version=str(next(self.ids)), default_permission=True, nsfw=False)
+            if scope[1]:
+                command["guild_id"] = scope[1]
+            commands[command["id"]] = command
+            return command
+
+    def stats(self) -> dict:
+        """
+        :return: A snapshot of the received requests
+        """
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "rate_limited": self.rate_limited,
+                "starboard_posts": len(self.posts),
+                "duplicate_posts": sum(count - 1 for count in self.posts.values() if count > 1),
+            }
+
+
+def stored(value):
+    """
+    :return: A command's payload as Discord stores it, without unset, empty or false option fields
+    """
+    if isinstance(value, dict):
+        return {
+            key: stored(item)
+            for key, item in value.items()
+            if item is not None and item != [] and not (key in ("required", "autocomplete") and item is False)
+        }
+    if isinstance(value, list):
+        return [stored(item) for item in value]
+    return value
+
+
+def without_localizations(command: dict) -> dict:
+    """
+    :return: A command as listed without ``with_localizations``
+    """
+    if isinstance(command, dict):
+        return {key: without_localizations(item) for key, item in command.items() if not key.endswith("_localizations")}
+    if isinstance(command, list):
+        return [without_localizations(item) for item in command]
+    return command
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers the API calls of the bot"""
+
+    protocol_version = "HTTP/1.1"
+    state: State = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def reply(self, status: int, body: dict = None, headers: dict = None) -> None:
+        """Sends a JSON response"""
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        """The request body as JSON, None if there is none"""
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Type", "").startswith("application/json") and body:
+            return json.loads(body)
+        return None
+
+    def handle_api(self, method: str) -> None:
+        """Dispatches an API call"""
+        payload = self.read_json()
+        if method == "GET" and self.path == "/_stats":
+            self.reply(200, self.state.stats())
+            return
+        if method == "POST" and self.path.endswith("/oauth2/token"):
+            self.state.record("oauth_token")
+            webhook = {"id": str(random.getrandbits(60)), "token": "fake", "guild_id": str(random.getrandbits(60))}
+            self.reply(200, {"access_token": "fake", "token_type": "Bearer", "expires_in": 604800, "webhook": webhook})
+            return
+        commands = COMMANDS.match(self.path)
+        if commands is not None:
+            self.handle_commands(method, commands, payload)
+            return
+        match = WEBHOOK.match(self.path)
+        if match is None:
+            self.reply(404, {"message": "404: Not Found", "code": 0})
+            return
+        if self.state.latency:
+            sleep(self.state.latency)
+        # like Discord the hash leaves out the major parameter, the webhook, which is counted separately
+        bucket = bucket_hash(method, "webhooks/{id}/{token}" + ("/messages/{id}" if match.group(3) else ""))
+        headers = {}
+        if self.state.limit:
+            remaining, reset_after = self.state.take(f"{bucket}:{match.group(1)}/{match.group(2)}")
+            headers = {
+                "X-RateLimit-Limit": str(self.state.limit),
+                "X-RateLimit-Remaining": str(max(remaining, 0)),
+                "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+                "X-RateLimit-Bucket": bucket,
+            }
+            if remaining < 0:
+                headers["Retry-After"] = f"{reset_after:.3f}"
+                self.reply(429, {"message": "You are being rate limited.", "retry_after": reset_after}, headers)
+                return
+        if match.group(3):
+            self.state.record(f"followup_{method.lower()}")
+            self.reply(204 if method == "DELETE" else 200, None if method == "DELETE" else {"id": "1"}, headers)
+            return
+        # followups of interactions go to the application's webhook, posts to the guilds' ones
+        self.state.record("followup_post" if match.group(1) == self.state.application_id else "webhook_post", payload)
+        self.reply(200, {"id": str(int(time() * 1000) << 22)}, headers)
+
+    def handle_commands(self, method: str, match: re.Match, payload) -> None:
+        """Answers the application commands endpoints"""
+        self.state.record(f"commands_{method.lower()}")
+        scope, command_id = (match.group(1), match.group(2)), match.group(3)
+        commands = self.state.commands.setdefault(scope, {})
+        if method == "GET" and command_id is None:
+            listed = list(commands.values())
+            if "with_localizations=true" not in (match.group(4) or ""):
+                listed = [without_localizations(command) for command in listed]
+            self.reply(200, listed)
+        elif method == "PUT" and command_id is None:
+            commands.clear()
+            self.reply(200, [self.state.register(scope, command) for command in payload])
+        elif method == "POST" and command_id is None:
+            self.reply(201, self.state.register(scope, payload))
+        elif command_id not in commands:
+            self.reply(404, {"message": "Unknown application command", "code": 10063})
+        elif method == "GET":
+            self.reply(200, commands[command_id])
+        elif method == "PATCH":
+            self.reply(200, self.state.register(scope, payload, command_id))
+        elif method == "DELETE":
+            del commands[command_id]
+            self.reply(204)
+        else:
+            self.reply(405, {"message": "405: Method Not Allowed", "code": 0})
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handles GET requests"""
+        self.handle_api("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Handles POST requests"""
+        self.handle_api("POST")
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        """Handles PUT requests"""
+        self.handle_api("PUT")
+
+    def do_PATCH(self):  # pylint: disable=invalid-name
+        """Handles PATCH requests"""
+        self.handle_api("PATCH")
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        """Handles DELETE requests"""
+        self.handle_api("DELETE")
+
+
+def serve(port: int, latency: float = 0.0, limit: int = 0, window: float = 1.0, application_id: str = "1") -> None:
+    """Runs the fake until it is killed"""
+    Handler.state = State(latency, limit, window, application_id)
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def main() -> None:
+    """Runs the fake with the options of the command line"""
+    parser = argparse.ArgumentParser(description="Fake Discord API")
+    parser.add_argument("--port", type=int, default=9300)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every request takes")
+    parser.add_argument("--limit", type=int, default=0, help="requests per route, webhook and window, 0 for no limit")
+    parser.add_argument("--window", type=float, default=1.0, help="seconds until a bucket refills")
+    parser.add_argument("--application-id", default="1", help="id of the bot receiving the followups")
+    args = parser.parse_args()
+    serve(args.port, args.latency, args.limit, args.window, args.application_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Latency of the guide autocomplete search for growing numbers of pages
+
+Run with ``python3 benchmarks/guide_search.py`` from the repository root.
+"""
+import random
+import string
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from search import SearchIndex  # pylint: disable=wrong-import-position
+
+PAGE_COUNTS = (10, 100, 1000, 5000)
+QUERIES = 2000
+
+
+def word(rng: random.Random) -> str:
+    """A random lowercase word"""
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9)))
+
+
+def pages(count: int, rng: random.Random) -> list:
+    """Synthetic pages with a few title words and a paragraph of body text"""
+    vocabulary = [word(rng) for _ in range(2000)]
+    return [
+        (
+            i,
+            "_".join(rng.choices(vocabulary, k=rng.randint(1, 4))),
+            " ".join(rng.choices(vocabulary, k=rng.randint(50, 200))),
+        )
+        for i in range(count)
+    ]
+
+
+def main() -> None:
+    """Prints build time and per query latency for every page count"""
+    rng = random.Random(0)
+    print(f"{'pages':>6} {'build ms':>10} {'p50 us':>8} {'p99 us':>8}")
+    for count in PAGE_COUNTS:
+        documents = pages(count, rng)
+        started = perf_counter()
+        index = SearchIndex(documents)
+        build = perf_counter() - started
+        titles = [title.replace("_", " ") for _, title, _ in documents]
+        # prefixes of real titles with the occasional typo, like users type them
+        queries = []
+        for _ in range(QUERIES):
+            title = rng.choice(titles)
+            query = title[: rng.randint(1, len(title))]
+            if len(query) > 3 and rng.random() < 0.3:
+                position = rng.randrange(len(query))
+                query = query[:position] + rng.choice(string.ascii_lowercase) + query[position + 1 :]
+            queries.append(query)
+        latencies = []
+        for query in queries:
+            started = perf_counter()
+            index.search(query)
+            latencies.append(perf_counter() - started)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1e6
+        p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+        print(f"{count:>6} {build * 1000:>10.1f} {p50:>8.1f} {p99:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,546 @@
+"""
+End-to-end load test of the interaction endpoint
+
+Starts the fake Discord from ``fake_discord.py``, a database and the bot in the chosen
+serving mode, then runs every scenario with signed interactions:
+
+* ``star``: the star context menu command on fresh messages
+* ``storm``: star button clicks of different users on a few hot messages
+* ``settings``: changes of the ``/settings`` of a guild
+* ``autocomplete``: ``/manual`` topic autocompletion
+* ``retry``: star button clicks that are all sent twice, like retries after a timeout
+
+Throughput and p50/p95/p99 latency are reported per scenario and saved as JSON, pass an
+earlier result with ``--compare`` to check for regressions. The most database statements
+a handler ran for one interaction are read from the bot's log, the test fails if one ran
+more than its budget in ``tracing.QUERY_BUDGETS``. Run from the repository root::
+
+    python3 benchmarks/loadtest.py --mode async --database embedded
+    python3 benchmarks/loadtest.py --mode sync --compare benchmarks/results/<earlier run>.json
+
+``--database embedded`` starts a throwaway MariaDB, which needs ``mariadbd`` and
+``mariadb-install-db`` in the PATH. ``--database external`` uses the database of the
+``MYSQL_*`` environment variables and leaves its benchmark rows behind. ``--database sqlite``
+runs the bot on the embedded SQLite backend instead.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from time import monotonic, perf_counter, sleep, time
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from nacl.signing import SigningKey
+from serving import Connection
+
+ROOT = Path(__file__).resolve().parent.parent
+APP = ROOT / "app"
+RESULTS = ROOT / "benchmarks" / "results"
+
+APPLICATION_ID = "900000000000000001"
+GUILD_ID = "800000000000000001"
+SETTINGS_GUILD_ID = "800000000000000002"
+CHANNEL_ID = "810000000000000001"
+WEBHOOK_ID = "700000000000000001"
+# writes the hot messages, so the storm also counts stars in the statistics
+AUTHOR_ID = "600000000000000001"
+SCENARIOS = ("star", "storm", "settings", "autocomplete", "retry")
+HOT_MESSAGES = 50
+QUERY_SUMMARY = re.compile(r"Interaction \S+ \((.+)\) ran (\d+) queries")
+AUTOCOMPLETE_QUERIES = ("", "i", "in", "intr", "set", "setting", "setup", "thing", "star", "sett up", "xyz")
+
+
+def free_port() -> int:
+    """A port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30) -> None:
+    """Waits until a started process accepts connections"""
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[0]} exited with {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            sleep(0.1)
+    raise RuntimeError(f"{process.args[0]} didn't listen on port {port} in time")
+
+
+def snowflake(timestamp: float) -> int:
+    """Pseudo id from a message sent at a unix timestamp"""
+    return int(timestamp * 1000.0 - 1420070400000) << 22
+
+
+class EmbeddedDatabase:
+    """
+    A throwaway MariaDB server in a temporary directory
+
+    :param str directory: Where the data and the log are kept
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.port = free_port()
+        self.process = None
+
+    def start(self) -> dict:
+        """
+        Initializes and starts the server
+
+        :return: The environment variables to connect to it
+        """
+        install = shutil.which("mariadb-install-db") or shutil.which("mysql_install_db")
+        server = shutil.which("mariadbd") or shutil.which("mysqld")
+        if install is None or server is None:
+            raise RuntimeError("The embedded database needs mariadbd and mariadb-install-db in the PATH")
+        data = self.directory / "data"
+        subprocess.run(
+            [install, "--no-defaults", f"--datadir={data}", "--auth-root-authentication-method=normal"],
+            check=True,
+            capture_output=True,
+        )
+        with open(self.directory / "mariadb.log", "wb") as log:
+            # runs until stop() is called
+            self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+                [
+                    server,
+                    "--no-defaults",
+                    f"--datadir={data}",
+                    f"--port={self.port}",
+                    "--bind-address=127.0.0.1",
+                    f"--socket={self.directory / 'mariadb.sock'}",
+                    "--skip-grant-tables",
+                ],
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        wait_for_port(self.port, self.process)
+        return {
+            "MYSQL_HOST": "127.0.0.1",
+            "MYSQL_PORT": str(self.port),
+            "MYSQL_USER": "root",
+            "MYSQL_PASSWORD": "",
+            "MYSQL_DATABASE": "starboard",
+        }
+
+    def stop(self) -> None:
+        """Stops the server"""
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(30)
+
+
+def prepare_database(env: dict, storm_threshold: int) -> list[str]:
+    """
+    Creates the schema and the guilds and hot messages of the scenarios
+
+    :return: Ids of the hot messages of the storm
+    """
+    os.environ.update(env)
+    sys.path.insert(0, str(APP))
+    # pylint: disable=import-outside-toplevel
+    if env.get("STORAGE_BACKEND") != "sqlite":
+        import mysql.connector
+
+        server = mysql.connector.connect(
+            host=env["MYSQL_HOST"], port=int(env["MYSQL_PORT"]), user=env["MYSQL_USER"], passwd=env["MYSQL_PASSWORD"]
+        )
+        server.cursor().execute(f"CREATE DATABASE IF NOT EXISTS {env['MYSQL_DATABASE']}")
+        server.close()
+
+    import migrations
+    from resources import guilds, messages
+
+    migrations.migrate()
+    for guild_id in (GUILD_ID, SETTINGS_GUILD_ID):
+        guilds.upsert_webhook(guild_id, WEBHOOK_ID, f"starboard{guild_id}")
+    guilds.update(guilds.get(GUILD_ID), required_stars=storm_threshold)
+    hot_messages = []
+    for _ in range(HOT_MESSAGES):
+        message_id = str(snowflake(time() - random.uniform(0, 3600)))
+        messages.insert(
+            messages.Message(id=message_id, guild_id=GUILD_ID, author_id=AUTHOR_ID, channel_id=CHANNEL_ID)
+        )
+        hot_messages.append(message_id)
+    return hot_messages
+
+
+class Traffic:
+    """
+    Builds the interactions of the scenarios
+
+    :param list hot_messages: Ids of the messages clicked during the storm
+    :param int storm_size: Clicks per hot message
+    """
+
+    def __init__(self, hot_messages: list, storm_size: int):
+        self.hot_messages = hot_messages
+        self.storm_size = storm_size
+        self.counter = itertools.count(1)
+        self.clicks = itertools.count()
+        self.retried = None
+
+    def user(self) -> dict:
+        """A user that hasn't interacted before"""
+        return {
+            "id": str(100000000000000000 + next(self.counter)),
+            "username": "loadtest",
+            "discriminator": "0001",
+            "avatar": None,
+        }
+
+    def base(self, guild_id: str = GUILD_ID) -> dict:
+        """The fields every interaction has"""
+        interaction_id = next(self.counter)
+        return {
+            "id": str(snowflake(time()) + interaction_id),
+            "application_id": APPLICATION_ID,
+            "token": f"token{interaction_id}",
+            "version": 1,
+            "locale": random.choice(("en-US", "de")),
+            "guild_locale": "en-US",
+            "guild_id": guild_id,
+            "channel_id": CHANNEL_ID,
+            "member": {"user": self.user(), "roles": [], "permissions": "32"},
+        }
+
+    def star(self) -> dict:
+        """The star context menu command on a fresh message"""
+        interaction = self.base()
+        message_id = str(snowflake(time()) + next(self.counter))
+        interaction["type"] = 2
+        interaction["data"] = {
+            "id": "1",
+            "name": "Star message",
+            "type": 3,
+            "target_id": message_id,
+            "resolved": {
+                "messages": {
+                    message_id: {
+                        "id": message_id,
+                        "channel_id": CHANNEL_ID,
+                        "author": self.user(),
+                        "content": "A message worth a star " * random.randint(1, 20),
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "embeds": [],
+                        "attachments": [],
+                    }
+                }
+            },
+        }
+        return interaction
+
+    def storm(self) -> dict:
+        """A click on the star button of the current hot message"""
+        interaction = self.base()
+        message_id = self.hot_messages[(next(self.clicks) // self.storm_size) % len(self.hot_messages)]
+        interaction["type"] = 3
+        interaction["data"] = {"custom_id": f"star\n{message_id}\n1", "component_type": 2}
+        interaction["message"] = {
+            "id": str(snowflake(time())),
+            "channel_id": CHANNEL_ID,
+            "author": {"id": APPLICATION_ID, "username": "Starboard", "discriminator": "0000", "avatar": None},
+            "content": "Starred by loadtest",
+            "embeds": [
+                {
+                    "type": "rich",
+                    "author": {"name": "someone#0001"},
+                    "description": "A message worth a star",
+                    "footer": {"text": "Star it"},
+                    "color": 3092790,
+                }
+            ],
+            "components": [],
+        }
+        return interaction
+
+    def retry(self) -> dict:
+        """A star button click, every other one repeats the click before"""
+        if self.retried is not None:
+            interaction, self.retried = self.retried, None
+            return interaction
+        self.retried = self.storm()
+        return self.retried
+
+    def settings(self) -> dict:
+        """A change of the settings of the settings guild"""
+        interaction = self.base(SETTINGS_GUILD_ID)
+        interaction["type"] = 2
+        options = [
+            {"name": "stars", "type": 4, "value": random.randint(2, 10)},
+            {"name": "allow_self_stars", "type": 5, "value": random.random() < 0.5},
+            {"name": "delete_message", "type": 5, "value": random.random() < 0.5},
+        ]
+        interaction["data"] = {"id": "2", "name": "settings", "type": 1, "options": random.sample(options, 2)}
+        return interaction
+
+    def autocomplete(self) -> dict:
+        """An autocompletion of the manual's topic"""
+        interaction = self.base()
+        interaction["type"] = 4
+        locale = random.choice(("en-US", "de"))
+        interaction["data"] = {
+            "id": "3",
+            "name": "manual",
+            "type": 1,
+            "options": [
+                {"name": "language", "type": 3, "value": locale},
+                {"name": "topic", "type": 3, "value": random.choice(AUTOCOMPLETE_QUERIES), "focused": True},
+            ],
+        }
+        return interaction
+
+
+def summarize(latencies: list, statuses: dict, deferred: int, elapsed: float) -> dict:
+    """
+    :return: Throughput and latency quantiles of a scenario
+    """
+    latencies = sorted(latencies)
+
+    def quantile(q: float) -> float:
+        return round(latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000, 2) if latencies else None
+
+    return {
+        "requests": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": quantile(0.5),
+        "p95_ms": quantile(0.95),
+        "p99_ms": quantile(0.99),
+        "errors": sum(count for status, count in statuses.items() if status != 200),
+        "deferred": deferred,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def run_scenario(build, url, signing_key: SigningKey, concurrency: int, duration: float) -> dict:
+    """
+    Sends interactions of one scenario from concurrent connections
+
+    :param build: Returns the next interaction
+    :return: The scenario's summary
+    """
+    latencies, statuses = [], {}
+    deferred = 0
+
+    async def worker(deadline: float) -> None:
+        nonlocal deferred
+        connection = Connection(url)
+        try:
+            while perf_counter() < deadline:
+                body = json.dumps(build()).encode()
+                timestamp = str(int(time()))
+                headers = {
+                    "X-Signature-Timestamp": timestamp,
+                    "X-Signature-Ed25519": signing_key.sign(timestamp.encode() + body).signature.hex(),
+                }
+                started = perf_counter()
+                status, response = await connection.post(body, headers)
+                latencies.append(perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+                # deferred channel message or deferred update
+                if status == 200 and json.loads(response)["type"] in (5, 6):
+                    deferred += 1
+        finally:
+            connection.close()
+
+    started = perf_counter()
+    await asyncio.gather(*(worker(started + duration) for _ in range(concurrency)))
+    return summarize(latencies, statuses, deferred, perf_counter() - started)
+
+
+def start_bot(mode: str, workers: int, port: int, env: dict, log) -> subprocess.Popen:
+    """Starts the bot with gunicorn in the given serving mode"""
+    command = [sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}", "-w", str(workers), "--preload"]
+    if mode == "async":
+        command += ["-k", "uvicorn.workers.UvicornWorker", "asgi:create_app()"]
+    else:
+        command += ["bot:create_app()"]
+    return subprocess.Popen(command, cwd=APP, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    """
+    Prints the changes against an earlier run
+
+    :return: False if a scenario got slower or handled less than allowed
+    """
+    ok = True
+    print(f"\ncompared to {baseline['meta']['started']} ({baseline['meta']['mode']})")
+    for name, current in results["handlers"].items():
+        before = baseline["handlers"].get(name)
+        if not before or not before["requests"] or not current["requests"]:
+            continue
+        throughput = current["throughput"] / before["throughput"] - 1
+        p95 = current["p95_ms"] / before["p95_ms"] - 1
+        regressed = throughput < -max_regression or p95 > max_regression
+        ok = ok and not regressed
+        print(f"{name:>12} throughput {throughput:+7.1%} p95 {p95:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def most_queries(log: Path) -> dict:
+    """
+    :return: The most statements any interaction of a handler ran, by handler
+    """
+    queries = {}
+    for line in log.read_text(errors="replace").splitlines():
+        match = QUERY_SUMMARY.search(line)
+        if match:
+            queries[match.group(1)] = max(queries.get(match.group(1), 0), int(match.group(2)))
+    return queries
+
+
+def check_query_budgets(queries: dict) -> bool:
+    """
+    Prints the handlers that ran more statements than their budget
+
+    :return: False if a handler exceeded its budget
+    """
+    # the budgets are the app's, prepare_database() put it on the path
+    from tracing import QUERY_BUDGETS  # pylint: disable=import-outside-toplevel
+
+    ok = True
+    for handler, budget in QUERY_BUDGETS.items():
+        if queries.get(handler, 0) > budget:
+            ok = False
+            print(f"{handler} ran {queries[handler]} queries in one interaction, the budget is {budget}")
+    return ok
+
+
+def main() -> int:  # pylint: disable=too-many-locals,too-many-statements
+    """Runs the load test"""
+    parser = argparse.ArgumentParser(description="End-to-end load test of the interaction endpoint")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync", help="serving mode of the bot")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--database", choices=("embedded", "external", "sqlite"), default="embedded")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=32, help="interactions in flight at once")
+    parser.add_argument("--duration", type=float, default=15, help="seconds every scenario runs")
+    parser.add_argument("--storm-threshold", type=int, default=10, help="stars that send a hot message")
+    parser.add_argument("--storm-size", type=int, default=200, help="clicks per hot message")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="seconds every Discord call takes")
+    parser.add_argument("--discord-limit", type=int, default=5, help="requests per webhook and second")
+    parser.add_argument("--output", type=Path, help="where to save the results")
+    parser.add_argument("--compare", type=Path, help="earlier results to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="tolerated relative slowdown")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="starboard-loadtest-")
+    processes = []
+    database = EmbeddedDatabase(directory) if args.database == "embedded" else None
+    signing_key = SigningKey.generate()
+    try:
+        discord_port = free_port()
+        discord = subprocess.Popen(  # pylint: disable=consider-using-with
+            [
+                sys.executable,
+                str(Path(__file__).with_name("fake_discord.py")),
+                f"--port={discord_port}",
+                f"--latency={args.discord_latency}",
+                f"--limit={args.discord_limit}",
+                f"--application-id={APPLICATION_ID}",
+            ]
+        )
+        processes.append(discord)
+        wait_for_port(discord_port, discord)
+
+        if database is not None:
+            env = database.start()
+        elif args.database == "sqlite":
+            env = {"STORAGE_BACKEND": "sqlite", "SQLITE_PATH": str(Path(directory) / "starboard.db")}
+        else:
+            env = {name: os.environ.get(name, "") for name in ("MYSQL_HOST", "MYSQL_USER", "MYSQL_PASSWORD")}
+            env["MYSQL_PORT"] = os.environ.get("MYSQL_PORT", "3306")
+            env["MYSQL_DATABASE"] = os.environ.get("MYSQL_DATABASE", "starboard")
+        hot_messages = prepare_database(env, args.storm_threshold)
+
+        bot_port = free_port()
+        env.update(
+            {
+                "DISCORD_API_URL": f"http://127.0.0.1:{discord_port}/api/v10",
+                "DISCORD_CLIENT_ID": APPLICATION_ID,
+                "DISCORD_PUBLIC_KEY": signing_key.verify_key.encode().hex(),
+                "OUTBOX_POLL_INTERVAL": "0.5",
+                "RETENTION_INTERVAL": "0",
+                "DB_TRACE_SUMMARY": "true",
+            }
+        )
+        with open(Path(directory) / "bot.log", "wb") as log:
+            bot = start_bot(args.mode, args.workers, bot_port, env, log)
+        processes.append(bot)
+        wait_for_port(bot_port, bot)
+
+        traffic = Traffic(hot_messages, args.storm_size)
+        url = urlsplit(f"http://127.0.0.1:{bot_port}/interactions")
+        results = {
+            "meta": {
+                "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "commit": subprocess.run(
+                    ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=False
+                ).stdout.strip(),
+                "mode": args.mode,
+                "workers": args.workers,
+                "database": args.database,
+                "concurrency": args.concurrency,
+                "duration": args.duration,
+            },
+            "handlers": {},
+        }
+        print(f"{'scenario':>12} {'requests':>9} {'per s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for name in args.scenarios:
+            summary = asyncio.run(
+                run_scenario(getattr(traffic, name), url, signing_key, args.concurrency, args.duration)
+            )
+            results["handlers"][name] = summary
+            print(
+                f"{name:>12} {summary['requests']:>9} {summary['throughput']:>8.1f} {summary['p50_ms']:>8} "
+                f"{summary['p95_ms']:>8} {summary['p99_ms']:>8} {summary['errors']:>7}"
+            )
+        # give the outbox a moment to deliver the last starboard posts
+        sleep(2)
+        with urlopen(f"http://127.0.0.1:{discord_port}/_stats") as response:
+            results["discord"] = json.load(response)
+        print(f"discord: {results['discord']}")
+        results["queries"] = most_queries(Path(directory) / "bot.log")
+        print(f"most queries per interaction: {results['queries']}")
+
+        output = args.output or RESULTS / f"{args.mode}-{results['meta']['started'].replace(':', '')}.json"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        print(f"saved to {output}")
+        ok = check_query_budgets(results["queries"])
+        if args.compare and not compare(results, json.loads(args.compare.read_text()), args.max_regression):
+            ok = False
+        return 0 if ok else 1
+    except Exception:
+        for log in Path(directory).glob("*.log"):
+            print(f"--- last lines of {log.name}", file=sys.stderr)
+            print(b"\n".join(log.read_bytes().splitlines()[-20:]).decode(errors="replace"), file=sys.stderr)
+        raise
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(30)
+        if database is not None:
+            database.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Time and allocations of building a star button response with the library's models and as plain dicts
+
+Run with ``python3 benchmarks/serialization.py`` from the repository root.
+"""
+import json
+import sys
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+APP = Path(__file__).resolve().parent.parent / "app"
+sys.path.insert(0, str(APP))
+
+# pylint: disable=wrong-import-position
+import responses
+import translations
+from flask_discord_interactions.models.component import ActionRow, Button
+from flask_discord_interactions.models.embed import Author, Embed, Footer, Media
+from flask_discord_interactions.models.message import Message
+
+ROUNDS = 5000
+URL = "https://discord.com/channels/1/2/3"
+RECEIVED_EMBEDS = [
+    {
+        "type": "rich",
+        "author": {"name": "someone#0001", "icon_url": "https://cdn.discordapp.com/avatars/1/a.png"},
+        "description": "A message that was worth a star " * 8,
+        "footer": {"text": "Star it"},
+        "color": 0xFCD63F,
+        "image": {"url": "https://cdn.discordapp.com/attachments/1/2/image.png", "width": 640, "height": 480},
+    },
+    {"type": "link", "title": "A link", "url": "https://example.com", "description": "Embedded link " * 4},
+]
+
+
+def with_models() -> bytes:
+    """The response as built before, through the models and a parse of the encoded webhook payload"""
+    embeds = [
+        Embed(
+            author=Author(**RECEIVED_EMBEDS[0]["author"]),
+            description=RECEIVED_EMBEDS[0]["description"],
+            footer=Footer("Star it"),
+            color=RECEIVED_EMBEDS[0]["color"],
+            image=Media(url=RECEIVED_EMBEDS[0]["image"]["url"]),
+        ),
+        Embed(**{key: RECEIVED_EMBEDS[1][key] for key in ("title", "url", "description")}),
+    ]
+    post = json.loads(
+        Message(
+            embeds=embeds,
+            components=[ActionRow(components=[Button(label="Jump", style=5, url=URL)])],
+        ).encode(followup=True)[0]
+    )
+    json.dumps(post)
+    return Message(
+        "Starred by someone",
+        embeds=embeds,
+        components=[
+            ActionRow(
+                components=[
+                    Button(label="3", emoji={"name": "⭐", "id": None}, custom_id=["star", "3", 3], style=2),
+                    Button(label="Jump", style=5, url=URL),
+                ]
+            )
+        ],
+        update=True,
+    ).encode()[0]
+
+
+def with_dicts() -> bytes:
+    """The response as built now, straight from the received embeds"""
+    post = responses.starboard_post(RECEIVED_EMBEDS, "3", URL, "2024-01-01T00:00:00", "en-US")
+    json.dumps(post)
+    return responses.star_update(
+        "Starred by someone",
+        responses.with_footer(RECEIVED_EMBEDS, "Star it"),
+        responses.star_components("3", 3, URL),
+    ).encode()[0]
+
+
+def measure(build) -> tuple[float, int]:
+    """
+    :return: Microseconds per response and peak bytes allocated while building one
+    """
+    build()
+    started = perf_counter()
+    for _ in range(ROUNDS):
+        build()
+    elapsed = (perf_counter() - started) / ROUNDS
+    tracemalloc.start()
+    build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed * 1e6, peak
+
+
+def main() -> None:
+    """Prints the cost of both ways to build the response"""
+    translations.load(str(APP / "locales"))
+    print(f"{'variant':>8} {'us':>8} {'peak bytes':>11}")
+    for name, build in (("models", with_models), ("dicts", with_dicts)):
+        elapsed, peak = measure(build)
+        print(f"{name:>8} {elapsed:>8.1f} {peak:>11}")
+
+
+if __name__ == "__main__":
+    main()
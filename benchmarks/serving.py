@@ -0,0 +1,170 @@
+"""
+Throughput and latency of the interaction endpoint at a fixed number of concurrent interactions
+
+Start the blocking and the async mode against the same database, then point the benchmark at each::
+
+    gunicorn "bot:create_app()" --preload -b 0.0.0.0:9200 -w 4
+    gunicorn "asgi:create_app()" --preload -k uvicorn.workers.UvicornWorker -b 0.0.0.0:9201 -w 4
+
+    python3 benchmarks/serving.py --url http://localhost:9200/interactions --guild-id 123
+    python3 benchmarks/serving.py --url http://localhost:9201/interactions --guild-id 123
+
+Requests are signed with ``--private-key`` if given, the servers need the matching
+``DISCORD_PUBLIC_KEY``. Without it they have to run with signature validation disabled.
+"""
+import argparse
+import asyncio
+import json
+import random
+from time import perf_counter, time
+from urllib.parse import urlsplit
+
+try:
+    from nacl.signing import SigningKey
+except ImportError:
+    SigningKey = None
+
+USER = {"id": "100000000000000001", "username": "benchmark", "discriminator": "0001", "avatar": None}
+
+
+def interaction(kind: str, guild_id: str) -> dict:
+    """A synthetic interaction of the given kind"""
+    data = {
+        "id": str(random.getrandbits(63)),
+        "application_id": "1",
+        "token": "benchmark",
+        "version": 1,
+        "locale": "en-US",
+        "guild_locale": "en-US",
+        "guild_id": guild_id,
+        "channel_id": "2",
+        "member": {"user": USER, "roles": [], "permissions": "32"},
+    }
+    if kind == "ping":
+        data["type"] = 1
+    elif kind == "settings":
+        data["type"] = 2
+        data["data"] = {"id": "3", "name": "settings", "type": 1, "options": []}
+    else:
+        data["type"] = 2
+        data["data"] = {
+            "id": "3",
+            "name": "manual",
+            "type": 1,
+            "options": [
+                {"name": "language", "type": 3, "value": "en-US"},
+                {"name": "topic", "type": 3, "value": "intro"},
+            ],
+        }
+    return data
+
+
+class Connection:
+    """
+    A kept alive HTTP/1.1 connection that reconnects once the server closed it
+
+    :param url: Split url of the endpoint
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.reader = None
+        self.writer = None
+
+    async def post(self, body: bytes, headers: dict) -> tuple[int, bytes]:
+        """
+        Posts a JSON body, retrying once on a connection the server closed while it was idle
+
+        :return: Status and body of the response
+        """
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.url.hostname, self.url.port or 80)
+            head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+            self.writer.write(
+                f"POST {self.url.path} HTTP/1.1\r\nHost: {self.url.netloc}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n{head}\r\n".encode()
+                + body
+            )
+            try:
+                await self.writer.drain()
+                status_line = await self.reader.readline()
+            except ConnectionError:
+                status_line = b""
+            if status_line:
+                break
+            self.close()
+            if attempt:
+                raise ConnectionError("The server closed the connection")
+        length, keep_alive = 0, True
+        while (line := await self.reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode().partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+            elif name.lower() == "connection":
+                keep_alive = value.strip().lower() != "close"
+        response = await self.reader.readexactly(length)
+        if not keep_alive:
+            self.close()
+        return int(status_line.split()[1]), response
+
+    def close(self) -> None:
+        """Closes the connection"""
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def worker(args, url, signing_key, deadline: float, *, latencies: list, statuses: dict) -> None:
+    """Sends interactions one after another until the deadline"""
+    connection = Connection(url)
+    try:
+        while perf_counter() < deadline:
+            body = json.dumps(interaction(args.interaction, args.guild_id)).encode()
+            headers = {}
+            if signing_key is not None:
+                timestamp = str(int(time()))
+                headers["X-Signature-Timestamp"] = timestamp
+                headers["X-Signature-Ed25519"] = signing_key.sign(timestamp.encode() + body).signature.hex()
+            started = perf_counter()
+            status, _ = await connection.post(body, headers)
+            latencies.append(perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        connection.close()
+
+
+async def main() -> None:
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description="Benchmark the interaction endpoint")
+    parser.add_argument("--url", default="http://localhost:9200/interactions")
+    parser.add_argument("--interaction", choices=("ping", "manual", "settings"), default="settings")
+    parser.add_argument("--guild-id", default="1", help="registered guild the settings are read from")
+    parser.add_argument("--concurrency", type=int, default=200, help="interactions in flight at once")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to send interactions for")
+    parser.add_argument("--private-key", help="hex encoded ed25519 key to sign the interactions with")
+    args = parser.parse_args()
+    signing_key = None
+    if args.private_key:
+        if SigningKey is None:
+            parser.error("signing requires PyNaCl")
+        signing_key = SigningKey(bytes.fromhex(args.private_key))
+    url = urlsplit(args.url)
+    latencies, statuses = [], {}
+    started = perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(
+        *(
+            worker(args, url, signing_key, deadline, latencies=latencies, statuses=statuses)
+            for _ in range(args.concurrency)
+        )
+    )
+    elapsed = perf_counter() - started
+    latencies.sort()
+    print(f"{len(latencies)} interactions in {elapsed:.1f}s, {len(latencies) / elapsed:.0f}/s, statuses {statuses}")
+    for quantile in (0.5, 0.9, 0.99):
+        print(f"p{int(quantile * 100)}: {latencies[int(len(latencies) * quantile)] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,218 @@
+"""
+Startup time of a worker, from importing the bot to answering its first interactions
+
+Every round starts a fresh interpreter that imports the serving mode's module, runs its
+``create_app()`` and answers a ``/manual`` autocompletion twice, each step is timed on its
+own. Importing has to stay free of side effects, a round fails if it configured logging.
+Run from the repository root::
+
+    python3 benchmarks/startup.py --mode sync
+    python3 benchmarks/startup.py --mode async --compare benchmarks/results/<earlier run>.json
+
+With ``gunicorn --preload`` the import and ``create_app()`` run once in the master process,
+so a forked worker only pays for its first request. The bot runs on a throwaway SQLite file.
+"""
+# standalone on purpose, the probe's interpreter must not import anything the bot could share
+# pylint: disable=duplicate-code
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter, time
+
+ROOT = Path(__file__).resolve().parent.parent
+APP = ROOT / "app"
+RESULTS = ROOT / "benchmarks" / "results"
+STEPS = ("import", "create_app", "first_request", "second_request")
+AUTOCOMPLETE = {
+    "type": 4,
+    "id": "1",
+    "application_id": "900000000000000001",
+    "token": "token",
+    "version": 1,
+    "locale": "en-US",
+    "guild_id": "800000000000000001",
+    "channel_id": "810000000000000001",
+    "member": {"user": {"id": "1", "username": "startup", "discriminator": "0001", "avatar": None}, "roles": []},
+    "data": {
+        "id": "3",
+        "name": "manual",
+        "type": 1,
+        "options": [
+            {"name": "language", "type": 3, "value": "en-US"},
+            {"name": "topic", "type": 3, "value": "sett", "focused": True},
+        ],
+    },
+}
+
+
+def signed(signing_key) -> tuple[bytes, dict]:
+    """
+    :return: The body and signature headers of the autocompletion
+    """
+    body = json.dumps(AUTOCOMPLETE).encode()
+    timestamp = str(int(time()))
+    signature = signing_key.sign(timestamp.encode() + body).signature.hex()
+    return body, {"X-Signature-Timestamp": timestamp, "X-Signature-Ed25519": signature}
+
+
+def request_sync(app, signing_key) -> None:
+    """Sends the autocompletion to the Flask application"""
+    body, headers = signed(signing_key)
+    response = app.test_client().post("/interactions", data=body, headers=headers, content_type="application/json")
+    assert response.status_code == 200, response.status_code
+
+
+def request_async(app, signing_key) -> None:
+    """Sends the autocompletion to the ASGI application"""
+    body, headers = signed(signing_key)
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/interactions",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(event):
+        sent.append(event)
+
+    asyncio.run(app(scope, receive, send))
+    assert sent[0]["status"] == 200, sent[0]["status"]
+
+
+def probe(mode: str) -> dict:
+    """
+    Times the startup steps in the current interpreter, which must not have imported the bot yet
+
+    :return: Milliseconds per step
+    """
+    # pylint: disable=import-outside-toplevel
+    from nacl.signing import SigningKey
+
+    signing_key = SigningKey.generate()
+    os.environ["DISCORD_PUBLIC_KEY"] = signing_key.verify_key.encode().hex()
+    sys.path.insert(0, str(APP))
+    handlers = list(logging.getLogger().handlers)
+    timings = {}
+    started = perf_counter()
+    if mode == "async":
+        import asgi as module
+    else:
+        import bot as module
+    timings["import"] = perf_counter() - started
+    assert logging.getLogger().handlers == handlers, "importing the bot configured logging"
+    started = perf_counter()
+    app = module.create_app()
+    timings["create_app"] = perf_counter() - started
+    request = request_async if mode == "async" else request_sync
+    for step in ("first_request", "second_request"):
+        started = perf_counter()
+        request(app, signing_key)
+        timings[step] = perf_counter() - started
+    return {step: round(seconds * 1000, 2) for step, seconds in timings.items()}
+
+
+def run_round(mode: str, directory: str) -> dict:
+    """
+    Runs a probe in a fresh interpreter
+
+    :return: Milliseconds per step
+    """
+    env = {
+        **os.environ,
+        "STORAGE_BACKEND": "sqlite",
+        "SQLITE_PATH": str(Path(directory) / "starboard.db"),
+        "RETENTION_INTERVAL": "0",
+        "DATABASE_MIGRATE": "false",
+    }
+    result = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), "--probe", "--mode", mode],
+        cwd=APP,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"the probe failed:\n{result.stderr}")
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    """
+    Prints the changes against an earlier run
+
+    :return: False if a step got slower than allowed
+    """
+    ok = True
+    print(f"\ncompared to {baseline['meta']['started']} ({baseline['meta']['mode']})")
+    for step in STEPS:
+        change = results["steps"][step]["median_ms"] / baseline["steps"][step]["median_ms"] - 1
+        regressed = change > max_regression
+        ok = ok and not regressed
+        print(f"{step:>15} median {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main() -> int:
+    """Runs the startup benchmark"""
+    parser = argparse.ArgumentParser(description="Startup time of a worker")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync", help="serving mode of the bot")
+    parser.add_argument("--rounds", type=int, default=5, help="fresh interpreters to time")
+    parser.add_argument("--output", type=Path, help="where to save the results")
+    parser.add_argument("--compare", type=Path, help="earlier results to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="tolerated relative slowdown")
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.probe:
+        print(json.dumps(probe(args.mode)), flush=True)
+        # the background workers started by the first request aren't waited for
+        os._exit(0)  # pylint: disable=protected-access
+
+    rounds = []
+    with tempfile.TemporaryDirectory(prefix="starboard-startup-") as directory:
+        for _ in range(args.rounds):
+            rounds.append(run_round(args.mode, directory))
+    results = {
+        "meta": {
+            "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=False
+            ).stdout.strip(),
+            "mode": args.mode,
+            "rounds": args.rounds,
+        },
+        "steps": {
+            step: {
+                "median_ms": round(statistics.median(timings[step] for timings in rounds), 2),
+                "max_ms": max(timings[step] for timings in rounds),
+            }
+            for step in STEPS
+        },
+    }
+    print(f"{'step':>15} {'median ms':>10} {'max ms':>8}")
+    for step, summary in results["steps"].items():
+        print(f"{step:>15} {summary['median_ms']:>10} {summary['max_ms']:>8}")
+
+    output = args.output or RESULTS / f"startup-{args.mode}-{results['meta']['started'].replace(':', '')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"saved to {output}")
+    if args.compare and not compare(results, json.loads(args.compare.read_text()), args.max_regression):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
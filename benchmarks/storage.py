@@ -0,0 +1,70 @@
+"""
+Lookup latency of the storage backends
+
+Measures the guild and message lookups of every backend, their conformance is tested in
+``tests/test_storage.py``. Run from the repository root::
+
+    python3 benchmarks/storage.py --backends sqlite
+    python3 benchmarks/storage.py --backends sqlite mysql
+
+The MySQL backend uses the database of the ``MYSQL_*`` environment variables and runs the
+migrations first, the benchmark leaves its rows behind. SQLite runs in a temporary file.
+"""
+import argparse
+import random
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter, time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+# pylint: disable=wrong-import-position
+from resources.messages import snowflake
+from resources.storage import create_backend
+
+
+def new_id() -> str:
+    """A snowflake of the last hour that no earlier run used"""
+    return str(snowflake(time() - random.uniform(0, 3600)) + random.getrandbits(22))
+
+
+def latency(backend, iterations: int) -> dict:
+    """
+    :return: Microseconds per guild and message lookup
+    """
+    guild_id, message_id = new_id(), new_id()
+    backend.upsert_webhook(guild_id, "1", "t")
+    backend.insert_message({"id": message_id, "flags": 0, "stars": 0, "guild_id": guild_id})
+    results = {}
+    for name, lookup in (("guild", lambda: backend.guild(guild_id)), ("message", lambda: backend.message(message_id))):
+        started = perf_counter()
+        for _ in range(iterations):
+            lookup()
+        results[name] = (perf_counter() - started) / iterations * 1000000
+    return results
+
+
+def main() -> int:
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description="Compare the storage backends")
+    parser.add_argument("--backends", nargs="+", choices=("mysql", "sqlite"), default=["sqlite"])
+    parser.add_argument("--iterations", type=int, default=2000, help="lookups measured per backend")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="starboard-storage-") as directory:
+        for name in args.backends:
+            if name == "sqlite":
+                # pylint: disable=import-outside-toplevel
+                from resources.sqlite_backend import SQLiteBackend
+
+                backend = SQLiteBackend(str(Path(directory) / "starboard.db"))
+            else:
+                backend = create_backend(name)
+                backend.migrate()
+            results = latency(backend, args.iterations)
+            print(f"{name:>6} guild lookup {results['guild']:.1f}us, message lookup {results['message']:.1f}us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Shared fixtures of the tests
+
+The app reads its configuration from the environment when it's imported, so the test
+environment is set up here before any test imports it: an embedded SQLite database,
+a fake Discord and a throwaway signing key. Tests that take the ``backend`` fixture run
+against SQLite and, if ``MYSQL_HOST`` is set, against that MySQL or MariaDB server too.
+"""
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from time import monotonic, sleep, time
+
+import pytest
+from nacl.signing import SigningKey
+
+ROOT = Path(__file__).resolve().parent.parent
+APP = ROOT / "app"
+sys.path[:0] = [str(APP), str(ROOT / "benchmarks")]
+
+
+def free_port() -> int:
+    """A port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+DIRECTORY = tempfile.mkdtemp(prefix="starboard-tests-")
+DISCORD_PORT = free_port()
+SIGNING_KEY = SigningKey.generate()
+os.environ.update(
+    {
+        "STORAGE_BACKEND": "sqlite",
+        "SQLITE_PATH": str(Path(DIRECTORY) / "starboard.db"),
+        "DISCORD_API_URL": f"http://127.0.0.1:{DISCORD_PORT}/api/v10",
+        "DISCORD_CLIENT_ID": "900000000000000001",
+        "DISCORD_CLIENT_SECRET": "secret",
+        "DISCORD_PUBLIC_KEY": SIGNING_KEY.verify_key.encode().hex(),
+        "DEPLOY_STATE_PATH": str(Path(DIRECTORY) / "deployed.json"),
+        "RETENTION_INTERVAL": "0",
+        "DB_TRACE_SUMMARY": "false",
+    }
+)
+# pylint: disable=wrong-import-position
+import fake_discord
+from resources import storage
+from resources.messages import snowflake
+
+APPLICATION_ID = "900000000000000001"
+CHANNEL_ID = "810000000000000001"
+USER = {"id": "100000000000000001", "username": "tests", "discriminator": "0001", "avatar": None}
+
+
+def new_id() -> str:
+    """A snowflake of the last hour that no earlier run used"""
+    return str(snowflake(time() - random.uniform(0, 3600)) + random.getrandbits(22))
+
+
+def interaction(guild_id: str, kind: int, data: dict, **fields) -> dict:
+    """
+    :return: An interaction of a new user
+    """
+    user = {**USER, "id": new_id()}
+    return {
+        "id": new_id(),
+        "application_id": APPLICATION_ID,
+        "type": kind,
+        "token": "token",
+        "version": 1,
+        "locale": "en-US",
+        "guild_locale": "en-US",
+        "guild_id": guild_id,
+        "channel_id": CHANNEL_ID,
+        "member": {"user": user, "roles": [], "permissions": "32"},
+        "data": data,
+        **fields,
+    }
+
+
+def post(client, data: dict):
+    """
+    Sends a signed interaction to the Flask application
+
+    :return: The response
+    """
+    body = json.dumps(data).encode()
+    timestamp = str(int(time()))
+    signature = SIGNING_KEY.sign(timestamp.encode() + body).signature.hex()
+    headers = {"X-Signature-Timestamp": timestamp, "X-Signature-Ed25519": signature}
+    return client.post("/interactions", data=body, headers=headers, content_type="application/json")
+
+
+def pytest_sessionstart(session):  # pylint: disable=unused-argument
+    """Runs the tests in the app directory, the locales and the guide are read relative to it"""
+    os.chdir(APP)
+
+
+@pytest.fixture(scope="session", name="fake")
+def fixture_fake():
+    """
+    :return: The state of the fake Discord serving the app's Discord API url
+    """
+    threading.Thread(target=fake_discord.serve, args=(DISCORD_PORT,), daemon=True).start()
+    deadline = monotonic() + 5
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", DISCORD_PORT), timeout=1).close()
+            return fake_discord.Handler.state
+        except ConnectionRefusedError:
+            if monotonic() > deadline:
+                raise
+            sleep(0.01)
+
+
+@pytest.fixture(scope="session", name="mysql_backend")
+def fixture_mysql_backend():
+    """
+    :return: The migrated MySQL backend of the ``MYSQL_*`` environment variables
+    """
+    if not os.environ.get("MYSQL_HOST"):
+        pytest.skip("MYSQL_HOST isn't set")
+    backend = storage.create_backend("mysql")
+    backend.migrate()
+    return backend
+
+
+@pytest.fixture(params=["sqlite", "mysql"], name="backend")
+def fixture_backend(request, tmp_path):
+    """
+    :return: A backend of every kind, SQLite in a fresh file
+    """
+    if request.param == "mysql":
+        return request.getfixturevalue("mysql_backend")
+    # pylint: disable=import-outside-toplevel
+    from resources.sqlite_backend import SQLiteBackend
+
+    return SQLiteBackend(str(tmp_path / "starboard.db"))
+
+
+@pytest.fixture(name="installed")
+def fixture_installed(backend, monkeypatch):
+    """
+    :return: The backend, installed as the one the resource modules use
+    """
+    monkeypatch.setattr(storage, "_backend", backend)
+    monkeypatch.setattr(storage, "_backend_pid", os.getpid())
+    return backend
+
+
+@pytest.fixture(name="client")
+def fixture_client(installed, fake, monkeypatch):  # pylint: disable=unused-argument
+    """
+    :return: A test client of the Flask application on the installed backend
+    """
+    # pylint: disable=import-outside-toplevel
+    import bot
+    import delivery
+    import retention
+
+    # posts are left in the outbox and nothing is purged while the tests run
+    monkeypatch.setattr(delivery.deliverer, "start", lambda: None)
+    monkeypatch.setattr(retention, "start", lambda: None)
+    return bot.app.test_client()
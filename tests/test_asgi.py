@@ -0,0 +1,86 @@
+"""
+Tests of the routing of the ASGI application
+"""
+import asyncio
+import json
+from time import time
+from types import SimpleNamespace
+
+import pytest
+from conftest import SIGNING_KEY
+from flask_discord_interactions.models.message import Message
+
+
+def call(method: str, path: str, body: bytes = b"", headers: list = ()) -> tuple:
+    """
+    Sends one request to the ASGI application
+
+    :return: The status, content type and body of the response
+    """
+    import asgi  # pylint: disable=import-outside-toplevel
+
+    sent = []
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(event: dict) -> None:
+        sent.append(event)
+
+    scope = {"type": "http", "method": method, "path": path, "headers": list(headers)}
+    asyncio.run(asgi.app(scope, receive, send))
+    assert [event["type"] for event in sent] == ["http.response.start", "http.response.body"]
+    return sent[0]["status"], dict(sent[0]["headers"])[b"content-type"], sent[1]["body"]
+
+
+def signed(body: bytes) -> list:
+    """
+    :return: The signature headers of a body
+    """
+    timestamp = str(int(time())).encode()
+    signature = SIGNING_KEY.sign(timestamp + body).signature.hex().encode()
+    return [(b"x-signature-timestamp", timestamp), (b"x-signature-ed25519", signature)]
+
+
+@pytest.mark.usefixtures("installed")
+def test_pages():
+    """The metrics and readiness pages answer GET requests, anything else is not found"""
+    status, content_type, body = call("GET", "/metrics")
+    assert status == 200 and content_type.startswith(b"text/plain") and body
+    assert call("GET", "/ready") == (200, b"application/json", b'{"database": "ok"}')
+    assert call("POST", "/metrics")[0] == 404
+    assert call("GET", "/interactions")[0] == 404
+    assert call("GET", "/nothing")[0] == 404
+
+
+def test_interactions():
+    """Interactions are only handled with a valid signature"""
+    body = json.dumps({"type": 1}).encode()
+    assert call("POST", "/interactions", body)[:2] == (401, b"text/plain")
+    forged = [(b"x-signature-timestamp", b"1"), (b"x-signature-ed25519", b"00")]
+    assert call("POST", "/interactions", body, forged)[0] == 401
+    status, content_type, response = call("POST", "/interactions", body, signed(body))
+    assert (status, content_type, json.loads(response)) == (200, b"application/json", {"type": 1})
+
+
+def test_followup_before_deferral(monkeypatch):
+    """Editing a deferred response Discord doesn't know yet is retried until it does"""
+    import asgi  # pylint: disable=import-outside-toplevel
+
+    sent = []
+
+    async def request(method: str, url: str, **kwargs):  # pylint: disable=unused-argument
+        sent.append((method, url))
+        return SimpleNamespace(status=404 if len(sent) < 3 else 200, raise_for_status=lambda: None)
+
+    async def done() -> Message:
+        return Message("Done")
+
+    async def finish() -> None:
+        await asgi.finish_deferred(asyncio.create_task(done()), {"id": "1", "token": "token", "type": 3})
+
+    monkeypatch.setattr(asgi, "get_async_client", lambda: SimpleNamespace(request=request))
+    monkeypatch.setattr(asgi.handlers.config.Interactions, "FOLLOWUP_RETRY_DELAY", 0.01)
+    asyncio.run(finish())
+    assert [method for method, _ in sent] == ["PATCH"] * 3
+    assert sent[0][1].endswith("/token/messages/@original")
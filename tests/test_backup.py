@@ -0,0 +1,113 @@
+"""
+Tests of the export and import of guilds, messages and star votes
+"""
+import io
+import json
+import os
+import sys
+
+import pytest
+from conftest import new_id
+from resources import storage
+from resources.sqlite_backend import SQLiteBackend
+
+import backup
+
+ALL = 1000
+
+
+def install(monkeypatch, backend) -> None:
+    """Makes the resource modules use a backend"""
+    monkeypatch.setattr(storage, "_backend", backend)
+    monkeypatch.setattr(storage, "_backend_pid", os.getpid())
+
+
+def rows(backend) -> dict:
+    """
+    :return: Everything an export should carry over, and the statistics rebuilt from it
+    """
+    guilds = backend.guild_page(None, ALL)
+    return {
+        "guilds": [dict(record) for record in guilds],
+        "messages": [dict(record) for record in backend.message_page(None, ALL)],
+        "votes": [dict(record) for record in backend.vote_page(None, ALL)],
+        "leaderboards": {
+            record["id"]: {
+                kind: [dict(row) for row in ranked] for kind, ranked in backend.leaderboard(record["id"], ALL).items()
+            }
+            for record in guilds
+        },
+    }
+
+
+@pytest.fixture(name="source")
+def fixture_source(tmp_path) -> SQLiteBackend:
+    """
+    :return: A SQLite backend of three guilds with five starred messages each
+    """
+    source = SQLiteBackend(str(tmp_path / "source.db"))
+    for number in range(3):
+        guild_id = new_id()
+        source.insert_guild(
+            {"id": guild_id, "webhook_id": new_id(), "webhook_token": f"token{number}", "flags": number}
+        )
+        for _ in range(5):
+            message_id, author_id = new_id(), new_id()
+            source.insert_message(
+                {
+                    "id": message_id,
+                    "flags": 0,
+                    "stars": 0,
+                    "guild_id": guild_id,
+                    "author_id": author_id,
+                    "channel_id": new_id(),
+                }
+            )
+            for _ in range(number + 1):
+                source.star(message_id, new_id())
+    return source
+
+
+def test_round_trip(source, tmp_path, monkeypatch):
+    """Exporting and importing into an empty database through the command line carries over every row"""
+    path = str(tmp_path / "backup.jsonl")
+    install(monkeypatch, source)
+    monkeypatch.setattr(sys, "argv", ["backup.py", "--batch-size", "4", "export", path])
+    backup.main()
+    target = SQLiteBackend(str(tmp_path / "target.db"))
+    install(monkeypatch, target)
+    monkeypatch.setattr(sys, "argv", ["backup.py", "--batch-size", "4", "import", path])
+    backup.main()
+    assert rows(target) == rows(source)
+    assert len(rows(target)["votes"]) == 5 * (1 + 2 + 3)
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 4, 15, 30, 1000])
+def test_pages(source, tmp_path, monkeypatch, batch_size):
+    """Pages of any size export every row exactly once and in order, even when the last page is full"""
+    install(monkeypatch, source)
+    output = io.StringIO()
+    counts = backup.export(output, batch_size=batch_size)
+    assert counts == {"guild": 3, "message": 15, "vote": 30}
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    guild_ids = [line["id"] for line in lines if line["type"] == "guild"]
+    message_ids = [line["id"] for line in lines if line["type"] == "message"]
+    votes = [(line["message_id"], line["user_id"]) for line in lines if line["type"] == "vote"]
+    assert guild_ids == [record["id"] for record in source.guild_page(None, ALL)]
+    assert message_ids == [record["id"] for record in source.message_page(None, ALL)]
+    assert votes == [(record["message_id"], record["user_id"]) for record in source.vote_page(None, ALL)]
+    assert len(set(votes)) == len(votes) == 30
+
+    install(monkeypatch, SQLiteBackend(str(tmp_path / "target.db")))
+    lines = output.getvalue().splitlines()
+    added = {kind: {"read": count, "added": count} for kind, count in counts.items()}
+    assert backup.import_rows(lines, batch_size) == added
+    assert backup.import_rows(lines, batch_size) == {
+        kind: {"read": count, "added": 0} for kind, count in counts.items()
+    }
+
+
+def test_unknown_type():
+    """Lines of an unknown type are refused with their line number"""
+    with pytest.raises(ValueError, match="Line 2"):
+        backup.import_rows(['{"type": "guild", "id": "1", "webhook_id": "2", "webhook_token": "t"}', '{"type": "x"}'])
@@ -0,0 +1,22 @@
+"""
+Tests of the in-process cache
+"""
+from resources.cache import TTLCache
+
+
+def test_set_after_invalidation():
+    """A value loaded before an invalidation isn't stored, one loaded afterwards is"""
+    cache = TTLCache(10, 60)
+    generation = cache.generation()
+    cache.invalidate("guild")
+    cache.set("guild", "stale", generation)
+    assert cache.get("guild") is None
+    cache.set("guild", "fresh", cache.generation())
+    assert cache.get("guild") == "fresh"
+
+
+def test_expiry():
+    """Entries expire after the ttl"""
+    cache = TTLCache(10, 0)
+    cache.set("guild", "value")
+    assert cache.get("guild") is None
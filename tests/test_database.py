@@ -0,0 +1,111 @@
+"""
+Tests of the blocking MySQL connection pool
+
+The pool's bookkeeping doesn't need a server, so the connections are stand-ins that
+count how they were used.
+"""
+import threading
+
+import pytest
+from mysql.connector import errors
+
+from resources import database
+
+
+class Connection:
+    """A connection whose ping fails once the server dropped it"""
+
+    def __init__(self, **connect_args):  # pylint: disable=unused-argument
+        self.dropped = False
+        self.closed = False
+        self.in_transaction = False
+        self.autocommit = False
+
+    def ping(self, reconnect: bool, attempts: int) -> None:  # pylint: disable=unused-argument
+        """Fails like a connection the server closed"""
+        if self.dropped:
+            raise errors.InterfaceError("Connection dropped")
+
+    def rollback(self) -> None:
+        """Ends the transaction"""
+        self.in_transaction = False
+
+    def close(self) -> None:
+        """Closes the connection"""
+        self.closed = True
+
+
+@pytest.fixture(name="pool")
+def fixture_pool(monkeypatch) -> database.ConnectionPool:
+    """
+    :return: A pool of a single stand-in connection that gives up waiting after 50ms
+    """
+    monkeypatch.setattr(database.mysql.connector, "connect", Connection)
+    return database.ConnectionPool(1, 0.05)
+
+
+def test_reuse(pool):
+    """A returned connection is borrowed again instead of opening another one"""
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert pool.stats()["created"] == 1 and pool.stats()["idle"] == 1
+
+
+def test_timeout(pool):
+    """Borrowing from an exhausted pool gives up after the timeout"""
+    with pool.connection():
+        with pytest.raises(database.PoolTimeout):
+            pool.acquire()
+        assert pool.stats()["waiting"] == 0
+    assert pool.stats()["checked_out"] == 0
+
+
+def test_waiting(pool):
+    """A waiting borrower gets the connection as soon as it's returned"""
+    con = pool.acquire()
+    threading.Timer(0.01, pool.release, (con,)).start()
+    assert pool.acquire() is con
+
+
+def test_broken(pool):
+    """A connection that failed with a connection error is closed instead of returned"""
+    with pytest.raises(errors.OperationalError):
+        with pool.connection() as con:
+            raise errors.OperationalError("Lost connection")
+    assert con.closed and pool.stats()["idle"] == 0
+    with pool.connection() as replacement:
+        assert replacement is not con
+    assert pool.stats()["checked_out"] == 0
+
+
+def test_rollback(pool):
+    """A connection is returned with its transaction rolled back if the block raised"""
+    with pytest.raises(ValueError):
+        with pool.connection() as con:
+            con.in_transaction = True
+            raise ValueError()
+    assert not con.in_transaction and not con.closed
+    assert pool.stats()["idle"] == 1
+
+
+def test_reconnect(pool):
+    """A connection the server dropped while idle is replaced when it's borrowed"""
+    with pool.connection() as con:
+        con.dropped = True
+    with pool.connection() as replacement:
+        assert replacement is not con
+    assert con.closed
+    stats = pool.stats()
+    assert stats["reconnects"] == 1 and stats["created"] == 2
+
+
+def test_forked(monkeypatch):
+    """A forked worker gets a pool of its own instead of its parent's sockets"""
+    monkeypatch.setattr(database, "_pool", None)
+    pool = database.get_pool()
+    assert database.get_pool() is pool
+    monkeypatch.setattr(database, "getpid", lambda: pool.pid + 1)
+    forked = database.get_pool()
+    assert forked is not pool and forked.pid == pool.pid + 1
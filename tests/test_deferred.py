@@ -0,0 +1,70 @@
+"""
+Tests of the deferred responses of the blocking serving mode
+"""
+import logging
+from concurrent.futures import Future
+
+import requests
+from flask_discord_interactions.models.message import Message
+
+import bot
+from http_client import RateLimited
+
+
+class LimitedClient:  # pylint: disable=too-few-public-methods
+    """An HTTP client whose followup bucket is empty"""
+
+    def request(self, method: str, url: str, **kwargs):  # pylint: disable=unused-argument
+        """Gives up on the followup like a long rate limit does"""
+        raise RateLimited("webhooks", 30)
+
+
+def test_rate_limited_followup(monkeypatch, caplog):
+    """A followup that is rate limited for too long is logged and dropped"""
+    monkeypatch.setattr(bot, "get_client", LimitedClient)
+    future = Future()
+    future.set_result(Message("Done"))
+    with caplog.at_level(logging.WARNING):
+        bot.discord.finish_deferred(future, {"id": "1", "token": "token", "type": 3})
+    assert "Dropped the deferred response of interaction 1: Rate limited on webhooks" in caplog.text
+
+
+class LateClient:  # pylint: disable=too-few-public-methods
+    """An HTTP client for which the deferred response only reaches Discord after two attempts"""
+
+    sent = []
+
+    def request(self, method: str, url: str, **kwargs):  # pylint: disable=unused-argument
+        """Answers 404 until the deferred response is known"""
+        self.sent.append((method, url))
+        response = requests.Response()
+        response.status_code = 404 if len(self.sent) < 3 else 200
+        response.url = url
+        return response
+
+
+def test_followup_before_deferral(monkeypatch, caplog):
+    """Editing a deferred response Discord doesn't know yet is retried until it does"""
+    monkeypatch.setattr(bot, "get_client", LateClient)
+    monkeypatch.setattr(LateClient, "sent", [])
+    monkeypatch.setattr(bot.config.Interactions, "FOLLOWUP_RETRY_DELAY", 0.01)
+    future = Future()
+    future.set_result(Message("Done"))
+    with caplog.at_level(logging.WARNING):
+        bot.discord.finish_deferred(future, {"id": "1", "token": "token", "type": 3})
+    assert [method for method, _ in LateClient.sent] == ["PATCH"] * 3
+    assert LateClient.sent[0][1].endswith("/token/messages/@original")
+    assert not caplog.text
+
+
+def test_followup_never_deferred(monkeypatch, caplog):
+    """A deferred response that never shows up is given up on after the configured retries"""
+    monkeypatch.setattr(bot, "get_client", LateClient)
+    monkeypatch.setattr(LateClient, "sent", [])
+    monkeypatch.setattr(bot.config.Interactions, "FOLLOWUP_RETRIES", 1)
+    monkeypatch.setattr(bot.config.Interactions, "FOLLOWUP_RETRY_DELAY", 0.01)
+    future = Future()
+    future.set_result(Message("Done"))
+    bot.discord.finish_deferred(future, {"id": "1", "token": "token", "type": 3})
+    assert len(LateClient.sent) == 2
+    assert "Failed to send the deferred response of interaction 1" in caplog.text
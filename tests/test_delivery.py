@@ -0,0 +1,74 @@
+"""
+Tests of the delivery of queued starboard posts
+"""
+import pytest
+
+import delivery
+from http_client import RateLimited
+from resources import outbox
+
+
+class Response:  # pylint: disable=too-few-public-methods
+    """A webhook's response"""
+
+    def __init__(self, status_code: int, headers: dict = None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.reason = "Error"
+        self.text = ""
+        self.headers = headers or {}
+
+
+@pytest.fixture(name="attempts")
+def fixture_attempts(monkeypatch) -> dict:
+    """
+    :return: How the posts were rescheduled or given up, by outcome
+    """
+    attempts = {"counted": 0, "not_counted": 0, "failed": 0}
+
+    def reschedule(post, delay, error, count_attempt=True):  # pylint: disable=unused-argument
+        attempts["counted" if count_attempt else "not_counted"] += 1
+
+    monkeypatch.setattr(outbox, "reschedule", reschedule)
+    monkeypatch.setattr(outbox, "mark_failed", lambda post, error: attempts.update(failed=attempts["failed"] + 1))
+    return attempts
+
+
+def client(answer):
+    """
+    :return: An HTTP client whose posts all get the same response or raise the same error
+    """
+
+    class Client:  # pylint: disable=too-few-public-methods
+        """An HTTP client answering every post the same way"""
+
+        def post(self, url: str, **kwargs):  # pylint: disable=unused-argument
+            """Answers the post"""
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+    return Client
+
+
+def deliver(post: outbox.Post) -> None:
+    """Delivers a post like a worker does"""
+    delivery.Deliverer(1, 1, max_attempts=3)._deliver(post)  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize(
+    "answer", [Response(429, {"Retry-After": "1"}), RateLimited("webhooks", 30)], ids=["429", "rate_limited"]
+)
+def test_rate_limits_dont_count(monkeypatch, attempts, answer):
+    """A rate limited post is retried even after its last attempt, without counting one"""
+    monkeypatch.setattr(delivery, "get_client", client(answer))
+    deliver(outbox.Post(1, "2", "https://example.com/webhook", {}, attempts=2))
+    assert attempts == {"counted": 0, "not_counted": 1, "failed": 0}
+
+
+def test_server_errors_count(monkeypatch, attempts):
+    """A post failing on its last attempt is given up"""
+    monkeypatch.setattr(delivery, "get_client", client(Response(502)))
+    deliver(outbox.Post(1, "2", "https://example.com/webhook", {}, attempts=1))
+    deliver(outbox.Post(1, "2", "https://example.com/webhook", {}, attempts=2))
+    assert attempts == {"counted": 1, "not_counted": 0, "failed": 1}
@@ -0,0 +1,155 @@
+"""
+Tests of the diff-based command deployment against the fake Discord
+
+Every test starts without registered commands and without a state of the last deploy,
+then checks what was created, updated, deleted or skipped and which requests reached the
+commands endpoints.
+"""
+import json
+import os
+from urllib.request import Request, urlopen
+
+import pytest
+from conftest import DISCORD_PORT
+
+import config
+import deploy
+from bot import discord
+
+APPLICATION_ID = "900000000000000001"
+GUILD_ID = "830928381100556338"
+API = f"http://127.0.0.1:{DISCORD_PORT}/api/v10"
+
+
+@pytest.fixture(name="fake", autouse=True)
+def fixture_fake(fake):
+    """
+    :return: The fake Discord without registered commands, and no state of the last deploy
+    """
+    with fake.lock:
+        fake.commands.pop((APPLICATION_ID, None), None)
+        fake.commands.pop((APPLICATION_ID, GUILD_ID), None)
+    if os.path.exists(config.Deploy.STATE_PATH):
+        os.remove(config.Deploy.STATE_PATH)
+    return fake
+
+
+@pytest.fixture(name="deployed")
+def fixture_deployed(fake) -> None:  # pylint: disable=unused-argument
+    """Every command is deployed globally"""
+    deploy.deploy()
+
+
+def call(method: str, path: str, payload=None):
+    """
+    Calls the fake directly, like someone editing the commands by hand
+
+    :return: The response's JSON, None if it has no body
+    """
+    data = json.dumps(payload).encode() if payload is not None else None
+    request = Request(f"{API}{path}", data=data, method=method, headers={"Content-Type": "application/json"})
+    with urlopen(request) as response:
+        body = response.read()
+    return json.loads(body) if body else None
+
+
+def registered(guild_id: str = None) -> dict:
+    """
+    :return: The registered commands by name
+    """
+    path = f"/applications/{APPLICATION_ID}{f'/guilds/{guild_id}' if guild_id else ''}/commands"
+    return {command["name"]: command for command in call("GET", f"{path}?with_localizations=true")}
+
+
+def requests(fake) -> dict:
+    """
+    :return: Number of requests to the commands endpoints by method
+    """
+    received = fake.stats()["requests"]
+    return {kind[9:]: count for kind, count in received.items() if kind.startswith("commands_")}
+
+
+def writes(before: dict, after: dict) -> int:
+    """
+    :return: Number of requests between two snapshots that changed commands
+    """
+    return sum(after.get(method, 0) - before.get(method, 0) for method in ("post", "patch", "delete", "put"))
+
+
+def test_first_deploy():
+    """Every command is created"""
+    result = deploy.deploy()
+    assert sorted(result["created"]) == sorted(discord.discord_commands)
+    assert sorted(registered()) == sorted(discord.discord_commands)
+
+
+def test_unchanged(fake, deployed):  # pylint: disable=unused-argument
+    """Deploying again only lists the registered commands"""
+    before = requests(fake)
+    result = deploy.deploy()
+    assert sorted(result["skipped"]) == sorted(discord.discord_commands)
+    after = requests(fake)
+    assert writes(before, after) == 0 and after["get"] - before.get("get", 0) == 1
+
+
+def test_without_state(fake, deployed):  # pylint: disable=unused-argument
+    """Without the state of the last deploy the registered commands are compared field by field"""
+    os.remove(config.Deploy.STATE_PATH)
+    before = requests(fake)
+    result = deploy.deploy()
+    assert sorted(result["skipped"]) == sorted(discord.discord_commands)
+    assert writes(before, requests(fake)) == 0
+    assert os.path.exists(config.Deploy.STATE_PATH)
+
+
+def test_drift(deployed):  # pylint: disable=unused-argument
+    """Commands changed, deleted or added by hand are put back"""
+    commands = registered()
+    path = f"/applications/{APPLICATION_ID}/commands"
+    call("PATCH", f"{path}/{commands['settings']['id']}", {"description": "Edited by hand"})
+    call("DELETE", f"{path}/{commands['manual']['id']}")
+    call("POST", path, {"name": "obsolete", "description": "Not defined anymore", "type": 1})
+    result = deploy.deploy()
+    assert result["updated"] == ["settings"] and result["created"] == ["manual"]
+    assert result["deleted"] == ["obsolete"] and len(result["skipped"]) == len(discord.discord_commands) - 2
+    commands = registered()
+    assert "obsolete" not in commands and commands["settings"]["description"] == "Set up starboard."
+
+
+def test_changed_definition(deployed, monkeypatch):  # pylint: disable=unused-argument
+    """Only a command whose definition changed is updated, the state alone tells it apart"""
+    monkeypatch.setattr(discord.discord_commands["leaderboard"], "description", "A changed description")
+    result = deploy.deploy()
+    assert result["updated"] == ["leaderboard"] and not result["created"] and not result["deleted"]
+    assert registered()["leaderboard"]["description"] == "A changed description"
+    monkeypatch.undo()
+    assert deploy.deploy()["updated"] == ["leaderboard"]
+
+
+def test_dry_run(fake, deployed):  # pylint: disable=unused-argument
+    """A dry run sends nothing and keeps the state"""
+    with open(config.Deploy.STATE_PATH, encoding="utf-8") as file:
+        state = file.read()
+    before = requests(fake)
+    result = deploy.deploy(force=True, dry_run=True)
+    assert sorted(result["updated"]) == sorted(discord.discord_commands)
+    assert writes(before, requests(fake)) == 0
+    with open(config.Deploy.STATE_PATH, encoding="utf-8") as file:
+        assert file.read() == state
+
+
+def test_guild(deployed):  # pylint: disable=unused-argument
+    """Guild commands are deployed on their own and don't touch the global ones"""
+    global_commands = registered()
+    result = deploy.deploy(GUILD_ID)
+    assert sorted(result["created"]) == sorted(discord.discord_commands)
+    assert sorted(deploy.deploy(GUILD_ID)["skipped"]) == sorted(discord.discord_commands)
+    assert registered() == global_commands
+
+
+def test_remove(deployed):  # pylint: disable=unused-argument
+    """Removing deletes every registered command"""
+    deploy.deploy(GUILD_ID)
+    result = deploy.deploy(GUILD_ID, remove=True)
+    assert sorted(result["deleted"]) == sorted(discord.discord_commands)
+    assert not registered(GUILD_ID) and registered()
@@ -0,0 +1,30 @@
+"""
+Tests of the fake Discord the benchmarks and tests run against
+"""
+import json
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from conftest import DISCORD_PORT
+
+
+def test_registers_commands(fake):
+    """Commands put in bulk are listed with their ids"""
+    path = f"http://127.0.0.1:{DISCORD_PORT}/api/v10/applications/1/guilds/2/commands"
+    payload = json.dumps([{"name": "ping", "description": "Pong", "type": 1}]).encode()
+    request = Request(path, data=payload, method="PUT", headers={"Content-Type": "application/json"})
+    with urlopen(request) as response:
+        created = json.load(response)
+    with urlopen(path) as response:
+        assert json.load(response) == created
+    assert created[0]["name"] == "ping"
+    assert list(fake.commands[("1", "2")]) == [created[0]["id"]]
+
+
+def test_unknown_route(fake):  # pylint: disable=unused-argument
+    """Routes the fake doesn't know answer 404"""
+    with pytest.raises(HTTPError) as error:
+        urlopen(f"http://127.0.0.1:{DISCORD_PORT}/api/v10/nothing")  # pylint: disable=consider-using-with
+    assert error.value.code == 404
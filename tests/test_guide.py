@@ -0,0 +1,26 @@
+"""
+Tests of the hot reloading of the guide
+"""
+import guide
+
+
+def test_checks_once_per_interval(monkeypatch):
+    """The guide files are checked at most once per interval and a reload doesn't check them again"""
+    now = [1000.0]
+    checks = []
+    index = guide.load_index()
+    monkeypatch.setattr(guide.config.Guide, "RELOAD_INTERVAL", 10)
+    monkeypatch.setattr(guide, "monotonic", lambda: now[0])
+    monkeypatch.setattr(guide, "_index", index)
+    monkeypatch.setattr(guide, "_checked_at", now[0])
+    monkeypatch.setattr(guide, "guide_mtime", lambda path=None: checks.append(now[0]) or index.mtime + len(checks) - 1)
+    for _ in range(3):
+        assert guide.get_index() is index
+    assert not checks
+    now[0] += 10
+    for _ in range(3):
+        assert guide.get_index() is index
+    assert checks == [1010.0]
+    now[0] += 10
+    reloaded = guide.get_index()
+    assert reloaded is not index and reloaded.mtime == index.mtime + 1 and checks == [1010.0, 1020.0]
@@ -0,0 +1,34 @@
+"""
+Tests of the messages the handlers answer with
+"""
+from types import SimpleNamespace
+
+import pytest
+
+import handlers
+from resources.leaderboard import Leaderboard
+
+
+@pytest.mark.parametrize("locale, text", [("en-US", "No stars yet."), ("de", "Noch keine Sterne.")])
+def test_leaderboard_without_stars(locale, text):
+    """A leaderboard without starred messages says so instead of sending an empty field"""
+    ctx = SimpleNamespace(guild_id="1", guild_locale=locale)
+    message = handlers.leaderboard_message(ctx, Leaderboard(messages=[], users=[("2", 0, 0)]))
+    fields = message.embeds[0].fields
+    assert fields[0].value == text
+    assert all(field.value for field in fields)
+
+
+@pytest.mark.parametrize(
+    "kind, ephemeral, methods",
+    [(2, False, ["PATCH"]), (3, False, ["PATCH"]), (2, True, ["DELETE", "POST"]), (3, True, ["POST"])],
+    ids=["command", "component", "ephemeral_command", "ephemeral_component"],
+)
+def test_followup_requests(kind, ephemeral, methods):
+    """A public deferred response is edited, an ephemeral result is sent as a followup"""
+    data = {"id": "1", "token": "token", "type": kind}
+    requests = handlers.followup_requests(data, "9", b"{}", "application/json", ephemeral)
+    assert [method for method, _, _ in requests] == methods
+    assert all(
+        url.endswith("/9/token" if method == "POST" else "/9/token/messages/@original") for method, url, _ in requests
+    )
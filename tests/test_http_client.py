@@ -0,0 +1,101 @@
+"""
+Tests of the rate limit handling of the HTTP client against the fake Discord
+
+Every test posts to webhooks of its own, so the fake's buckets don't carry over.
+"""
+from time import monotonic
+
+import pytest
+from conftest import DISCORD_PORT, new_id
+
+import http_client
+
+API = f"http://127.0.0.1:{DISCORD_PORT}/api/v10"
+
+
+@pytest.fixture(name="limited")
+def fixture_limited(fake, monkeypatch):
+    """
+    :return: The fake Discord allowing two requests per bucket, webhook and 300ms
+    """
+    monkeypatch.setattr(fake, "limit", 2)
+    monkeypatch.setattr(fake, "window", 0.3)
+    return fake
+
+
+def webhook() -> str:
+    """
+    :return: The url of a new webhook
+    """
+    return f"{API}/webhooks/{new_id()}/token-{new_id()}"
+
+
+def new_client(max_wait: float = 5) -> http_client.Client:
+    """
+    :return: A client that doesn't know any bucket yet
+    """
+    return http_client.Client(4, 5, max_wait)
+
+
+def test_route_key():
+    """Webhooks share a route and are told apart by their major parameter, which keeps the token"""
+    first_route, first_major = http_client.route_key("post", f"{API}/webhooks/{new_id()}/secret")
+    second_route, second_major = http_client.route_key("POST", f"{API}/webhooks/{new_id()}/other")
+    assert first_route == second_route and "secret" not in first_route
+    assert first_major != second_major and first_major.endswith("/secret")
+
+
+def test_waits_for_bucket(limited):
+    """A request on an exhausted bucket waits for it to reset instead of getting a 429"""
+    client, url = new_client(), webhook()
+    rate_limited = limited.rate_limited
+    for _ in range(2):
+        client.post(url, json={}).raise_for_status()
+    started = monotonic()
+    client.post(url, json={}).raise_for_status()
+    assert monotonic() - started > 0.1
+    assert limited.rate_limited == rate_limited
+
+
+def test_isolated_webhooks(limited):  # pylint: disable=unused-argument
+    """An exhausted webhook doesn't hold up the others, although they share the bucket hash"""
+    client, url = new_client(max_wait=0.05), webhook()
+    for _ in range(2):
+        client.post(url, json={}).raise_for_status()
+    started = monotonic()
+    client.post(webhook(), json={}).raise_for_status()
+    assert monotonic() - started < 0.1
+    with pytest.raises(http_client.RateLimited):
+        client.post(url, json={})
+    assert client.rate_limits.stats()["routes"] == 1
+
+
+def test_retry_after(limited):  # pylint: disable=unused-argument
+    """A 429 the client didn't see coming makes the next request wait for the Retry-After"""
+    url = webhook()
+    for _ in range(2):
+        new_client().post(url, json={}).raise_for_status()
+    client = new_client(max_wait=0.05)
+    assert client.post(url, json={}).status_code == 429
+    with pytest.raises(http_client.RateLimited) as error:
+        client.post(url, json={})
+    assert 0 < error.value.retry_after <= 0.3
+    assert client.post(url, json={}, max_wait=1).status_code == 200
+
+
+def test_global_limit():
+    """A global 429 holds up every route until the Retry-After passed"""
+    limiter = http_client.RateLimiter()
+    limiter.update("POST /webhooks", "webhooks/1/a", 429, {"Retry-After": "2", "X-RateLimit-Global": "true"})
+    assert 1 < limiter.reserve("PATCH /channels/{id}", "channels/2") <= 2
+    with pytest.raises(http_client.RateLimited):
+        limiter.acquire("POST /webhooks", "webhooks/3/b", 0.1)
+
+
+def test_forgets_reset_buckets():
+    """Buckets of unique interaction tokens are dropped once they reset"""
+    limiter = http_client.RateLimiter(prune_interval=0)
+    headers = {"X-RateLimit-Bucket": "hash", "X-RateLimit-Remaining": "4", "X-RateLimit-Reset-After": "0"}
+    for token in range(1000):
+        limiter.update("POST /webhooks/{id}/{token}", f"webhooks/1/{token}", 200, headers)
+    assert limiter.stats() == {"buckets": 1, "routes": 1}
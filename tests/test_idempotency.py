@@ -0,0 +1,109 @@
+"""
+Tests of answering duplicate interactions with the response of the first one
+
+A command of the tests counts its runs, so a duplicate that ran again shows up.
+"""
+from types import SimpleNamespace
+
+import pytest
+from conftest import interaction, new_id, post
+from flask_discord_interactions.command import Command
+from flask_discord_interactions.models.message import Message
+
+import bot
+import config
+from resources import interactions
+from resources.cache import TTLCache
+
+
+@pytest.fixture(name="runs")
+def fixture_runs(client, monkeypatch) -> SimpleNamespace:  # pylint: disable=unused-argument
+    """
+    :return: The number of runs of the ``runs`` command, and the results it answers with in turn
+    """
+    runs = SimpleNamespace(count=0, results=[])
+
+    def command(ctx) -> Message:  # pylint: disable=unused-argument
+        runs.count += 1
+        result = runs.results.pop(0) if runs.results else Message("Done", ephemeral=True)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setitem(
+        bot.discord.discord_commands, "runs", Command(command, "runs", "Counts its runs", options=[], annotations={})
+    )
+    return runs
+
+
+def command_interaction() -> dict:
+    """
+    :return: An interaction running the ``runs`` command
+    """
+    return interaction(new_id(), 2, {"id": "4", "name": "runs", "type": 1})
+
+
+def test_duplicate(client, runs):
+    """A duplicate gets the stored response without running the command again"""
+    data = command_interaction()
+    first = post(client, data)
+    second = post(client, data)
+    assert first.status_code == second.status_code == 200
+    assert second.get_json() == first.get_json() and first.get_json()["data"]["content"] == "Done"
+    assert runs.count == 1
+
+
+def test_duplicate_after_cache_expiry(client, runs, monkeypatch):
+    """A duplicate whose response left the cache gets it from the database"""
+    monkeypatch.setattr(interactions, "cache", TTLCache(10, 0))
+    data = command_interaction()
+    first = post(client, data)
+    assert post(client, data).get_json() == first.get_json()
+    assert runs.count == 1
+
+
+def test_pending(client, runs, installed, monkeypatch):
+    """A duplicate of an interaction another worker is still handling gets a 409 at the deadline"""
+    monkeypatch.setattr(config.Interactions, "DEADLINE", 0.2)
+    data = command_interaction()
+    installed.claim_interaction(data["id"])
+    assert post(client, data).status_code == 409
+    assert runs.count == 0
+
+
+def test_failed_is_released(client, runs, installed):
+    """A command that raised doesn't keep its claim, so a retry runs it again"""
+    runs.results.append(ValueError("Failed"))
+    data = command_interaction()
+    assert post(client, data).status_code == 500
+    assert installed.interaction_response(data["id"]) is None
+    response = post(client, data)
+    assert response.status_code == 200 and response.get_json()["data"]["content"] == "Done"
+    assert runs.count == 2
+
+
+@pytest.mark.parametrize(
+    "result",
+    [Message("With a file", file=("stars.txt", b"*")), Message("x" * (config.Idempotency.MAX_RESPONSE_SIZE + 1))],
+    ids=["file", "oversized"],
+)
+def test_not_stored(client, runs, installed, result):
+    """Responses with files and oversized ones aren't stored, their duplicates run again"""
+    runs.results.extend([result, result])
+    data = command_interaction()
+    for _ in range(2):
+        assert post(client, data).status_code == 200
+    assert runs.count == 2
+    assert installed.interaction_response(data["id"]) is None and interactions.cache.get(data["id"]) is None
+
+
+def test_empty_response(installed):  # pylint: disable=unused-argument
+    """A stored empty response is answered like any other instead of being taken for a pending one"""
+    interaction_id = new_id()
+    assert interactions.claim(interaction_id, 0) is None
+    with pytest.raises(interactions.InteractionPending):
+        interactions.claim(interaction_id, 0)
+    interactions.store(interaction_id, "")
+    assert interactions.claim(interaction_id, 0) == ""
+    interactions.cache.invalidate(interaction_id)
+    assert interactions.claim(interaction_id, 0) == ""
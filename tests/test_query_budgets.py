@@ -0,0 +1,113 @@
+"""
+Tests of the database statements the handlers run per interaction
+
+Signed interactions are posted to the Flask application and every handler's trace is
+checked against its budget in ``tracing.QUERY_BUDGETS``, the same budgets the load test
+checks under load.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pytest
+from conftest import APPLICATION_ID, CHANNEL_ID, USER, interaction, new_id
+from conftest import post as post_interaction
+
+import tracing
+from resources import guilds, messages
+
+
+@pytest.fixture(name="traces")
+def fixture_traces(monkeypatch):
+    """
+    :return: The trace of every handler run, by handler
+    """
+    traces = {}
+    trace = tracing.trace
+
+    @contextmanager
+    def recorded(interaction_id: str, handler: str):
+        with trace(interaction_id, handler) as current:
+            yield current
+        traces[handler] = current
+
+    monkeypatch.setattr(tracing, "trace", recorded)
+    return traces
+
+
+@pytest.fixture(name="guild_id")
+def fixture_guild_id(installed) -> str:  # pylint: disable=unused-argument
+    """
+    :return: A guild with a webhook that needs two stars
+    """
+    guild_id = new_id()
+    guilds.upsert_webhook(guild_id, "700000000000000001", "token")
+    guilds.update(guilds.get(guild_id), required_stars=2)
+    return guild_id
+
+
+def post(client, data: dict) -> dict:
+    """
+    Sends a signed interaction to the application
+
+    :return: The response's JSON
+    """
+    response = post_interaction(client, data)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
+
+
+def assert_budget(traces: dict, handler: str) -> None:
+    """Asserts that the handler ran at most its budget of statements"""
+    if len(traces[handler].queries) > tracing.QUERY_BUDGETS[handler]:
+        raise tracing.TooManyQueries(tracing.QUERY_BUDGETS[handler], traces[handler])
+
+
+def test_star_message(client, traces, guild_id):
+    """Starring a message with the context menu command"""
+    message_id = new_id()
+    message = {
+        "id": message_id,
+        "channel_id": CHANNEL_ID,
+        "author": {**USER, "id": new_id()},
+        "content": "A message worth a star",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "embeds": [],
+        "attachments": [],
+    }
+    data = {"id": "1", "name": "Star message", "type": 3, "target_id": message_id}
+    post(client, interaction(guild_id, 2, {**data, "resolved": {"messages": {message_id: message}}}))
+    assert_budget(traces, "Star message")
+
+
+@pytest.mark.parametrize("clicks", [1, 2, 3], ids=["star", "sends", "already_sent"])
+def test_star_button(client, traces, guild_id, installed, clicks):
+    """Clicking the star button, the click reaching the required stars queues the post"""
+    message_id = new_id()
+    messages.insert(messages.Message(id=message_id, guild_id=guild_id, author_id=new_id(), channel_id=CHANNEL_ID))
+    embeds = [{"type": "rich", "description": "A message worth a star", "footer": {"text": "Star it"}}]
+    message = {"id": new_id(), "channel_id": CHANNEL_ID, "content": "Starred", "embeds": embeds, "components": []}
+    for _ in range(clicks):
+        data = {"custom_id": f"star\n{message_id}\n1", "component_type": 2}
+        post(client, interaction(guild_id, 3, data, message={**message, "author": {**USER, "id": APPLICATION_ID}}))
+        assert_budget(traces, "star")
+    record = installed.message(message_id)
+    assert record["stars"] == min(clicks, 2) and record["flags"] & 1 == (clicks >= 2)
+
+
+def test_settings(client, traces, guild_id):
+    """Changing the settings"""
+    options = [{"name": "stars", "type": 4, "value": 4}, {"name": "allow_self_stars", "type": 5, "value": True}]
+    response = post(client, interaction(guild_id, 2, {"id": "2", "name": "settings", "type": 1, "options": options}))
+    assert response["type"] == 4
+    assert_budget(traces, "settings")
+
+
+def test_manual_autocomplete(client, traces, guild_id):
+    """Autocompleting a topic of the manual doesn't touch the database"""
+    options = [
+        {"name": "language", "type": 3, "value": "en-US"},
+        {"name": "topic", "type": 3, "value": "sett", "focused": True},
+    ]
+    response = post(client, interaction(guild_id, 4, {"id": "3", "name": "manual", "type": 1, "options": options}))
+    assert response["data"]["choices"]
+    assert_budget(traces, "manual:autocomplete")
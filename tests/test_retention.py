@@ -0,0 +1,47 @@
+"""
+Tests of the purge of expired messages
+"""
+from time import time
+
+from conftest import new_id
+
+import retention
+from resources import guilds, messages
+
+
+def message_from(days: float, guild_id: str) -> str:
+    """
+    :return: The id of a new message of the given age
+    """
+    message_id = str(messages.snowflake(time() - days * retention.DAY) + int(new_id()) % 4096)
+    messages.insert(messages.Message(id=message_id, guild_id=guild_id))
+    return message_id
+
+
+def test_purge(installed, monkeypatch):
+    """Messages expire by their guild's retention and the next purge starts after the purged ones"""
+    monkeypatch.setattr(retention, "_purged_below", 0)
+    now = time()
+    monkeypatch.setattr(retention, "time", lambda: now)
+    longer, default = new_id(), new_id()
+    guilds.upsert_webhook(longer, "1", "t")
+    guilds.update(guilds.get(longer), retention_days=60)
+    guilds.upsert_webhook(default, "1", "t")
+    expired = [message_from(100, longer), message_from(45, default)]
+    kept = message_from(45, longer)
+    retention.purge()
+    assert all(installed.message(message_id) is None for message_id in expired)
+    assert installed.message(kept) is not None
+    assert retention._purged_below == retention.expired_everywhere()  # pylint: disable=protected-access
+
+    scanned = []
+    candidates = installed.expired_candidates
+
+    def expired_candidates(after: int, below: int, limit: int) -> list[dict]:
+        scanned.append(after)
+        return candidates(after, below, limit)
+
+    monkeypatch.setattr(installed, "expired_candidates", expired_candidates)
+    retention.purge()
+    assert scanned[0] == retention.expired_everywhere() - 1
+    assert installed.message(kept) is not None
@@ -0,0 +1,26 @@
+"""
+Tests of the scheduler's shutdown
+"""
+from scheduler import Scheduler
+
+
+def test_shutdown_drains_pending_tasks():
+    """Pending tasks run on shutdown, recurring ones are dropped and nothing is scheduled afterwards"""
+    scheduler = Scheduler(2)
+    ran = []
+
+    @scheduler.task
+    def once(value: int) -> None:
+        ran.append(value)
+
+    @scheduler.task(recurring=True)
+    def again() -> None:
+        ran.append("again")
+        scheduler.schedule("again", 60, persist=False)
+
+    assert scheduler.schedule("once", 60, persist=False, value=1)
+    assert scheduler.schedule("again", 60, persist=False)
+    scheduler.shutdown()
+    assert ran == [1]
+    assert not scheduler.schedule("once", 0, persist=False, value=2)
+    assert scheduler.pending() == 0 and not scheduler._running  # pylint: disable=protected-access
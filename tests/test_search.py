@@ -0,0 +1,77 @@
+"""
+Tests of the ranking of the autocomplete search
+"""
+from types import SimpleNamespace
+
+import pytest
+
+import guide
+from search import SearchIndex
+
+DOCUMENTS = [
+    ("settings", "settings", "Which options a server can change"),
+    ("setting_things_up", "setting_things_up", "How to add the bot and pick a starboard channel"),
+    ("reset", "reset", "Clears the settings of a server"),
+    ("intro", "intro", "What the bot does with starred messages"),
+]
+
+
+@pytest.fixture(name="index")
+def fixture_index() -> SearchIndex:
+    """
+    :return: An index over a few guide like topics, some sharing a prefix
+    """
+    return SearchIndex(DOCUMENTS)
+
+
+def test_exact_then_prefix(index):
+    """An exact title is ranked first, then titles starting with the query"""
+    assert index.search("settings")[:2] == ["settings", "setting_things_up"]
+    assert index.search("sett")[:2] == ["settings", "setting_things_up"]
+
+
+def test_prefix_before_trigrams(index):
+    """Titles starting with the query rank ahead of titles that only share trigrams with it"""
+    results = index.search("set")
+    assert set(results[:2]) == {"settings", "setting_things_up"}
+    assert "reset" in results[2:]
+
+
+def test_word_prefix(index):
+    """A query matching the start of a later title word finds the document"""
+    assert index.search("things")[0] == "setting_things_up"
+
+
+def test_typos(index):
+    """Misspelled queries still find the document through trigrams"""
+    assert index.search("setings")[0] == "settings"
+    assert index.search("intor")[0] == "intro"
+
+
+def test_body(index):
+    """Words only found in the body still find the document"""
+    assert index.search("starboard") == ["setting_things_up"]
+
+
+def test_no_match(index):
+    """Queries sharing nothing with any document find nothing"""
+    assert not index.search("xyzzy")
+
+
+def test_limit():
+    """No more results than the limit are returned, whether the query is empty or not"""
+    index = SearchIndex((i, f"topic {i}", "") for i in range(40))
+    assert len(index.search("")) == 25
+    assert len(index.search("topic")) == 25
+    assert len(index.search("topic", limit=5)) == 5
+    assert index.search("", limit=3) == [0, 1, 10]
+
+
+@pytest.mark.parametrize("locale", ["", "xx"])
+def test_unknown_locale(monkeypatch, locale):
+    """The manual autocomplete suggests nothing for an empty or unknown locale"""
+    monkeypatch.setattr(guide, "_index", guide.load_index())
+    autocomplete = guide.guide_bp.autocomplete_handlers["manual"]
+    topic = SimpleNamespace(value="intro")
+    assert autocomplete(None, SimpleNamespace(value=locale), topic) == []
+    assert [choice.value for choice in autocomplete(None, SimpleNamespace(value="en-US"), topic)] == ["intro"]
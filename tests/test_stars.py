@@ -0,0 +1,54 @@
+"""
+Stress tests of concurrent star clicks on the same message
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import new_id
+from resources import messages
+
+CLICKS = 300
+
+
+def build_post() -> tuple[str, dict]:
+    """The starboard post of the test message"""
+    return "https://example.com/webhook", {"content": "post"}
+
+
+def queued(backend, message_id: str) -> int:
+    """
+    :return: Number of posts of the message in the outbox
+    """
+    posts = []
+    while page := backend.claim_posts(1000, 60):
+        posts += page
+    return sum(post["message_id"] == message_id for post in posts)
+
+
+def click(message_id: str, user_id: str, required_stars: int) -> messages.StarResult:
+    """A star button click"""
+    return messages.star(message_id, user_id, required_stars, build_post=build_post)
+
+
+def test_concurrent_clicks(installed):
+    """Every click of a different user counts and exactly one queues the post"""
+    message_id = new_id()
+    messages.insert(messages.Message(id=message_id, guild_id=new_id()))
+    with ThreadPoolExecutor(32) as executor:
+        results = list(executor.map(lambda user_id: click(message_id, str(user_id), CLICKS), range(CLICKS)))
+    assert all(result.added for result in results)
+    assert sum(result.claimed for result in results) == 1
+    assert installed.message(message_id)["stars"] == CLICKS
+    assert queued(installed, message_id) == 1
+
+
+def test_concurrent_repeated_clicks(installed):
+    """Repeated clicks of the same users count once"""
+    message_id = new_id()
+    messages.insert(messages.Message(id=message_id, guild_id=new_id()))
+    users = 20
+    with ThreadPoolExecutor(32) as executor:
+        results = list(executor.map(lambda click_id: click(message_id, str(click_id % users), users), range(CLICKS)))
+    assert sum(result.added for result in results) == users
+    assert sum(result.claimed for result in results) == 1
+    assert installed.message(message_id)["stars"] == users
+    assert queued(installed, message_id) == 1
@@ -0,0 +1,234 @@
+"""
+Conformance tests of the storage backends
+
+Every backend runs the same tests of what :class:`resources.storage.Backend` promises. The
+MySQL backend leaves its rows behind, so every test works on ids no earlier run used.
+"""
+import json
+import threading
+from time import sleep, time
+
+import pytest
+from conftest import new_id
+from resources.messages import MessageNotFound, snowflake
+
+
+def test_migrations(backend) -> None:
+    """Every migration is applied and applying them again changes nothing"""
+    backend.migrate()
+    status = backend.migrations()
+    assert status and all(applied for _, _, applied in status), status
+    assert [version for version, _, _ in status] == list(range(1, len(status) + 1))
+
+
+def test_guilds(backend) -> None:
+    """Guilds are added, their webhook replaced and their settings changed"""
+    guild_id = new_id()
+    assert backend.guild(guild_id) is None
+    backend.upsert_webhook(guild_id, "1", "first")
+    backend.upsert_webhook(guild_id, "2", "second")
+    record = backend.guild(guild_id)
+    assert record["id"] == guild_id and record["webhook_id"] == "2" and record["webhook_token"] == "second"
+    assert record["required_stars"] == 3 and record["flags"] == 0 and record["retention_days"] is None
+    backend.update_guild(guild_id, {"required_stars": 5}, set_flags=3)
+    record = backend.guild(guild_id)
+    assert record["required_stars"] == 5 and record["flags"] == 3
+    backend.update_guild(guild_id, {}, clear_flags=1)
+    backend.update_guild(guild_id, {}, set_flags=4)
+    assert backend.guild(guild_id)["flags"] == 6, "a flag change undid another"
+    other_id = new_id()
+    backend.insert_guild(
+        {
+            "id": other_id,
+            "webhook_id": "3",
+            "webhook_token": "t",
+            "required_stars": 2,
+            "flags": 1,
+            "retention_days": 40,
+        }
+    )
+    assert backend.guild(other_id)["retention_days"] == 40
+    assert not backend.insert_guild({"id": other_id, "webhook_id": "4", "webhook_token": "u"})
+    assert backend.guild(other_id)["webhook_id"] == "3"
+
+
+def test_messages(backend) -> None:
+    """Messages are only added once, together with the star of their author"""
+    message_id, guild_id = new_id(), new_id()
+    assert backend.message(message_id) is None
+    assert backend.insert_message({"id": message_id, "flags": 0, "stars": 1, "guild_id": guild_id}, star_user="7")
+    assert not backend.insert_message({"id": message_id, "flags": 0, "stars": 1, "guild_id": guild_id}, star_user="8")
+    assert backend.message(message_id) == {
+        "id": message_id,
+        "flags": 0,
+        "stars": 1,
+        "guild_id": guild_id,
+        "author_id": None,
+        "channel_id": None,
+    }
+    assert backend.has_starred(message_id, "7") and not backend.has_starred(message_id, "8")
+    backend.set_message_flags(message_id, 2)
+    backend.set_message_flags(message_id, 1)
+    assert backend.message(message_id)["flags"] == 3
+    backend.delete_message(message_id)
+    assert backend.message(message_id) is None and not backend.has_starred(message_id, "7")
+
+
+def test_stars(backend) -> None:
+    """Stars count once per user and the one reaching the threshold queues the post"""
+    message_id = new_id()
+    backend.insert_message({"id": message_id, "flags": 0, "stars": 0, "guild_id": new_id()})
+
+    def build_post():
+        return "https://example.com/webhook", json.dumps({"content": message_id})
+
+    assert backend.star(message_id, "1", 2, build_post) == {"added": True, "stars": 1, "sent": False, "claimed": False}
+    assert backend.star(message_id, "1", 2, build_post) == {"added": False, "stars": 1, "sent": False}
+    assert backend.star(message_id, "2", 2, build_post) == {"added": True, "stars": 2, "sent": True, "claimed": True}
+    assert backend.star(message_id, "3", 2, build_post) == {"added": False, "stars": 2, "sent": True}
+    assert backend.message(message_id)["flags"] & 1
+    with pytest.raises(MessageNotFound):
+        backend.star(new_id(), "1", 2, build_post)
+
+
+def test_concurrent_stars(backend) -> None:
+    """Concurrent stars of different users are all counted and only one claims the post"""
+    message_id = new_id()
+    backend.insert_message({"id": message_id, "flags": 0, "stars": 0, "guild_id": new_id()})
+    results = []
+
+    def click(user_id: int) -> None:
+        results.append(backend.star(message_id, str(user_id), 10, lambda: ("https://example.com/webhook", "{}")))
+
+    threads = [threading.Thread(target=click, args=(user_id,)) for user_id in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(result["added"] for result in results) == 10
+    assert sum(result.get("claimed", False) for result in results) == 1
+    assert backend.message(message_id)["stars"] == 10
+
+
+def test_outbox(backend) -> None:
+    """Queued posts are leased, retried, delivered or given up on"""
+    while backend.claim_posts(100, 60):
+        pass
+    message_id = new_id()
+    backend.insert_message({"id": message_id, "flags": 0, "stars": 0, "guild_id": new_id()})
+    backend.star(message_id, "1", 1, lambda: ("https://example.com/webhook", json.dumps({"content": "post"})))
+    depth = backend.outbox_depth()
+    [post] = backend.claim_posts(10, 60)
+    assert post["message_id"] == message_id and json.loads(post["payload"]) == {"content": "post"}
+    assert post["attempts"] == 0 and 0 <= float(post["age"]) < 60
+    assert backend.claim_posts(10, 60) == [], "a leased post was claimed again"
+    backend.reschedule_post(post["id"], 0, "HTTP 500")
+    [post] = backend.claim_posts(10, 60)
+    assert post["attempts"] == 1
+    backend.reschedule_post(post["id"], 0, "Rate limited", count_attempt=False)
+    [post] = backend.claim_posts(10, 60)
+    assert post["attempts"] == 1
+    backend.mark_delivered(post["id"])
+    assert backend.outbox_depth() == depth - 1
+
+
+def test_interactions(backend) -> None:
+    """Interactions are claimed once, and released ones can be claimed again"""
+    interaction_id = new_id()
+    assert backend.interaction_response(interaction_id) is None
+    assert backend.claim_interaction(interaction_id) and not backend.claim_interaction(interaction_id)
+    assert backend.interaction_response(interaction_id) is None
+    backend.release_interaction(interaction_id)
+    assert backend.claim_interaction(interaction_id)
+    backend.store_interaction_response(interaction_id, '{"type": 4}')
+    assert backend.interaction_response(interaction_id) == '{"type": 4}'
+    assert not backend.claim_interaction(interaction_id)
+    assert backend.purge_interactions(3600, 100) == 0 and backend.interaction_response(interaction_id)
+    sleep(0.01)
+    assert backend.purge_interactions(0, 100000) >= 1 and backend.interaction_response(interaction_id) is None
+
+
+def test_tasks(backend) -> None:
+    """Tasks are persisted and claimed once"""
+    task_id = backend.insert_task("delete_original", 12.5, json.dumps({"url": "https://example.com"}))
+    assert {"id": task_id, "name": "delete_original", "run_at": 12.5, "kwargs": '{"url": "https://example.com"}'} in (
+        backend.tasks()
+    )
+    assert backend.delete_task(task_id) and not backend.delete_task(task_id)
+
+
+def test_pages(backend) -> None:
+    """Imports skip existing rows and pages continue after the previous page's last row"""
+    base = int(new_id())
+    message_ids = [str(base + offset) for offset in range(7)]
+    records = [{"id": message_id, "flags": 0, "stars": 2, "guild_id": "1"} for message_id in message_ids]
+    assert backend.import_messages(records[:4]) == 4
+    assert backend.import_messages(records) == 3
+    votes = [{"message_id": message_id, "user_id": str(user_id)} for message_id in message_ids for user_id in (2, 1)]
+    assert backend.import_votes(votes) == 14 and backend.import_votes(votes[:3]) == 0
+    seen, after = [], str(base - 1)
+    while page := backend.message_page(after, 3):
+        seen += [record["id"] for record in page if record["id"] in message_ids]
+        after = page[-1]["id"]
+    assert seen == message_ids
+    seen, after = [], (str(base - 1), "0")
+    while page := backend.vote_page(after, 4):
+        seen += [(record["message_id"], record["user_id"]) for record in page if record["message_id"] in message_ids]
+        after = page[-1]["message_id"], page[-1]["user_id"]
+    assert seen == [(message_id, user_id) for message_id in message_ids for user_id in ("1", "2")]
+    guild_ids = [str(base + offset) for offset in range(3)]
+    settings = {"webhook_id": "1", "webhook_token": "t", "required_stars": 3, "flags": 0, "retention_days": None}
+    guild_records = [{"id": guild_id, **settings} for guild_id in guild_ids]
+    assert backend.import_guilds(guild_records) == 3
+    page = backend.guild_page(str(base), 2)
+    assert [record["id"] for record in page] == guild_ids[1:]
+
+
+def test_stats(backend) -> None:
+    """Stars, posts and purges change the statistics, which a rebuild recounts to the same numbers"""
+    guild_id, author_id = new_id(), new_id()
+    other_id = str(int(author_id) + 1)
+
+    def build_post():
+        return "https://example.com/webhook", "{}"
+
+    first, second, third = (str(int(guild_id) + offset) for offset in range(3))
+    record = {"flags": 0, "stars": 1, "guild_id": guild_id, "author_id": author_id, "channel_id": "9"}
+    backend.insert_message({**record, "id": first}, star_user="1")
+    backend.insert_message({**record, "id": second}, star_user="1")
+    backend.insert_message({**record, "id": third, "author_id": other_id}, star_user="1")
+    backend.star(first, "2", 2, build_post)
+    backend.star(first, "3", 2, build_post)
+    backend.set_message_flags(second, 1)
+    backend.set_message_flags(second, 1)
+    board = backend.leaderboard(guild_id, 10)
+    assert [(record["id"], record["stars"]) for record in board["messages"]] == [(first, 2), (third, 1), (second, 1)]
+    assert board["messages"][0]["channel_id"] == "9"
+    expected = [{"user_id": author_id, "stars": 3, "posts": 2}, {"user_id": other_id, "stars": 1, "posts": 0}]
+    assert board["users"] == expected, board["users"]
+    assert backend.leaderboard(guild_id, 1)["users"] == expected[:1]
+    assert backend.rebuild_stats(guild_id) == 2 and backend.leaderboard(guild_id, 10)["users"] == expected
+    backend.delete_messages([first])
+    assert backend.leaderboard(guild_id, 10)["users"] == [
+        {"user_id": other_id, "stars": 1, "posts": 0},
+        {"user_id": author_id, "stars": 1, "posts": 1},
+    ]
+    backend.import_votes([{"message_id": second, "user_id": "4"}])
+    backend.rebuild_stats(guild_id)
+    assert backend.leaderboard(guild_id, 1)["users"] == [{"user_id": author_id, "stars": 2, "posts": 1}]
+
+
+def test_retention(backend) -> None:
+    """Expired candidates are found in id order with their guild's retention"""
+    guild_id = new_id()
+    backend.upsert_webhook(guild_id, "1", "t")
+    backend.update_guild(guild_id, {"retention_days": 60})
+    assert backend.longest_retention() >= 60
+    old = int(snowflake(time() - 400 * 24 * 60 * 60))
+    ids = [str(old + offset) for offset in (3, 1, 2)]
+    for message_id in ids:
+        backend.insert_message({"id": message_id, "flags": 0, "stars": 1, "guild_id": guild_id}, star_user="5")
+    records = backend.expired_candidates(old, old + 10, 10)
+    assert [record["id"] for record in records] == sorted(ids)
+    assert all(record["retention_days"] == 60 for record in records)
+    assert backend.delete_messages(ids) == (3, 3)
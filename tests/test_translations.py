@@ -0,0 +1,92 @@
+"""
+Tests of the request scoped locale and the fallback of missing translations
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+import pytest
+
+import translations
+from translations import get_locale, localizations, set_locale, t
+
+
+@pytest.fixture(name="partial")
+def fixture_partial(monkeypatch, tmp_path):
+    """
+    Loads an English catalog and a German one lacking one of its keys, the real catalog is restored afterwards
+    """
+    monkeypatch.setattr(translations, "_catalog", None)
+    monkeypatch.setattr(translations, "_localizations", None)
+    (tmp_path / "en-US.yml").write_text(
+        "greeting: Hello %{name}\nsettings:\n  success: Saved\n  only_english: Only in English\n", encoding="utf8"
+    )
+    (tmp_path / "de.yml").write_text("greeting: Hallo %{name}\nsettings:\n  success: Gespeichert\n", encoding="utf8")
+    translations.load(str(tmp_path))
+
+
+def test_concurrent_requests():
+    """Requests handled at the same time in different threads each keep their own locale"""
+    barrier = threading.Barrier(2)
+    seen = {}
+
+    def request(locale: str) -> None:
+        set_locale(locale)
+        barrier.wait()
+        seen[locale] = get_locale(), t("settings.success")
+
+    threads = [threading.Thread(target=request, args=(locale,)) for locale in ("de", "en-US")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == {
+        "de": ("de", t("settings.success", locale="de")),
+        "en-US": ("en-US", t("settings.success", locale="en-US")),
+    }
+    assert t("settings.success", locale="de") != t("settings.success", locale="en-US")
+
+
+def test_deferred_executor():
+    """A deferred command sees the locale of its request, and what it sets doesn't leak back or into other commands"""
+
+    def request() -> tuple:
+        set_locale("de")
+        with ThreadPoolExecutor(1) as executor:
+            deferred = executor.submit(copy_context().run, get_locale).result()
+            executor.submit(copy_context().run, set_locale, "en-US").result()
+            after = get_locale()
+            bare = executor.submit(get_locale).result()
+        return deferred, after, bare
+
+    before = get_locale()
+    assert copy_context().run(request) == ("de", "de", "en-US")
+    assert get_locale() == before
+
+
+def test_unknown_locale():
+    """Unknown locales fall back to the default one"""
+
+    def request() -> str:
+        set_locale("xx")
+        return get_locale()
+
+    assert copy_context().run(request) == translations.config.I18n.FALLBACK
+    assert t("settings.success", locale="xx") == t("settings.success", locale="en-US")
+
+
+@pytest.mark.usefixtures("partial")
+def test_missing_keys():
+    """Keys missing from a locale are filled in from the fallback locale"""
+    assert localizations("settings.success") == {"en-US": "Saved", "de": "Gespeichert"}
+    assert localizations("settings.only_english") == {"en-US": "Only in English", "de": "Only in English"}
+    assert localizations("greeting") == {"en-US": "Hello %{name}", "de": "Hallo %{name}"}
+    assert t("settings.only_english", locale="de") == "Only in English"
+    assert t("greeting", locale="de", name="Ada") == "Hallo Ada"
+
+
+@pytest.mark.usefixtures("partial")
+def test_unknown_keys():
+    """Keys no locale has get no localizations and translate to themselves"""
+    assert not localizations("settings.nothing")
+    assert t("settings.nothing", locale="de") == "settings.nothing"